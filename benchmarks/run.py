@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""PixelShield benchmarks: KDF latency, cipher and file throughput, peak RSS, batch and CLI start-up.
+
+Run from the repository root:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json --threshold 0.15
+
+Every file case runs in a fresh child process, so its peak RSS and timings
+are not skewed by earlier cases. With `--baseline`, metrics that got worse by
+more than `--threshold` are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from tools.batch import decrypt_directory, encrypt_directory  # noqa: E402
+from tools.image_utils import (  # noqa: E402
+    FIELD_KDF, KeySession, decrypt_image, derive_key, encrypt_image, read_header,
+)
+from tools.suites import Scrypt, cipher_report, unpack_kdf  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+# (name, format, width, height): from KB thumbnails to a large uncompressed scan
+IMAGES = [
+    ('thumbnail', 'JPEG', 256, 256),
+    ('photo', 'JPEG', 4000, 3000),
+    ('screenshot', 'PNG', 1920, 1080),
+    ('tiff', 'TIFF', 3000, 2000),
+]
+SCAN_MB = {'quick': 64, 'full': 2048}
+PASSWORD = 'benchmark password'
+BATCH_FILES = {'quick': 200, 'full': 1000}
+
+# Whether a larger value of a metric is an improvement, by unit
+_HIGHER_IS_BETTER = {'MB/s': True, 'files/s': True, 'ms': False, 'MB': False}
+
+
+def _gradient(width: int, rows: range, rng) -> np.ndarray:
+    """Rows of a smooth colour gradient with mild noise, like a photo or scan."""
+    x = np.arange(width, dtype=np.uint32)
+    y = np.arange(rows.start, rows.stop, dtype=np.uint32)[:, None]
+    pixels = np.empty((len(rows), width, 3), dtype=np.uint8)
+    pixels[..., 0] = (x * 255 // max(width - 1, 1)).astype(np.uint8)
+    pixels[..., 1] = (y * 7 % 256).astype(np.uint8)
+    pixels[..., 2] = ((x + y) % 256).astype(np.uint8)
+    pixels += rng.integers(0, 16, pixels.shape, dtype=np.uint8)
+    return pixels
+
+
+def make_image(path: str, image_format: str, width: int, height: int, seed: int = 0):
+    """Write a synthetic image with Pillow."""
+    rng = np.random.default_rng(seed)
+    Image.fromarray(_gradient(width, range(height), rng)).save(path, image_format)
+
+
+def make_scan(path: str, size_mb: int, width: int = 8000, seed: int = 0):
+    """Stream a 24-bit BMP of about `size_mb` MiB to disk, a block of rows at a time."""
+    rng = np.random.default_rng(seed)
+    row_size = width * 3  # A multiple of 4, so rows need no padding
+    height = max(1, size_mb * 1024 * 1024 // row_size)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<2sIHHI', b'BM', 54 + row_size * height, 0, 0, 54))
+        f.write(struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, row_size * height, 2835, 2835, 0, 0))
+        for start in range(0, height, 256):
+            f.write(_gradient(width, range(start, min(start + 256, height)), rng).tobytes())
+
+
+def _peak_rss_mb() -> dict:
+    """Peak resident set size of this process and of its (finished) children, in MiB."""
+    if resource is None:
+        return {}
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024  # bytes on macOS, KiB elsewhere
+    peak = {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor,
+    }
+    # Linux carries ru_maxrss over from the forking parent, VmHWM starts afresh at exec
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak['self'] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak
+
+
+def run_child(case: dict) -> dict:
+    """Run one timed case in this (fresh) process."""
+    if case['kind'] in ('encrypt', 'decrypt'):
+        session = KeySession(PASSWORD)
+        # Key derivation is measured on its own, so derive the key before the clock starts
+        if case['kind'] == 'encrypt':
+            run = encrypt_image
+            session.master_key()
+        else:
+            run = decrypt_image
+            with open(case['input'], 'rb') as f:
+                kdf, salt = unpack_kdf(dict(read_header(f))[FIELD_KDF])
+            session.master_key(salt, kdf)
+        start = time.perf_counter()
+        run(case['input'], case['output'], PASSWORD, session=session)
+        elapsed = time.perf_counter() - start
+    else:
+        run = encrypt_directory if case['kind'] == 'encrypt-dir' else decrypt_directory
+        start = time.perf_counter()
+        result = run(case['input'], case['output'], PASSWORD)
+        elapsed = time.perf_counter() - start
+        if result.failures:
+            raise RuntimeError(f"{len(result.failures)} file(s) failed: {result.failures[0]}")
+    return {'seconds': elapsed, 'peak_rss_mb': _peak_rss_mb()}
+
+
+def _spawn(case: dict) -> dict:
+    output = subprocess.run([sys.executable, __file__, '--child', json.dumps(case)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def _metric(results: dict, name: str, value: float, unit: str):
+    results[name] = {'value': round(value, 3), 'unit': unit}
+    print(f"  {name:<42} {value:>12.2f} {unit}")
+
+
+def bench_kdf(results: dict, repeat: int):
+    print("Key derivation")
+    salt = os.urandom(16)
+    for name, derive in (('kdf.pbkdf2.latency', lambda: derive_key('benchmark', salt)),
+                         ('kdf.scrypt.latency', lambda: Scrypt().derive('benchmark', salt))):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            derive()
+            timings.append(time.perf_counter() - start)
+        _metric(results, name, statistics.median(timings) * 1000, 'ms')
+
+
+def bench_ciphers(results: dict):
+    print("Ciphers (in memory)")
+    for cipher, rate in cipher_report():
+        _metric(results, f'cipher.{cipher.name}.throughput', rate, 'MB/s')
+
+
+def bench_files(results: dict, workdir: str, profile: str, repeat: int):
+    print("Single files (fresh process per run)")
+    files = []
+    for name, image_format, width, height in IMAGES:
+        path = os.path.join(workdir, f'{name}.{image_format.lower()}')
+        make_image(path, image_format, width, height)
+        files.append((name, path))
+    path = os.path.join(workdir, 'scan.bmp')
+    make_scan(path, SCAN_MB[profile])
+    files.append(('scan', path))
+
+    for name, path in files:
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        encrypted = os.path.join(workdir, f'{name}.bin')
+        for kind, source, target in (('encrypt', path, encrypted), ('decrypt', encrypted, encrypted + '.out')):
+            runs = [_spawn({'kind': kind, 'input': source, 'output': target}) for _ in range(repeat)]
+            best = min(run['seconds'] for run in runs)
+            _metric(results, f'file.{name}.{kind}.throughput', size_mb / best, 'MB/s')
+            rss = [run['peak_rss_mb']['self'] for run in runs if run['peak_rss_mb']]
+            if rss:
+                _metric(results, f'file.{name}.{kind}.peak_rss', max(rss), 'MB')
+
+
+def bench_batch(results: dict, workdir: str, profile: str):
+    print("Directory batches")
+    source = os.path.join(workdir, 'batch')
+    os.makedirs(source)
+    for index in range(BATCH_FILES[profile]):
+        image_format = 'JPEG' if index % 2 else 'PNG'
+        make_image(os.path.join(source, f'{index:05}.{image_format.lower()}'), image_format, 320, 240, index)
+
+    encrypted = os.path.join(workdir, 'batch-encrypted')
+    for kind, input_dir, output_dir in (('encrypt-dir', source, encrypted),
+                                        ('decrypt-dir', encrypted, os.path.join(workdir, 'batch-decrypted'))):
+        run = _spawn({'kind': kind, 'input': input_dir, 'output': output_dir})
+        _metric(results, f'batch.{kind}.files_per_second', BATCH_FILES[profile] / run['seconds'], 'files/s')
+        if run['peak_rss_mb']:
+            _metric(results, f'batch.{kind}.peak_rss', run['peak_rss_mb']['self'] + run['peak_rss_mb']['children'], 'MB')
+
+
+def bench_cli(results: dict, repeat: int):
+    print("CLI")
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(ROOT / 'pixel_shield.py'), 'formats'],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    _metric(results, 'cli.cold_start', statistics.median(timings) * 1000, 'ms')
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Print the change of every metric against `baseline`; return the regressions."""
+    print(f"\nComparison with baseline (threshold {threshold:.0%})")
+    regressions = []
+    for name, metric in results.items():
+        old = baseline.get(name)
+        if old is None or not old['value']:
+            continue
+        change = (metric['value'] - old['value']) / old['value']
+        worse = -change if _HIGHER_IS_BETTER[metric['unit']] else change
+        flag = 'REGRESSION' if worse > threshold else ''
+        print(f"  {name:<42} {old['value']:>10.2f} -> {metric['value']:>10.2f} {metric['unit']:<8} {change:+7.1%} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PixelShield.')
+    parser.add_argument('--profile', choices=sorted(SCAN_MB), default='quick',
+                        help=f"quick: {SCAN_MB['quick']} MiB scan, full: {SCAN_MB['full']} MiB scan and larger batches")
+    parser.add_argument('--only', nargs='+', choices=['kdf', 'cipher', 'files', 'batch', 'cli'],
+                        help='Run only these groups')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (default: 3)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown reported as a regression (default: 0.10)')
+    parser.add_argument('--workdir', help='Directory for the generated images (default: a temporary one)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return
+
+    groups = set(args.only or ['kdf', 'cipher', 'files', 'batch', 'cli'])
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        if 'kdf' in groups:
+            bench_kdf(results, args.repeat)
+        if 'cipher' in groups:
+            bench_ciphers(results)
+        if 'files' in groups:
+            bench_files(results, workdir, args.profile, args.repeat)
+        if 'batch' in groups:
+            bench_batch(results, workdir, args.profile)
+        if 'cli' in groups:
+            bench_cli(results, args.repeat)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'profile': args.profile,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,19 @@ from pathlib import Path
 import webbrowser
 import os
 import ctypes
-from tools.image_utils import encrypt_image, decrypt_image, is_supported_image
+import queue
+import threading
+from tools.image_utils import is_supported_image
+from tools.batch import decryption_tasks, encryption_tasks, output_name
+from tools.scheduler import CANCELLED, DONE, FAILED, PENDING, RUNNING, JobScheduler
+
+# How often the Tk main loop drains job updates posted by the scheduler (ms)
+POLL_INTERVAL = 100
+
+# Besides job updates, `events` carries (kind, value) messages from the threads that queue files
+EVENT_QUEUED = 'queued'  # A job was submitted; its row is added to the queue view
+EVENT_SKIPPED = 'skipped'  # Number of unsupported files that were not queued
+EVENT_QUEUE_FAILED = 'queue-failed'  # Error that stopped a folder or file selection from being queued
 
 
 class PixelShieldApp(tk.Tk):
@@ -13,11 +25,16 @@ class PixelShieldApp(tk.Tk):
 
         # Configure the main window
         self.title("PixelShield - Secure Image Encryption")
-        self.geometry("800x600")
-        self.minsize(700, 500)
+        self.geometry("900x750")
+        self.minsize(750, 600)
 
         # Initialize state
         self.mode = "encrypt"
+        self.events = queue.Queue()
+        self.current_job = None  # Job started with the Process button
+        self.job_rows = {}  # Job id -> queue view item
+        # Job updates arrive on worker threads and are applied to the widgets in poll_events
+        self.scheduler = JobScheduler(on_update=lambda job: self.events.put(job))
         self.dark_mode = self.detect_system_theme()  # Detect system theme
 
         # Apply styles
@@ -29,8 +46,12 @@ class PixelShieldApp(tk.Tk):
         self.create_header()
         self.create_mode_selection()
         self.create_file_selection()
+        self.create_queue_view()
         self.create_footer()
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(POLL_INTERVAL, self.poll_events)
+
     def detect_system_theme(self):
         """Detect the system theme (dark or light)."""
         if os.name == "nt":  # Windows
@@ -97,7 +118,7 @@ class PixelShieldApp(tk.Tk):
         file_menu.add_command(label="Encrypt", command=lambda: self.set_mode("encrypt"))
         file_menu.add_command(label="Decrypt", command=lambda: self.set_mode("decrypt"))
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.quit)
+        file_menu.add_command(label="Exit", command=self.on_close)
 
         # View menu
         view_menu = tk.Menu(menu_bar, tearoff=0)
@@ -135,7 +156,7 @@ class PixelShieldApp(tk.Tk):
     def create_file_selection(self):
         """Create the file selection section."""
         file_frame = ttk.Frame(self, padding=(10, 10))
-        file_frame.pack(fill="both", expand=True, pady=(10, 0))
+        file_frame.pack(fill="x", pady=(10, 0))
 
         # Input file selection
         ttk.Label(file_frame, text="Input File:").grid(row=0, column=0, sticky="w", pady=5)
@@ -159,8 +180,49 @@ class PixelShieldApp(tk.Tk):
         self.progress_bar = ttk.Progressbar(file_frame, length=400, mode="determinate")
         self.progress_bar.grid(row=3, column=0, columnspan=3, pady=10)
 
-        # Process button
-        ttk.Button(file_frame, text="Process", command=self.process_file).grid(row=4, column=0, columnspan=3, pady=10)
+        # Process and Cancel buttons
+        button_frame = ttk.Frame(file_frame)
+        button_frame.grid(row=4, column=0, columnspan=3, pady=10)
+        self.process_button = ttk.Button(button_frame, text="Process", command=self.process_file)
+        self.process_button.pack(side="left", padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel_processing, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+
+    def create_queue_view(self):
+        """Create the job queue section for processing many files at once."""
+        queue_frame = ttk.Frame(self, padding=(10, 0))
+        queue_frame.pack(fill="both", expand=True)
+
+        # Output folder for queued files
+        ttk.Label(queue_frame, text="Queue Output Folder:").grid(row=0, column=0, sticky="w", pady=5)
+        self.queue_output = ttk.Entry(queue_frame, width=50)
+        self.queue_output.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        ttk.Button(queue_frame, text="Browse", command=self.browse_queue_output).grid(row=0, column=2, padx=5, pady=5)
+
+        # Job list
+        columns = ("file", "mode", "status", "progress")
+        self.queue_tree = ttk.Treeview(queue_frame, columns=columns, show="headings", height=8)
+        for column, heading, width in zip(columns, ("File", "Mode", "Status", "Progress"), (420, 80, 200, 80)):
+            self.queue_tree.heading(column, text=heading)
+            self.queue_tree.column(column, width=width, anchor="w")
+        self.queue_tree.grid(row=1, column=0, columnspan=3, sticky="nsew")
+        scrollbar = ttk.Scrollbar(queue_frame, orient="vertical", command=self.queue_tree.yview)
+        scrollbar.grid(row=1, column=3, sticky="ns")
+        self.queue_tree.configure(yscrollcommand=scrollbar.set)
+        queue_frame.columnconfigure(1, weight=1)
+        queue_frame.rowconfigure(1, weight=1)
+
+        # Queue actions
+        button_frame = ttk.Frame(queue_frame)
+        button_frame.grid(row=2, column=0, columnspan=3, pady=10)
+        ttk.Button(button_frame, text="Add Files", command=self.add_files).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Add Folder", command=self.add_folder).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Retry Failed", command=self.retry_failed).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Cancel All", command=self.scheduler.cancel_all).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Clear Finished", command=self.clear_finished).pack(side="left", padx=5)
+
+        self.queue_stats = ttk.Label(queue_frame, text="Queue empty")
+        self.queue_stats.grid(row=3, column=0, columnspan=3, sticky="w")
 
     def create_footer(self):
         """Create the footer section."""
@@ -200,6 +262,97 @@ class PixelShieldApp(tk.Tk):
             self.output_path.delete(0, tk.END)
             self.output_path.insert(0, file_path)
 
+    def browse_queue_output(self):
+        """Browse for the folder that receives queued outputs."""
+        directory = filedialog.askdirectory(title="Select Output Folder")
+        if directory:
+            self.queue_output.delete(0, tk.END)
+            self.queue_output.insert(0, directory)
+
+    def queue_settings(self):
+        """Return the password and output folder for queued jobs, or None after showing an error."""
+        password = self.password_input.get().strip()
+        output_dir = self.queue_output.get().strip()
+        if not password:
+            messagebox.showerror("Error", "Please enter a password.")
+            return None
+        if not output_dir:
+            messagebox.showerror("Error", "Please select a queue output folder.")
+            return None
+        return password, output_dir
+
+    def add_files(self):
+        """Queue one or more files in the current mode."""
+        settings = self.queue_settings()
+        if settings is None:
+            return
+        password, output_dir = settings
+        paths = filedialog.askopenfilenames(title="Select Files")
+        mode = self.mode
+
+        def tasks():
+            skipped = 0
+            for path in paths:
+                if mode == "encrypt" and not is_supported_image(path)[0]:
+                    skipped += 1
+                    continue
+                yield path, os.path.join(output_dir, output_name(path, mode))
+            if skipped:
+                self.events.put((EVENT_SKIPPED, skipped))
+
+        self.queue_in_background(mode, password, tasks())
+
+    def add_folder(self):
+        """Queue every eligible file of a folder tree, mirroring it into the output folder."""
+        settings = self.queue_settings()
+        if settings is None:
+            return
+        password, output_dir = settings
+        folder = filedialog.askdirectory(title="Select Folder")
+        if not folder:
+            return
+        tasks = encryption_tasks if self.mode == "encrypt" else decryption_tasks
+        self.queue_in_background(self.mode, password,
+                                 tasks(folder, os.path.join(output_dir, os.path.basename(folder))))
+
+    def queue_in_background(self, mode, password, tasks):
+        """Submit the (input, output) pairs of `tasks` from a worker thread.
+
+        Walking folders and sniffing files happens there too, so large folders
+        don't freeze the window; poll_events adds a row for each posted job.
+        """
+        def submit_all():
+            try:
+                for input_path, output_path in tasks:
+                    self.events.put((EVENT_QUEUED, self.scheduler.submit(mode, input_path, output_path, password)))
+            except Exception as e:
+                self.events.put((EVENT_QUEUE_FAILED, str(e)))
+
+        threading.Thread(target=submit_all, daemon=True).start()
+
+    def submit_job(self, input_path, output_path, password):
+        """Hand a file to the scheduler and add its row to the queue view."""
+        job = self.scheduler.submit(self.mode, input_path, output_path, password)
+        self.add_job_row(job)
+        return job
+
+    def add_job_row(self, job):
+        """Add a row for `job` to the queue view, showing its current state."""
+        self.job_rows[job.id] = self.queue_tree.insert("", "end", values=(job.input_path, job.mode, job.status, "0%"))
+        self.update_job_row(job)
+
+    def retry_failed(self):
+        """Queue every failed or cancelled job again."""
+        for job in list(self.scheduler.jobs):
+            if job.status in (FAILED, CANCELLED):
+                self.scheduler.retry(job)
+
+    def clear_finished(self):
+        """Remove completed jobs from the queue view."""
+        for job in list(self.scheduler.jobs):
+            if job.status == DONE and job.id in self.job_rows:
+                self.queue_tree.delete(self.job_rows.pop(job.id))
+
     def toggle_password_visibility(self):
         """Toggle the visibility of the password input."""
         if self.password_input.cget("show") == "*":
@@ -225,31 +378,106 @@ class PixelShieldApp(tk.Tk):
             if not messagebox.askyesno("Weak Password", "Your password is less than 8 characters. Do you want to continue?"):
                 return
 
+        if self.mode == "encrypt":
+            valid, error_msg = is_supported_image(input_path)
+            if not valid:
+                messagebox.showerror("Error", error_msg)
+                return
+
         self.status_label.config(text="Processing... Please wait")
-        self.progress_bar["value"] = 10
-        self.update_idletasks()
+        self.progress_bar["value"] = 0
+        self.process_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
 
+        # The job runs on the scheduler's worker pool; poll_events applies its updates
+        self.current_job = self.submit_job(input_path, output_path, password)
+
+    def poll_events(self):
+        """Apply job updates and messages posted by worker threads, then refresh the queue statistics."""
+        updated = {}
+        messages = []
         try:
-            if self.mode == "encrypt":
-                valid, error_msg = is_supported_image(input_path)
-                if not valid:
-                    messagebox.showerror("Error", error_msg)
-                    self.status_label.config(text="Ready")
-                    self.progress_bar["value"] = 0
-                    return
-
-                encrypt_image(input_path, output_path, password)
-                messagebox.showinfo("Success", f"Image encrypted successfully.\nSaved to: {output_path}")
-            else:
-                decrypt_image(input_path, output_path, password)
-                messagebox.showinfo("Success", f"Image decrypted successfully.\nSaved to: {output_path}")
+            while True:
+                event = self.events.get_nowait()
+                if isinstance(event, tuple):
+                    messages.append(event)
+                else:
+                    updated[event.id] = event  # Only the latest state of each job matters
+        except queue.Empty:
+            pass
+
+        # Rows show the live job, so updates that arrived before their row are not lost
+        for kind, value in messages:
+            if kind == EVENT_QUEUED:
+                self.add_job_row(value)
+            elif kind == EVENT_SKIPPED:
+                messagebox.showwarning("Skipped Files", f"{value} unsupported file(s) were not queued.")
+            elif kind == EVENT_QUEUE_FAILED:
+                messagebox.showerror("Error", f"Could not queue files: {value}")
+
+        for job in updated.values():
+            self.update_job_row(job)
+            if job is self.current_job:
+                self.update_current_job(job)
+        self.update_queue_stats()
+        self.after(POLL_INTERVAL, self.poll_events)
+
+    def update_job_row(self, job):
+        """Show the status and progress of a job in the queue view."""
+        row = self.job_rows.get(job.id)
+        if row is None:
+            return
+        status = f"{job.status}: {job.error}" if job.status == FAILED else job.status
+        percent = 100 * job.done_bytes // job.size if job.size else (100 if job.status == DONE else 0)
+        self.queue_tree.item(row, values=(job.input_path, job.mode, status, f"{percent}%"))
+
+    def update_current_job(self, job):
+        """Drive the progress bar and messages for the job started with Process."""
+        if job.status in (PENDING, RUNNING):
+            self.progress_bar["value"] = 100 * job.done_bytes / job.size if job.size else 0
+            return
 
+        self.current_job = None
+        self.process_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        if job.status == DONE:
             self.progress_bar["value"] = 100
             self.status_label.config(text="Operation completed successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Operation failed: {str(e)}")
-            self.status_label.config(text="Operation failed.")
+            messagebox.showinfo("Success", f"Image {job.mode}ed successfully.\nSaved to: {job.output_path}")
+        elif job.status == CANCELLED:
+            self.progress_bar["value"] = 0
+            self.status_label.config(text="Operation cancelled.")
+        else:
             self.progress_bar["value"] = 0
+            self.status_label.config(text="Operation failed.")
+            messagebox.showerror("Error", f"Operation failed: {job.error}")
+
+    def update_queue_stats(self):
+        """Show job counts, throughput and the estimated time remaining."""
+        jobs = self.scheduler.jobs
+        if not jobs:
+            return
+        counts = {status: 0 for status in (PENDING, RUNNING, DONE, FAILED, CANCELLED)}
+        for job in jobs:
+            counts[job.status] += 1
+        text = ", ".join(f"{count} {status}" for status, count in counts.items() if count)
+        text += f"  |  {self.scheduler.throughput() / (1024 * 1024):.1f} MB/s"
+        if counts[PENDING] or counts[RUNNING]:
+            eta = self.scheduler.eta()
+            text += f"  |  ETA {int(eta // 60)}:{int(eta % 60):02d}" if eta is not None else "  |  ETA --:--"
+        self.queue_stats.config(text=text)
+
+    def cancel_processing(self):
+        """Ask the running job to stop; its partial output is removed by the crypto layer."""
+        if self.current_job is not None:
+            self.scheduler.cancel(self.current_job)
+            self.cancel_button.config(state="disabled")
+            self.status_label.config(text="Cancelling...")
+
+    def on_close(self):
+        """Stop outstanding jobs and close the window."""
+        self.scheduler.shutdown(cancel=True)
+        self.destroy()
 
     def open_github(self):
         """Open the GitHub repository."""
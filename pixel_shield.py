@@ -1,8 +1,29 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import sys
+import time
 from pathlib import Path
-from tools.image_utils import encrypt_image, decrypt_image, is_supported_image, SUPPORTED_FORMATS
+import os
+from contextlib import ExitStack, nullcontext
+from tools.image_utils import (
+    STAGE_CIPHER, STAGE_COMPRESS, STAGE_DECOMPRESS, STAGE_KDF, STAGE_PREVIEW, STAGE_READ, STAGE_TRIAL,
+    STAGE_WRITE, atomic_output, collect_metrics, decrypt_preview, decrypt_stream, encrypt_stream, rekey_image, verify_image,
+    is_supported_image, SUPPORTED_FORMATS,
+)
+from tools.scheduler import run_job
+from tools.compression import AUTO, NONE, available_codecs
+from tools.batch import (
+    VERIFY_STATUSES, encrypt_directory, decrypt_directory, output_name, rekey_directory,
+    verify_directory, verify_status,
+)
+from tools.sync import sync_directory
+from tools.suites import (
+    AUTO as AUTO_CIPHER, CIPHER_NAMES, KDF_NAMES, calibrate_kdf, cipher_report, describe_kdf, make_kdf,
+    preferred_cipher,
+)
+from tools.pixel_crypto import encrypt_pixels, decrypt_pixels
+from tools.archive import collect_files, extract_member, list_archive, pack_archive, unpack_archive
 from gui.main_window import PixelShieldApp as PixelShieldGUI  # Import the GUI application
 
 # Add the parent directory to the Python path
@@ -16,6 +37,16 @@ GREEN = '\033[92m'
 YELLOW = '\033[93m'
 RED = '\033[91m'
 
+COMPRESSION_CHOICES = [AUTO, NONE] + available_codecs()
+
+# Path meaning stdin (for --input) or stdout (for --output)
+STDIO = '-'
+
+STATS_FORMATS = ['text', 'json']
+# Pipeline order of the stages in --stats output
+STAGE_ORDER = [STAGE_KDF, STAGE_PREVIEW, STAGE_TRIAL, STAGE_READ, STAGE_COMPRESS, STAGE_DECOMPRESS, STAGE_CIPHER,
+               STAGE_WRITE]
+
 
 def print_banner():
     """Print a colorful banner for the application."""
@@ -28,30 +59,310 @@ def print_banner():
 {GREEN}                ╚═╝     ╚═╝╚═╝  ╚═╝╚══════╝╚══════╝╚══════╝╚═╝  ╚═╝╚══════╝╚══════╝╚═════╝{END}
 {CYAN}                                     Secure Image Encryption Tool                                {END}
 {CYAN}                                        Version 1.0.0 - 2025                                     {END}
-""")
+""", file=sys.stderr)
+
+
+def describe_output(path):
+    """Name an output for status messages."""
+    return 'stdout' if path == STDIO else path
+
+
+def suite_options(args, cipher=True):
+    """Build the `kdf` (and `cipher`) options from --kdf, --kdf-cost and --cipher."""
+    options = {'kdf': make_kdf(args.kdf, args.kdf_cost)}
+    if cipher:
+        options['cipher'] = args.cipher
+    return options
+
+
+def stats_collector(args):
+    """Collect per-stage metrics while a command runs if --stats was given."""
+    return collect_metrics() if args.stats else nullcontext()
+
+
+def stats_report(stats, elapsed):
+    """JSON-ready form of the metrics collected by `stats_collector`."""
+    return {'elapsed': round(elapsed, 6), **stats.as_dict()}
+
+
+def print_stats(args, stats, elapsed):
+    """Print the per-stage breakdown requested with --stats."""
+    if stats is None:
+        return
+    if args.stats == 'json':
+        # Keep stdout clean when it carries the image
+        out = sys.stderr if getattr(args, 'output', None) == STDIO else sys.stdout
+        print(json.dumps(stats_report(stats, elapsed), indent=2), file=out)
+        return
+
+    report = stats.as_dict()
+    stages = report['stages']
+    print(f"\n{CYAN}Stats:{END}", file=sys.stderr)
+    print(f"  {'Stage':<12}{'Time':>12}{'Data':>14}{'Rate':>14}", file=sys.stderr)
+    for stage in sorted(stages, key=lambda s: STAGE_ORDER.index(s) if s in STAGE_ORDER else len(STAGE_ORDER)):
+        seconds, size = stages[stage]['seconds'], stages[stage]['bytes']
+        data = f"{size / (1024 * 1024):.1f} MB" if size else ''
+        rate = f"{size / (1024 * 1024) / seconds:.1f} MB/s" if size and seconds else ''
+        print(f"  {stage:<12}{seconds * 1000:>9.1f} ms{data:>14}{rate:>14}".rstrip(), file=sys.stderr)
+    for buffer, size in report['peak_bytes'].items():
+        print(f"  {'Peak ' + buffer + ' buffer:':<24}{size / (1024 * 1024):>14.1f} MB", file=sys.stderr)
+    print(f"  Wall time: {elapsed:.2f}s (stage times add up across threads and worker processes)", file=sys.stderr)
+
+
+def run_stream(transform, args, **options):
+    """Run `encrypt_stream`/`decrypt_stream` between files or stdin/stdout (`-`)."""
+    if args.pixel or args.preview:
+        raise ValueError(f"--pixel and --preview need file paths, not '{STDIO}'.")
+    with ExitStack() as stack:
+        src = sys.stdin.buffer if args.input == STDIO else stack.enter_context(open(args.input, 'rb'))
+        dst = sys.stdout.buffer if args.output == STDIO else stack.enter_context(atomic_output(args.output))
+        transform(src, dst, args.key, **options)
+        dst.flush()
+
+
+def pixel_conflicts(args):
+    """Encrypt options that pixel mode can't honour (it has no container to record them in)."""
+    conflicts = [('--envelope', args.envelope), ('--preview', args.preview is not None),
+                 ('--compress', args.compress != AUTO), ('--threads', args.threads != 1),
+                 ('--cipher', args.cipher != AUTO_CIPHER)]
+    return [option for option, given in conflicts if given]
 
 
 def handle_encrypt(args):
     """Handle the encryption command."""
-    valid, error_msg = is_supported_image(args.input)
-    if not valid:
-        print(f"{RED}Error: {error_msg}{END}")
-        return
+    if args.pixel and pixel_conflicts(args):
+        print(f"{RED}Error: --pixel can't be combined with {', '.join(pixel_conflicts(args))}.{END}", file=sys.stderr)
+        sys.exit(1)
+    if args.input != STDIO:
+        valid, error_msg = is_supported_image(args.input)
+        if not valid:
+            print(f"{RED}Error: {error_msg}{END}", file=sys.stderr)
+            sys.exit(1)
 
+    start = time.perf_counter()
     try:
-        encrypt_image(args.input, args.output, args.key)
-        print(f"{GREEN}Image encrypted successfully: {args.output}{END}")
+        with stats_collector(args) as stats:
+            if STDIO in (args.input, args.output):
+                run_stream(encrypt_stream, args, threads=args.threads, envelope=args.envelope,
+                           compression=args.compress, **suite_options(args))
+            elif args.pixel:
+                encrypt_pixels(args.input, args.output, args.key, kdf=suite_options(args, cipher=False)['kdf'])
+            else:
+                run_job('encrypt', args.input, args.output, args.key, threads=args.threads,
+                        envelope=args.envelope, preview_size=args.preview, compression=args.compress,
+                        **suite_options(args))
+        print(f"{GREEN}Image encrypted successfully: {describe_output(args.output)}{END}", file=sys.stderr)
     except Exception as e:
-        print(f"{RED}Encryption failed: {e}{END}")
+        print(f"{RED}Encryption failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+    print_stats(args, stats, time.perf_counter() - start)
 
 
 def handle_decrypt(args):
     """Handle the decryption command."""
+    if args.output is None or os.path.isdir(args.output):
+        if args.input == STDIO or args.pixel or args.preview:
+            print(f"{RED}Error: --output must name a file when using '{STDIO}', --pixel or --preview.{END}", file=sys.stderr)
+            sys.exit(1)
+        # Name the output after the input and the image format recorded in its header
+        args.output = os.path.join(args.output or os.path.dirname(args.input), output_name(args.input, 'decrypt'))
+
+    start = time.perf_counter()
+    try:
+        with stats_collector(args) as stats:
+            if STDIO in (args.input, args.output):
+                run_stream(decrypt_stream, args, threads=args.threads)
+            elif args.pixel:
+                decrypt_pixels(args.input, args.output, args.key)
+            elif args.preview:
+                decrypt_preview(args.input, args.output, args.key)
+            else:
+                run_job('decrypt', args.input, args.output, args.key, threads=args.threads)
+        print(f"{GREEN}Image decrypted successfully: {describe_output(args.output)}{END}", file=sys.stderr)
+    except Exception as e:
+        print(f"{RED}Decryption failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+    print_stats(args, stats, time.perf_counter() - start)
+
+
+def print_batch_summary(result):
+    """Print the throughput and failure summary of a directory run."""
+    print(f"\n{CYAN}Summary:{END}", file=sys.stderr)
+    print(f"  Files processed: {result.files}", file=sys.stderr)
+    print(f"  Elapsed:         {result.elapsed:.2f}s", file=sys.stderr)
+    print(f"  Throughput:      {result.files_per_second:.1f} files/s, {result.mb_per_second:.1f} MB/s", file=sys.stderr)
+    color = RED if result.failures else GREEN
+    print(f"{color}  Failures:        {len(result.failures)}{END}", file=sys.stderr)
+    for path, error in result.failures:
+        print(f"{RED}    {path}: {error}{END}", file=sys.stderr)
+
+
+def handle_directory(args, run, verb):
+    """Handle the encrypt-dir and decrypt-dir commands."""
+    try:
+        options = {}
+        if verb == 'encryption':
+            options = {'envelope': args.envelope, 'preview_size': args.preview, 'compression': args.compress,
+                       **suite_options(args)}
+        with stats_collector(args) as stats:
+            result = run(args.input, args.output, args.key, workers=args.workers,
+                         max_in_flight=args.max_in_flight, **options)
+    except Exception as e:
+        print(f"{RED}Directory {verb} failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+    print_batch_summary(result)
+    print_stats(args, stats, result.elapsed)
+    if result.failures:
+        sys.exit(1)
+
+
+def handle_sync(args):
+    """Handle the sync command."""
+    try:
+        with stats_collector(args) as stats:
+            result = sync_directory(args.input, args.output, args.key, workers=args.workers,
+                                    max_in_flight=args.max_in_flight, envelope=args.envelope,
+                                    preview_size=args.preview, compression=args.compress,
+                                    **suite_options(args))
+    except Exception as e:
+        print(f"{RED}Sync failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+    print(f"\n{CYAN}Summary:{END}", file=sys.stderr)
+    print(f"  Encrypted:    {result.encrypted}", file=sys.stderr)
+    print(f"  Deduplicated: {result.deduplicated}", file=sys.stderr)
+    print(f"  Unchanged:    {result.unchanged}", file=sys.stderr)
+    print(f"  Removed:      {result.removed}", file=sys.stderr)
+    print(f"  Elapsed:      {result.elapsed:.2f}s", file=sys.stderr)
+    color = RED if result.failures else GREEN
+    print(f"{color}  Failures:     {len(result.failures)}{END}", file=sys.stderr)
+    for path, error in result.failures:
+        print(f"{RED}    {path}: {error}{END}", file=sys.stderr)
+    print_stats(args, stats, result.elapsed)
+    if result.failures:
+        sys.exit(1)
+
+
+def handle_verify(args):
+    """Handle the verify command for a single file or a directory tree."""
+    records = []
+
+    def record(task, error):
+        records.append({'path': task[0], 'status': verify_status(error), 'error': str(error) if error else None})
+
+    start = time.perf_counter()
+    try:
+        with stats_collector(args) as stats:
+            if os.path.isdir(args.input):
+                size = verify_directory(args.input, args.key, workers=args.workers,
+                                        max_in_flight=args.max_in_flight, on_done=record).bytes
+            else:
+                try:
+                    verify_image(args.input, args.key, threads=args.threads)
+                    error = None
+                except (OSError, ValueError) as e:
+                    error = e
+                record((args.input, ''), error)
+                size = os.path.getsize(args.input) if os.path.exists(args.input) else 0
+    except Exception as e:
+        print(f"{RED}Verification failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    records.sort(key=lambda r: r['path'])
+    counts = {status: 0 for status in VERIFY_STATUSES}
+    for r in records:
+        counts[r['status']] += 1
+    if args.json:
+        report = {'files': records, 'summary': counts, 'bytes': size, 'elapsed': round(elapsed, 3)}
+        if stats is not None:
+            report['stats'] = stats_report(stats, elapsed)  # One JSON document on stdout
+        print(json.dumps(report, indent=2))
+    else:
+        for r in records:
+            if r['status'] != 'ok':
+                print(f"{RED}{r['status']:<15} {r['path']}: {r['error']}{END}")
+        print(f"\n{CYAN}Summary:{END}", file=sys.stderr)
+        for status, count in counts.items():
+            color = GREEN if status == 'ok' or not count else RED
+            print(f"{color}  {status + ':':<16}{count}{END}", file=sys.stderr)
+        rate = size / (1024 * 1024) / elapsed if elapsed else 0.0
+        print(f"  Elapsed:        {elapsed:.2f}s ({rate:.1f} MB/s)", file=sys.stderr)
+        print_stats(args, stats, elapsed)
+    if counts['ok'] != len(records):
+        sys.exit(1)
+
+
+def handle_rekey(args):
+    """Handle the rekey command for a single file or a directory tree."""
+    try:
+        if os.path.isdir(args.input):
+            result = rekey_directory(args.input, args.key, args.new_key, add=args.add,
+                                     **suite_options(args, cipher=False))
+            print_batch_summary(result)
+            failed = bool(result.failures)
+        else:
+            rekey_image(args.input, args.key, args.new_key, add=args.add, **suite_options(args, cipher=False))
+            print(f"{GREEN}Password {'added to' if args.add else 'changed for'}: {args.input}{END}", file=sys.stderr)
+            failed = False
+    except Exception as e:
+        print(f"{RED}Re-keying failed: {e}{END}", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+def handle_pack(args):
+    """Handle the pack command."""
+    try:
+        count = pack_archive(args.output, collect_files(args.input), args.key, append=args.append,
+                             **suite_options(args, cipher=False))
+        print(f"{GREEN}{'Appended' if args.append else 'Packed'} {count} image(s) into: {args.output}{END}", file=sys.stderr)
+    except Exception as e:
+        print(f"{RED}Packing failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+
+
+def handle_unpack(args):
+    """Handle the unpack command."""
     try:
-        decrypt_image(args.input, args.output, args.key)
-        print(f"{GREEN}Image decrypted successfully: {args.output}{END}")
+        count = unpack_archive(args.input, args.output, args.key)
+        print(f"{GREEN}Extracted {count} image(s) to: {args.output}{END}", file=sys.stderr)
     except Exception as e:
-        print(f"{RED}Decryption failed: {e}{END}")
+        print(f"{RED}Unpacking failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+
+
+def handle_list(args):
+    """Handle the list command."""
+    try:
+        members = list_archive(args.input, args.key)
+    except Exception as e:
+        print(f"{RED}Listing failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+    for member in members:
+        print(f"{member.size:>12}  {member.name}")
+    print(f"{CYAN}{len(members)} member(s){END}", file=sys.stderr)
+
+
+def handle_extract(args):
+    """Handle the extract command."""
+    try:
+        extract_member(args.input, args.member, args.output, args.key)
+        print(f"{GREEN}Extracted {args.member} to: {args.output}{END}", file=sys.stderr)
+    except Exception as e:
+        print(f"{RED}Extraction failed: {e}{END}", file=sys.stderr)
+        sys.exit(1)
+
+
+def handle_calibrate(args):
+    """Handle the calibrate command."""
+    print(f"{CYAN}Calibrating {args.kdf} for {args.target_ms} ms per key derivation...{END}", file=sys.stderr)
+    kdf, latency = calibrate_kdf(args.kdf, args.target_ms / 1000)
+    print(f"{YELLOW}KDF:{END} {describe_kdf(kdf)}, {latency * 1000:.0f} ms per derivation")
+    for cipher, rate in cipher_report():
+        print(f"{YELLOW}Cipher:{END} {cipher.name}, {rate:.0f} MB/s")
+    print(f"{YELLOW}Automatic cipher choice:{END} {preferred_cipher().name}")
+    print(f"\n{CYAN}Encrypt with:{END} --kdf {kdf.name} --kdf-cost {kdf.cost}")
 
 
 def handle_formats():
@@ -61,6 +372,25 @@ def handle_formats():
         print(f"{YELLOW}{format_name}:{END} {', '.join(extensions)}")
 
 
+def add_suite_arguments(parser, cipher=True):
+    """Add the KDF (and cipher) options of commands that write encrypted data."""
+    parser.add_argument('--kdf', choices=KDF_NAMES, default='pbkdf2',
+                        help='Password key derivation function (default: pbkdf2)')
+    parser.add_argument('--kdf-cost', type=int, default=0, metavar='COST',
+                        help='PBKDF2 iterations or scrypt log2(N), see the calibrate command '
+                             '(default: 100000 or 15)')
+    if cipher:
+        parser.add_argument('--cipher', choices=[AUTO_CIPHER] + CIPHER_NAMES, default=AUTO_CIPHER,
+                            help='Cipher for the image data (default: auto, the faster one on this CPU)')
+
+
+def add_stats_argument(parser):
+    """Add --stats to commands that read or write encrypted images."""
+    parser.add_argument('--stats', nargs='?', const='text', choices=STATS_FORMATS, default=None,
+                        help='Print the time, bytes and peak buffer size of each stage '
+                             '(KDF, read, compress, cipher, write) as text (default) or json')
+
+
 def parse_arguments():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(
@@ -71,9 +401,38 @@ def parse_arguments():
   Encrypt an image:
     {GREEN}%(prog)s encrypt --input image.jpg --output encrypted.bin --key "mysecretpassword"{END}
     
+  Encrypt the pixels into an image that pipelines can still handle:
+    {GREEN}%(prog)s encrypt --input image.jpg --output encrypted.png --key "mysecretpassword" --pixel{END}
+
   Decrypt an image:
     {GREEN}%(prog)s decrypt --input encrypted.bin --output decrypted.jpg --key "mysecretpassword"{END}
     
+  Encrypt in a pipeline without temporary files (messages go to stderr):
+    {GREEN}curl -s https://example.com/image.jpg | %(prog)s encrypt --input - --output - --key "mysecretpassword" > encrypted.bin{END}
+
+  Encrypt a whole directory tree:
+    {GREEN}%(prog)s encrypt-dir --input photos/ --output vault/ --key "mysecretpassword" --workers 8{END}
+
+  Keep an encrypted mirror up to date, re-encrypting only what changed:
+    {GREEN}%(prog)s sync --input photos/ --output vault/ --key "mysecretpassword"{END}
+
+  Check every file of a vault without writing plaintext (JSON report for scripts):
+    {GREEN}%(prog)s verify --input vault/ --key "mysecretpassword" --json{END}
+
+  See where the time goes (key derivation, disk reads, cipher, writes):
+    {GREEN}%(prog)s encrypt-dir --input photos/ --output vault/ --key "mysecretpassword" --stats{END}
+
+  Change the password of envelope-encrypted files without re-encrypting them:
+    {GREEN}%(prog)s rekey --input vault/ --key "oldpassword" --new-key "newpassword"{END}
+
+  Store a gallery in one archive and pull a single image back out:
+    {GREEN}%(prog)s pack --input gallery/ --output gallery.pxa --key "mysecretpassword"{END}
+    {GREEN}%(prog)s extract --input gallery.pxa --member 2024/img001.jpg --output img001.jpg --key "mysecretpassword"{END}
+
+  Tune the key derivation cost for this machine, then use the printed options:
+    {GREEN}%(prog)s calibrate --kdf scrypt --target-ms 500{END}
+    {GREEN}%(prog)s encrypt --input image.jpg --output encrypted.bin --key "mysecretpassword" --kdf scrypt --kdf-cost 16{END}
+
   List supported formats:
     {GREEN}%(prog)s formats{END}
 
@@ -97,9 +456,21 @@ def parse_arguments():
         help='Encrypt an image file',
         description='Encrypt an image file using AES-256 encryption'
     )
-    encrypt_parser.add_argument('--input', required=True, help='Path to input image file')
-    encrypt_parser.add_argument('--output', required=True, help='Path to save encrypted output file')
+    encrypt_parser.add_argument('--input', required=True, help='Path to input image file, or - for stdin')
+    encrypt_parser.add_argument('--output', required=True, help='Path to save encrypted output file, or - for stdout')
     encrypt_parser.add_argument('--key', required=True, help='Encryption password/key')
+    encrypt_parser.add_argument('--threads', type=int, default=1,
+                                help='Number of threads used to encrypt chunks in parallel (default: 1)')
+    encrypt_parser.add_argument('--envelope', action='store_true',
+                                help='Encrypt with a random data key wrapped by the password, so it can be re-keyed')
+    encrypt_parser.add_argument('--pixel', action='store_true',
+                                help='Encrypt the pixels only and write a viewable PNG/TIFF (output must end in .png/.tif/.tiff)')
+    encrypt_parser.add_argument('--preview', type=int, nargs='?', const=256, default=None, metavar='SIZE',
+                                help='Embed an encrypted preview of at most SIZE pixels per side (default: 256)')
+    encrypt_parser.add_argument('--compress', choices=COMPRESSION_CHOICES, default=AUTO,
+                                help='Compress before encrypting (default: auto, only for uncompressed formats such as BMP)')
+    add_suite_arguments(encrypt_parser)
+    add_stats_argument(encrypt_parser)
 
     # Decrypt command
     decrypt_parser = subparsers.add_parser(
@@ -107,9 +478,147 @@ def parse_arguments():
         help='Decrypt an encrypted image file',
         description='Decrypt a previously encrypted image file'
     )
-    decrypt_parser.add_argument('--input', required=True, help='Path to encrypted input file')
-    decrypt_parser.add_argument('--output', required=True, help='Path to save decrypted image')
+    decrypt_parser.add_argument('--input', required=True, help='Path to encrypted input file, or - for stdin')
+    decrypt_parser.add_argument('--output', default=None,
+                                help='Path to save decrypted image, a directory, or - for stdout '
+                                     '(default: the input name without .bin, with the original image extension)')
     decrypt_parser.add_argument('--key', required=True, help='Decryption password/key (must match encryption password)')
+    decrypt_parser.add_argument('--threads', type=int, default=1,
+                                help='Number of threads used to decrypt chunks in parallel (default: 1)')
+    decrypt_parser.add_argument('--pixel', action='store_true',
+                                help='Decrypt a PNG/TIFF produced with encrypt --pixel')
+    decrypt_parser.add_argument('--preview', action='store_true',
+                                help='Decrypt only the embedded preview (written as JPEG, or PNG if transparent)')
+    add_stats_argument(decrypt_parser)
+
+    # Directory commands
+    for name, verb, run_help in (
+        ('encrypt-dir', 'encrypt', 'Encrypt every supported image in a directory tree'),
+        ('decrypt-dir', 'decrypt', 'Decrypt every .bin file in a directory tree'),
+    ):
+        dir_parser = subparsers.add_parser(name, help=run_help, description=run_help)
+        dir_parser.add_argument('--input', required=True, help=f'Directory to {verb}')
+        dir_parser.add_argument('--output', required=True, help='Directory that mirrors the input layout')
+        dir_parser.add_argument('--key', required=True, help=f'{verb.capitalize()}ion password/key')
+        dir_parser.add_argument('--workers', type=int, default=None,
+                                help='Number of worker processes (default: number of CPUs)')
+        dir_parser.add_argument('--max-in-flight', type=int, default=None,
+                                help='Maximum number of files queued at once (default: 4 per worker)')
+        add_stats_argument(dir_parser)
+        if verb == 'encrypt':
+            dir_parser.add_argument('--envelope', action='store_true',
+                                    help='Encrypt with random data keys wrapped by the password, so files can be re-keyed')
+            dir_parser.add_argument('--preview', type=int, nargs='?', const=256, default=None, metavar='SIZE',
+                                    help='Embed an encrypted preview of at most SIZE pixels per side (default: 256)')
+            dir_parser.add_argument('--compress', choices=COMPRESSION_CHOICES, default=AUTO,
+                                    help='Compress before encrypting (default: auto, only for uncompressed formats such as BMP)')
+            add_suite_arguments(dir_parser)
+
+    # Sync command
+    sync_parser = subparsers.add_parser(
+        'sync',
+        help='Incrementally update an encrypted mirror of a directory tree',
+        description='Encrypt new and modified images, remove ciphertexts of deleted ones and '
+                    'deduplicate identical images, tracked by an encrypted manifest in the output directory'
+    )
+    sync_parser.add_argument('--input', required=True, help='Directory to mirror')
+    sync_parser.add_argument('--output', required=True, help='Encrypted mirror (holds the sync manifest)')
+    sync_parser.add_argument('--key', required=True, help='Encryption password/key (the same on every run)')
+    sync_parser.add_argument('--workers', type=int, default=None,
+                             help='Number of worker processes (default: number of CPUs)')
+    sync_parser.add_argument('--max-in-flight', type=int, default=None,
+                             help='Maximum number of files queued at once (default: 4 per worker)')
+    sync_parser.add_argument('--envelope', action='store_true',
+                             help='Encrypt with random data keys wrapped by the password, so files can be re-keyed')
+    sync_parser.add_argument('--preview', type=int, nargs='?', const=256, default=None, metavar='SIZE',
+                             help='Embed an encrypted preview of at most SIZE pixels per side (default: 256)')
+    sync_parser.add_argument('--compress', choices=COMPRESSION_CHOICES, default=AUTO,
+                             help='Compress before encrypting (default: auto, only for uncompressed formats such as BMP)')
+    add_suite_arguments(sync_parser)
+    add_stats_argument(sync_parser)
+
+    # Verify command
+    verify_parser = subparsers.add_parser(
+        'verify',
+        help='Check encrypted files without writing any plaintext',
+        description='Authenticate every chunk of an encrypted file or directory tree of .bin files, '
+                    'reporting wrong passwords, truncated files and corrupted files separately'
+    )
+    verify_parser.add_argument('--input', required=True, help='Encrypted file or directory')
+    verify_parser.add_argument('--key', required=True, help='Decryption password/key')
+    verify_parser.add_argument('--threads', type=int, default=1,
+                               help='Number of threads used to check the chunks of a single file (default: 1)')
+    verify_parser.add_argument('--workers', type=int, default=None,
+                               help='Number of worker processes for a directory (default: number of CPUs)')
+    verify_parser.add_argument('--max-in-flight', type=int, default=None,
+                               help='Maximum number of files queued at once (default: 4 per worker)')
+    verify_parser.add_argument('--json', action='store_true',
+                               help='Print a JSON report with the status of every file to stdout')
+    add_stats_argument(verify_parser)
+
+    # Rekey command
+    rekey_parser = subparsers.add_parser(
+        'rekey',
+        help='Change or add a password on envelope-encrypted files',
+        description='Rewrite only the key slots of an envelope-encrypted file or directory tree of .bin files'
+    )
+    rekey_parser.add_argument('--input', required=True, help='Encrypted file or directory')
+    rekey_parser.add_argument('--key', required=True, help='Current password/key')
+    rekey_parser.add_argument('--new-key', required=True, help='New password/key')
+    rekey_parser.add_argument('--add', action='store_true',
+                              help='Keep the current password and add the new one as an extra key slot')
+    add_suite_arguments(rekey_parser, cipher=False)
+
+    # Archive commands
+    pack_parser = subparsers.add_parser(
+        'pack',
+        help='Store many images in one encrypted archive',
+        description='Encrypt images (files or whole directories) into a single archive with an encrypted index'
+    )
+    pack_parser.add_argument('--input', required=True, nargs='+', help='Image files and/or directories to store')
+    pack_parser.add_argument('--output', required=True, help='Path of the archive')
+    pack_parser.add_argument('--key', required=True, help='Encryption password/key')
+    pack_parser.add_argument('--append', action='store_true', help='Add the images to an existing archive')
+    add_suite_arguments(pack_parser, cipher=False)
+
+    unpack_parser = subparsers.add_parser(
+        'unpack',
+        help='Extract every image from an archive',
+        description='Decrypt all members of an archive into a directory'
+    )
+    unpack_parser.add_argument('--input', required=True, help='Path of the archive')
+    unpack_parser.add_argument('--output', required=True, help='Directory to extract into')
+    unpack_parser.add_argument('--key', required=True, help='Decryption password/key')
+
+    list_parser = subparsers.add_parser(
+        'list',
+        help='List the images stored in an archive',
+        description='Decrypt the archive index and list its members'
+    )
+    list_parser.add_argument('--input', required=True, help='Path of the archive')
+    list_parser.add_argument('--key', required=True, help='Decryption password/key')
+
+    extract_parser = subparsers.add_parser(
+        'extract',
+        help='Extract a single image from an archive',
+        description='Decrypt one archive member without reading the rest of the archive'
+    )
+    extract_parser.add_argument('--input', required=True, help='Path of the archive')
+    extract_parser.add_argument('--member', required=True, help='Name of the member to extract')
+    extract_parser.add_argument('--output', required=True, help='Path to save the decrypted image')
+    extract_parser.add_argument('--key', required=True, help='Decryption password/key')
+
+    # Calibrate command
+    calibrate_parser = subparsers.add_parser(
+        'calibrate',
+        help='Pick KDF settings for this machine',
+        description='Benchmark the key derivation function and the ciphers on this machine and '
+                    'print the --kdf/--kdf-cost options that hit a target latency'
+    )
+    calibrate_parser.add_argument('--kdf', choices=KDF_NAMES, default='scrypt',
+                                  help='Key derivation function to calibrate (default: scrypt)')
+    calibrate_parser.add_argument('--target-ms', type=int, default=500,
+                                  help='Time one key derivation should take, in milliseconds (default: 500)')
 
     # List formats command
     subparsers.add_parser(
@@ -135,10 +644,30 @@ def main():
         handle_encrypt(args)
     elif args.command == 'decrypt':
         handle_decrypt(args)
+    elif args.command == 'encrypt-dir':
+        handle_directory(args, encrypt_directory, 'encryption')
+    elif args.command == 'decrypt-dir':
+        handle_directory(args, decrypt_directory, 'decryption')
+    elif args.command == 'sync':
+        handle_sync(args)
+    elif args.command == 'verify':
+        handle_verify(args)
+    elif args.command == 'rekey':
+        handle_rekey(args)
+    elif args.command == 'pack':
+        handle_pack(args)
+    elif args.command == 'unpack':
+        handle_unpack(args)
+    elif args.command == 'list':
+        handle_list(args)
+    elif args.command == 'extract':
+        handle_extract(args)
+    elif args.command == 'calibrate':
+        handle_calibrate(args)
     elif args.command == 'formats':
         handle_formats()
     else:
-        print("Invalid command. Use --help for usage information.")
+        print("Invalid command. Use --help for usage information.", file=sys.stderr)
 
 
 if __name__ == '__main__':
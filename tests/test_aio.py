@@ -0,0 +1,69 @@
+import asyncio
+import os
+
+import pytest
+
+from tools.aio import decrypt_image_async, encrypt_image_async, run_batch_async
+
+PASSWORD = 'correct horse'
+CHUNK_SIZE = 1024
+
+
+class SlowReader:
+    """An async reader that hands out a few bytes per call, or stalls forever."""
+
+    def __init__(self, data: bytes, stall: bool = False):
+        self.data = data
+        self.stall = stall
+
+    async def read(self, size: int) -> bytes:
+        if self.stall:
+            await asyncio.Event().wait()
+        data, self.data = self.data[:100], self.data[100:]
+        return data
+
+
+def test_bytes_round_trip():
+    data = os.urandom(5 * CHUNK_SIZE + 1)
+
+    async def main():
+        sealed = await encrypt_image_async(data, None, PASSWORD, chunk_size=CHUNK_SIZE)
+        return await decrypt_image_async(sealed, None, PASSWORD)
+
+    assert asyncio.run(main()) == data
+
+
+def test_path_and_reader_round_trip(tmp_path):
+    data = os.urandom(3 * CHUNK_SIZE + 5)
+
+    async def main():
+        await encrypt_image_async(SlowReader(data), str(tmp_path / 'image.bin'), PASSWORD, chunk_size=CHUNK_SIZE)
+        await decrypt_image_async(str(tmp_path / 'image.bin'), str(tmp_path / 'image.png'), PASSWORD)
+        sealed = (tmp_path / 'image.bin').read_bytes()
+        return await decrypt_image_async(SlowReader(sealed), None, PASSWORD)
+
+    assert asyncio.run(main()) == data
+    assert (tmp_path / 'image.png').read_bytes() == data
+
+
+def test_timeout_leaves_no_output(tmp_path):
+    async def main():
+        await encrypt_image_async(SlowReader(b'', stall=True), str(tmp_path / 'image.bin'), PASSWORD, timeout=0.1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    assert os.listdir(tmp_path) == []
+
+
+def test_batch_reports_errors_in_place(tmp_path):
+    images = [os.urandom(100 + i) for i in range(3)]
+
+    async def main():
+        sealed = await run_batch_async('encrypt', [(data, None) for data in images], PASSWORD, concurrency=2)
+        items = [(sealed[0], None), (sealed[1][:-1], None), (str(tmp_path / 'missing.bin'), None), (sealed[2], None)]
+        return await run_batch_async('decrypt', items, PASSWORD)
+
+    first, truncated, missing, last = asyncio.run(main())
+    assert (first, last) == (images[0], images[2])
+    assert isinstance(truncated, ValueError)
+    assert isinstance(missing, FileNotFoundError)
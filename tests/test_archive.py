@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from tools.archive import collect_files, extract_member, list_archive, pack_archive, unpack_archive
+
+PASSWORD = 'correct horse'
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def gallery(tmp_path):
+    """A directory of images, one nested, and the archive path next to it."""
+    root = tmp_path / 'gallery'
+    (root / 'trip').mkdir(parents=True)
+    images = {'cover.png': b'\x89PNG\r\n\x1a\n' + os.urandom(100),
+              'trip/beach.jpg': b'\xff\xd8\xff' + os.urandom(5 * CHUNK_SIZE + 7),
+              'blank.gif': b'GIF89a'}
+    for name, data in images.items():
+        (root / name).write_bytes(data)
+    (root / 'notes.txt').write_text('not an image')
+    (root / 'fake.png').write_text('not an image either')
+    return root, tmp_path / 'gallery.pxa', images
+
+
+def test_pack_list_unpack(gallery, tmp_path):
+    root, archive, images = gallery
+    assert pack_archive(str(archive), collect_files([str(root)]), PASSWORD, chunk_size=CHUNK_SIZE) == 3
+    assert sorted(member.name for member in list_archive(str(archive), PASSWORD)) == sorted(images)
+
+    assert unpack_archive(str(archive), str(tmp_path / 'out'), PASSWORD) == 3
+    for name, data in images.items():
+        assert (tmp_path / 'out' / name).read_bytes() == data
+
+
+def test_extract_single_member(gallery, tmp_path):
+    root, archive, images = gallery
+    pack_archive(str(archive), collect_files([str(root)]), PASSWORD, chunk_size=CHUNK_SIZE)
+    extract_member(str(archive), 'trip/beach.jpg', str(tmp_path / 'beach.jpg'), PASSWORD)
+    assert (tmp_path / 'beach.jpg').read_bytes() == images['trip/beach.jpg']
+
+    with pytest.raises(ValueError, match="no member named 'missing.png'"):
+        extract_member(str(archive), 'missing.png', str(tmp_path / 'missing.png'), PASSWORD)
+
+
+def test_append_keeps_existing_data(gallery, tmp_path):
+    root, archive, images = gallery
+    pack_archive(str(archive), [('cover.png', str(root / 'cover.png'))], PASSWORD)
+    stored = archive.read_bytes()
+
+    (tmp_path / 'cover.png').write_bytes(b'new cover')
+    pack_archive(str(archive), [('trip/beach.jpg', str(root / 'trip' / 'beach.jpg')),
+                                ('cover.png', str(tmp_path / 'cover.png'))], PASSWORD, append=True)
+    assert archive.read_bytes().startswith(stored)
+    assert sorted(member.name for member in list_archive(str(archive), PASSWORD)) == ['cover.png', 'trip/beach.jpg']
+    extract_member(str(archive), 'cover.png', str(tmp_path / 'out.png'), PASSWORD)
+    assert (tmp_path / 'out.png').read_bytes() == b'new cover'
+
+
+def test_failed_append_leaves_archive_unchanged(gallery):
+    root, archive, _ = gallery
+    pack_archive(str(archive), [('cover.png', str(root / 'cover.png'))], PASSWORD)
+    stored = archive.read_bytes()
+    with pytest.raises(FileNotFoundError):
+        pack_archive(str(archive), [('a.png', str(root / 'cover.png')), ('b.png', str(root / 'missing.png'))],
+                     PASSWORD, append=True)
+    assert archive.read_bytes() == stored
+
+
+def test_wrong_password(gallery):
+    root, archive, _ = gallery
+    pack_archive(str(archive), collect_files([str(root)]), PASSWORD)
+    with pytest.raises(ValueError):
+        list_archive(str(archive), 'wrong')
+
+
+def test_tampered_member(gallery, tmp_path):
+    root, archive, _ = gallery
+    pack_archive(str(archive), [('cover.png', str(root / 'cover.png'))], PASSWORD)
+    member, = list_archive(str(archive), PASSWORD)
+    data = bytearray(archive.read_bytes())
+    data[member.offset + 5] ^= 1
+    archive.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        extract_member(str(archive), 'cover.png', str(tmp_path / 'out.png'), PASSWORD)
+    assert not (tmp_path / 'out.png').exists()
+
+
+def test_truncated_archive(gallery):
+    root, archive, _ = gallery
+    pack_archive(str(archive), collect_files([str(root)]), PASSWORD)
+    archive.write_bytes(archive.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        list_archive(str(archive), PASSWORD)
+
+
+@pytest.mark.parametrize('name', ['../escape.png', '/', 'a/../../b.png'])
+def test_invalid_member_names(gallery, name):
+    root, archive, _ = gallery
+    with pytest.raises(ValueError, match='Invalid archive member name'):
+        pack_archive(str(archive), [(name, str(root / 'cover.png'))], PASSWORD)
+    assert not archive.exists()
+
+
+@pytest.mark.parametrize('command', [['list'], ['extract', '--member', 'missing.png', '--output', 'out.png'],
+                                     ['unpack', '--output', 'out'], ['pack', '--output', 'new.pxa']])
+def test_cli_failures_exit_with_status_1(gallery, tmp_path, command):
+    root, archive, _ = gallery
+    pack_archive(str(archive), collect_files([str(root)]), PASSWORD)
+    cli = [sys.executable, os.path.join(os.path.dirname(__file__), '..', 'pixel_shield.py')]
+    key = 'wrong' if command[0] != 'extract' else PASSWORD
+    source = str(tmp_path / 'missing') if command[0] == 'pack' else str(archive)
+    run = subprocess.run(cli + command + ['--input', source, '--key', key],
+                         cwd=tmp_path, capture_output=True, text=True)
+    assert run.returncode == 1
+    if command[0] == 'extract':
+        assert "failed: Archive has no member named 'missing.png'." in run.stderr
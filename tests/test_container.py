@@ -0,0 +1,372 @@
+import io
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from tools.image_utils import (
+    FIELD_CIPHER, FIELD_CODEC, FIELD_KDF, FIELD_SLOT, STAGE_CIPHER, STAGE_COMPRESS, STAGE_DECOMPRESS, STAGE_KDF,
+    STAGE_READ, STAGE_TRIAL, STAGE_WRITE, TAG_SIZE, CorruptFileError, StreamDecryptor, StreamEncryptor,
+    TruncatedFileError, WrongPasswordError, collect_metrics, decrypt_bytes, decrypt_image, decrypt_stream, derive_key, encrypt_bytes,
+    encrypt_image, open_encrypted, read_header, rekey_image, verify_image,
+)
+from tools.suites import CIPHER_NAMES, KDF_SCRYPT, Pbkdf2, Scrypt, choose_cipher, make_kdf, unpack_kdf
+
+PASSWORD = 'correct horse'
+CHUNK_SIZE = 1024
+
+
+def payload(size: int, seed: int = 0) -> bytes:
+    """Half compressible, half random, so compressed chunks differ in size."""
+    rng = random.Random(seed)
+    return bytes(rng.choice(b'ab') for _ in range(size // 2)) + rng.randbytes(size - size // 2)
+
+
+def payload_start(container: bytes) -> int:
+    f = io.BytesIO(container)
+    read_header(f)
+    return f.tell()
+
+
+@pytest.fixture
+def encrypt(tmp_path):
+    def encrypt(data: bytes, **options) -> bytes:
+        (tmp_path / 'plain.bmp').write_bytes(data)
+        options.setdefault('compression', None)
+        encrypt_image(str(tmp_path / 'plain.bmp'), str(tmp_path / 'sealed.bin'), PASSWORD,
+                      chunk_size=CHUNK_SIZE, **options)
+        return (tmp_path / 'sealed.bin').read_bytes()
+    return encrypt
+
+
+@pytest.fixture
+def decrypt(tmp_path):
+    def decrypt(container: bytes, password: str = PASSWORD, **options) -> bytes:
+        (tmp_path / 'in.bin').write_bytes(container)
+        decrypt_image(str(tmp_path / 'in.bin'), str(tmp_path / 'out.bmp'), password, **options)
+        return (tmp_path / 'out.bmp').read_bytes()
+    return decrypt
+
+
+@pytest.mark.parametrize('size', [0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, 3 * CHUNK_SIZE, 3 * CHUNK_SIZE + 17])
+@pytest.mark.parametrize('options', [{}, {'compression': 'zlib'}, {'compression': 'lzma'}, {'envelope': True}])
+def test_round_trip(encrypt, decrypt, size, options):
+    data = payload(size)
+    assert decrypt(encrypt(data, **options)) == data
+
+
+def test_truncation_on_chunk_boundary(encrypt, decrypt, tmp_path):
+    container = encrypt(payload(3 * CHUNK_SIZE + 100))
+    cut = payload_start(container) + 2 * (CHUNK_SIZE + TAG_SIZE)
+    with pytest.raises(ValueError):
+        decrypt(container[:cut])
+    assert not (tmp_path / 'out.bmp').exists()
+
+
+def test_truncation_off_chunk_boundary(encrypt, decrypt):
+    container = encrypt(payload(3 * CHUNK_SIZE + 100))
+    for cut in (payload_start(container) + CHUNK_SIZE + TAG_SIZE + 10, len(container) - 1):
+        with pytest.raises(ValueError):
+            decrypt(container[:cut])
+
+
+def test_truncated_compressed_chunk(encrypt, decrypt):
+    container = encrypt(payload(4 * CHUNK_SIZE), compression='zlib')
+    start = payload_start(container)
+    # Inside a length prefix, inside the first chunk, on a chunk boundary and one byte short of the end
+    first = int.from_bytes(container[start:start + 4], 'big')
+    for cut in (start + 1, start + 10, start + 4 + first, len(container) - 1):
+        with pytest.raises(ValueError):
+            decrypt(container[:cut])
+
+
+def test_truncated_header(encrypt, decrypt):
+    container = encrypt(payload(100))
+    with pytest.raises(ValueError):
+        decrypt(container[:payload_start(container) - 3])
+
+
+def test_tampered_chunk(encrypt, decrypt):
+    container = bytearray(encrypt(payload(3 * CHUNK_SIZE)))
+    container[payload_start(container) + CHUNK_SIZE + TAG_SIZE + 5] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(container))
+
+
+def test_reordered_chunks(encrypt, decrypt):
+    container = encrypt(payload(3 * CHUNK_SIZE))
+    start, sealed = payload_start(container), CHUNK_SIZE + TAG_SIZE
+    swapped = (container[:start] + container[start + sealed:start + 2 * sealed]
+               + container[start:start + sealed] + container[start + 2 * sealed:])
+    with pytest.raises(ValueError):
+        decrypt(swapped)
+
+
+def test_tampered_header(encrypt, decrypt):
+    container = encrypt(payload(2 * CHUNK_SIZE), compression='zlib')
+    start = payload_start(container)
+    # Another valid codec: only the chunks' associated data can notice
+    tampered = container[:start].replace(b'zlib', b'lzma') + container[start:]
+    with pytest.raises(CorruptFileError):
+        decrypt(tampered)
+
+
+@pytest.mark.parametrize('name, body, expected', [
+    ('scan.bmp', bytes(5 * CHUNK_SIZE), b'zlib'),
+    ('noise.bmp', os.urandom(5 * CHUNK_SIZE), None),  # The trial run barely shrinks it
+    ('photo.jpg', bytes(5 * CHUNK_SIZE), None),
+])
+def test_auto_compression(tmp_path, name, body, expected):
+    signature = b'BM\x00\x00\x00\x00\x00\x00' if name.endswith('.bmp') else b'\xff\xd8\xff'
+    (tmp_path / name).write_bytes(signature + body)
+    encrypt_image(str(tmp_path / name), str(tmp_path / 'sealed.bin'), PASSWORD, chunk_size=CHUNK_SIZE)
+    with open(tmp_path / 'sealed.bin', 'rb') as f:
+        assert dict(read_header(f)).get(FIELD_CODEC) == expected
+    decrypt_image(str(tmp_path / 'sealed.bin'), str(tmp_path / 'out'), PASSWORD)
+    assert (tmp_path / 'out').read_bytes() == (tmp_path / name).read_bytes()
+
+
+@pytest.mark.parametrize('options', [{}, {'envelope': True}])
+def test_wrong_password(encrypt, decrypt, options):
+    container = encrypt(payload(2 * CHUNK_SIZE), **options)
+    with pytest.raises(WrongPasswordError):
+        decrypt(container, 'wrong')
+
+
+@pytest.mark.parametrize('cipher', CIPHER_NAMES)
+@pytest.mark.parametrize('kdf', [Pbkdf2(1000), Scrypt(10)])
+@pytest.mark.parametrize('envelope', [False, True])
+def test_ciphers_and_kdfs(encrypt, decrypt, cipher, kdf, envelope):
+    data = payload(2 * CHUNK_SIZE + 1)
+    container = encrypt(data, cipher=cipher, kdf=kdf, envelope=envelope)
+    fields = dict(read_header(io.BytesIO(container)))
+    assert fields[FIELD_CIPHER] == bytes([choose_cipher(cipher).id])
+    kdf_field = fields[FIELD_SLOT][1:] if envelope else fields[FIELD_KDF]
+    assert unpack_kdf(kdf_field)[0] == kdf
+    assert decrypt(container) == data
+    with pytest.raises(WrongPasswordError):
+        decrypt(container, 'wrong')
+
+
+def test_unpack_kdf_rejects_unbounded_cost():
+    with pytest.raises(ValueError):
+        unpack_kdf(bytes([KDF_SCRYPT, 30, 8, 1]) + bytes(16))
+    with pytest.raises(ValueError):
+        unpack_kdf(Pbkdf2(2 ** 32 - 1).pack() + bytes(16))
+    with pytest.raises(ValueError):
+        make_kdf(Pbkdf2.name, 2 ** 32 - 1)
+
+
+def verify(container: bytes, tmp_path, password: str = PASSWORD):
+    (tmp_path / 'verify.bin').write_bytes(container)
+    verify_image(str(tmp_path / 'verify.bin'), password, threads=2)
+
+
+@pytest.mark.parametrize('options', [{}, {'compression': 'zlib'}, {'envelope': True}])
+def test_verify(encrypt, tmp_path, options):
+    container = encrypt(payload(3 * CHUNK_SIZE + 5), **options)
+    verify(container, tmp_path)
+    with pytest.raises(WrongPasswordError):
+        verify(container, tmp_path, 'wrong')
+
+    with pytest.raises(CorruptFileError):
+        verify(container[:-1], tmp_path)
+    if 'compression' not in options:
+        with pytest.raises(TruncatedFileError):
+            verify(container[:payload_start(container) + CHUNK_SIZE + TAG_SIZE], tmp_path)
+
+
+@pytest.mark.parametrize('size', [100, 3 * CHUNK_SIZE])
+def test_verify_damaged_chunk_is_not_a_wrong_password(encrypt, tmp_path, size):
+    # The password check proves the password even when the only chunk is damaged
+    container = bytearray(encrypt(payload(size)))
+    container[-1] ^= 1
+    with pytest.raises(CorruptFileError) as info:
+        verify(bytes(container), tmp_path)
+    assert not isinstance(info.value, TruncatedFileError)
+
+
+def test_verify_legacy(tmp_path):
+    legacy = legacy_container(payload(CHUNK_SIZE))
+    verify(legacy, tmp_path)
+    with pytest.raises(WrongPasswordError):
+        verify(legacy, tmp_path, 'wrong')
+
+
+def legacy_container(data: bytes) -> bytes:
+    """Build a file in the original `salt | iv | tag | ciphertext` layout."""
+    salt, iv = os.urandom(16), os.urandom(12)
+    sealed = AESGCM(derive_key(PASSWORD, salt)).encrypt(iv, data, None)
+    return salt + iv + sealed[-TAG_SIZE:] + sealed[:-TAG_SIZE]
+
+
+def test_legacy_format(decrypt):
+    data = payload(3 * CHUNK_SIZE)
+    legacy = legacy_container(data)
+    assert decrypt(legacy) == data
+
+    tampered = bytearray(legacy)
+    tampered[-1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(tampered))
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_thread_count_does_not_change_output(monkeypatch, encrypt, decrypt, compression):
+    data = payload(20 * CHUNK_SIZE)
+
+    def encrypt_with(threads):
+        rng = random.Random(1)
+        monkeypatch.setattr(os, 'urandom', rng.randbytes)  # Same salt and nonces for every run
+        return encrypt(data, threads=threads, compression=compression)
+
+    single = encrypt_with(1)
+    for threads in (2, 4, 8):
+        assert encrypt_with(threads) == single
+    monkeypatch.undo()
+    for threads in (1, 3, 8):
+        assert decrypt(single, threads=threads) == data
+
+
+def test_rekey(encrypt, decrypt, tmp_path):
+    data = payload(2 * CHUNK_SIZE)
+    path = tmp_path / 'image.bin'
+    path.write_bytes(encrypt(data, envelope=True))
+    rekey_image(str(path), PASSWORD, 'new password')
+    assert decrypt(path.read_bytes(), 'new password') == data
+    with pytest.raises(ValueError):
+        decrypt(path.read_bytes(), PASSWORD)
+
+    rekey_image(str(path), 'new password', PASSWORD, add=True)
+    assert decrypt(path.read_bytes(), PASSWORD) == data
+    assert decrypt(path.read_bytes(), 'new password') == data
+
+
+def test_rekey_needs_envelope_mode(encrypt, tmp_path):
+    path = tmp_path / 'image.bin'
+    path.write_bytes(encrypt(payload(100)))
+    with pytest.raises(ValueError, match='envelope mode'):
+        rekey_image(str(path), PASSWORD, 'new password')
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_random_access(encrypt, tmp_path, compression):
+    data = payload(10 * CHUNK_SIZE + 123)
+    path = tmp_path / 'image.bin'
+    path.write_bytes(encrypt(data, compression=compression))
+    rng = random.Random(2)
+    with open_encrypted(str(path), PASSWORD) as f:
+        assert f.seek(0, io.SEEK_END) == len(data)
+        for _ in range(30):
+            offset, size = rng.randrange(len(data)), rng.randrange(3 * CHUNK_SIZE)
+            f.seek(offset)
+            assert f.read(size) == data[offset:offset + size]
+
+
+def test_random_access_tampered_chunk(encrypt, tmp_path):
+    container = bytearray(encrypt(payload(3 * CHUNK_SIZE)))
+    container[payload_start(container) + CHUNK_SIZE + TAG_SIZE + 5] ^= 1
+    path = tmp_path / 'image.bin'
+    path.write_bytes(bytes(container))
+    with open_encrypted(str(path), PASSWORD) as f:
+        assert f.read(CHUNK_SIZE) == payload(3 * CHUNK_SIZE)[:CHUNK_SIZE]
+        with pytest.raises(ValueError):
+            f.read(CHUNK_SIZE)
+
+
+def test_random_access_legacy(tmp_path):
+    data = payload(3 * CHUNK_SIZE)
+    path = tmp_path / 'image.bin'
+    path.write_bytes(legacy_container(data))
+    with open_encrypted(str(path), PASSWORD) as f:
+        f.seek(CHUNK_SIZE)
+        assert f.read() == data[CHUNK_SIZE:]
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_push_api_round_trip(compression):
+    data = payload(5 * CHUNK_SIZE + 3)
+    encryptor = StreamEncryptor(PASSWORD, CHUNK_SIZE, compression=compression)
+    container = b''.join(encryptor.feed(data[i:i + 700]) for i in range(0, len(data), 700)) + encryptor.finish()
+    decryptor = StreamDecryptor(PASSWORD)
+    plain = b''.join(decryptor.feed(container[i:i + 333]) for i in range(0, len(container), 333))
+    assert plain + decryptor.finish() == data
+
+
+def test_push_api_truncated():
+    encryptor = StreamEncryptor(PASSWORD, CHUNK_SIZE)
+    container = encryptor.feed(payload(3 * CHUNK_SIZE)) + encryptor.finish()
+    decryptor = StreamDecryptor(PASSWORD)
+    decryptor.feed(container[:-TAG_SIZE])
+    with pytest.raises(ValueError):
+        decryptor.finish()
+
+
+class Pipe(io.RawIOBase):
+    """A non-seekable reader, like stdin."""
+
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._data.read(min(len(buffer), 100))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@pytest.mark.parametrize('options', [{}, {'envelope': True}])
+def test_bytes_and_stream_round_trip(options):
+    data = payload(4 * CHUNK_SIZE + 9)
+    container = encrypt_bytes(data, PASSWORD, chunk_size=CHUNK_SIZE, **options)
+    assert decrypt_bytes(container, PASSWORD) == data
+    dst = io.BytesIO()
+    decrypt_stream(Pipe(container), dst, PASSWORD)
+    assert dst.getvalue() == data
+    dst = io.BytesIO()
+    decrypt_stream(Pipe(legacy_container(data)), dst, PASSWORD)
+    assert dst.getvalue() == data
+
+
+def test_cli_pipe():
+    data = payload(3 * CHUNK_SIZE)
+    cli = [sys.executable, os.path.join(os.path.dirname(__file__), '..', 'pixel_shield.py')]
+    sealed = subprocess.run(cli + ['encrypt', '--input', '-', '--output', '-', '--key', PASSWORD],
+                            input=data, capture_output=True, check=True).stdout
+    assert decrypt_bytes(sealed, PASSWORD) == data
+    plain = subprocess.run(cli + ['decrypt', '--input', '-', '--output', '-', '--key', PASSWORD],
+                           input=sealed, capture_output=True, check=True).stdout
+    assert plain == data
+
+
+def test_stage_metrics(encrypt, decrypt):
+    data = payload(4 * CHUNK_SIZE)
+    with collect_metrics() as stats:
+        container = encrypt(data, compression='zlib', threads=2)
+    stages = stats.as_dict()['stages']
+    assert stages[STAGE_READ]['bytes'] == len(data)
+    assert stages[STAGE_COMPRESS]['bytes'] == len(data)
+    assert stages[STAGE_WRITE]['bytes'] == len(container)
+    assert STAGE_KDF in stages and STAGE_CIPHER in stages
+
+    with collect_metrics() as stats:
+        decrypt(container)
+    stages = stats.as_dict()['stages']
+    assert stages[STAGE_READ]['bytes'] >= len(container)  # The magic is sniffed first
+    assert stages[STAGE_WRITE]['bytes'] == len(data)
+    assert STAGE_DECOMPRESS in stages and STAGE_COMPRESS not in stages
+
+
+def test_auto_compression_trial_is_its_own_stage(tmp_path):
+    data = b'BM' + bytes(5 * CHUNK_SIZE)
+    (tmp_path / 'scan.bmp').write_bytes(data)
+    with collect_metrics() as stats:
+        encrypt_image(str(tmp_path / 'scan.bmp'), str(tmp_path / 'sealed.bin'), PASSWORD, chunk_size=CHUNK_SIZE)
+    stages = stats.as_dict()['stages']
+    assert stages[STAGE_COMPRESS]['bytes'] == len(data)
+    assert 0 < stages[STAGE_TRIAL]['bytes'] <= len(data)
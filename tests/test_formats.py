@@ -0,0 +1,96 @@
+import pytest
+
+from tools.formats import SNIFF_SIZE, classify, classify_many, detect_format, is_supported_image, with_format_extension
+from tools.image_utils import encrypt_image, read_image_format
+
+
+def ftyp(major: bytes, *compatible: bytes) -> bytes:
+    box = major + b'\x00\x00\x00\x00' + b''.join(compatible)
+    return (8 + len(box)).to_bytes(4, 'big') + b'ftyp' + box
+
+
+@pytest.mark.parametrize('head, expected', [
+    (b'\xff\xd8\xff\xe0\x00\x10JFIF', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR', 'PNG'),
+    (b'GIF87a\x01\x00', 'GIF'),
+    (b'GIF89a\x01\x00', 'GIF'),
+    (b'RIFF\x24\x00\x00\x00WEBPVP8 ', 'WebP'),
+    (b'RIFF\x24\x00\x00\x00WAVEfmt ', None),
+    (b'II*\x00\x10\x00\x00\x00CR\x02\x00', 'RAW'),
+    (b'II*\x00\x08\x00\x00\x00', 'TIFF'),
+    (b'MM\x00*\x00\x00\x00\x08', 'TIFF'),
+    (b'II+\x00\x08\x00\x00\x00', 'TIFF'),
+    (b'BM\x36\x00\x0c\x00\x00\x00\x00\x00\x36\x00', 'BMP'),
+    (b'BM not a bitmap', None),
+    (b'\x00\x00\x01\x00\x01\x00\x10\x10', 'ICO'),
+    (b'/* XPM */\nstatic char', 'XPM'),
+    (b'#define icon_width 16\n', 'XBM'),
+    (b'<svg xmlns="http://www.w3.org/2000/svg">', 'SVG'),
+    (b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg">', 'SVG'),
+    (b'\xef\xbb\xbf<svg>', 'SVG'),
+    (b'<?xml version="1.0"?>\n<html>', None),
+    (b'P1\n2 2\n', 'PBM'),
+    (b'P5 2 2 255\n', 'PGM'),
+    (b'P6\t2 2 255\n', 'PPM'),
+    (b'P7\n', None),
+    (ftyp(b'heic', b'mif1', b'heic'), 'HEIC'),
+    (ftyp(b'mif1', b'mif1', b'heic'), 'HEIC'),
+    (ftyp(b'avif', b'mif1', b'avif'), 'AVIF'),
+    (ftyp(b'mif1', b'mif1', b'avif'), 'AVIF'),
+    (ftyp(b'isom', b'isom', b'mp41'), None),
+    (b'', None),
+    (b'plain text', None),
+])
+def test_detect_format(head, expected):
+    assert detect_format(head) == expected
+
+
+@pytest.mark.parametrize('head, extension, expected', [
+    (b'II*\x00\x08\x00\x00\x00', '.dng', 'RAW'),
+    (b'MM\x00*\x00\x00\x00\x08', '.NEF', 'RAW'),
+    (b'II*\x00\x08\x00\x00\x00', '.tif', 'TIFF'),
+    (b'\x12\x34 headerless dump', '.raw', 'RAW'),
+    (b'\x12\x34 headerless dump', '.png', None),
+    (b'\x89PNG\r\n\x1a\n', '.jpg', 'PNG'),
+])
+def test_extension_hint(head, extension, expected):
+    assert detect_format(head, extension) == expected
+
+
+def test_classify_reads_content(tmp_path):
+    (tmp_path / 'renamed.jpg').write_bytes(b'\x89PNG\r\n\x1a\n' + bytes(1000))
+    (tmp_path / 'fake.png').write_bytes(b'not an image')
+    assert classify(str(tmp_path / 'renamed.jpg')) == 'PNG'
+    assert classify(str(tmp_path / 'fake.png')) is None
+    assert classify(str(tmp_path / 'missing.png')) is None
+
+
+def test_classify_many_keeps_order(tmp_path):
+    heads = [b'\x89PNG\r\n\x1a\n', b'GIF89a', b'nothing', b'\xff\xd8\xff']
+    paths = []
+    for i in range(50):
+        path = tmp_path / f'{i}.img'
+        path.write_bytes(heads[i % len(heads)] + bytes(2 * SNIFF_SIZE))
+        paths.append(str(path))
+    expected = [('PNG', 'GIF', None, 'JPEG')[i % len(heads)] for i in range(50)]
+    assert list(classify_many(paths, workers=2)) == list(zip(paths, expected))
+
+
+def test_with_format_extension():
+    assert with_format_extension('scan', 'TIFF') == 'scan.tiff'
+    assert with_format_extension('scan.TIF', 'TIFF') == 'scan.TIF'
+    assert with_format_extension('scan.bin', 'JPEG') == 'scan.bin.jpg'
+    assert with_format_extension('scan', None) == 'scan'
+
+
+def test_is_supported_image(tmp_path):
+    (tmp_path / 'fake.png').write_text('not an image')
+    assert not is_supported_image(str(tmp_path / 'fake.png'))[0]
+    assert is_supported_image(str(tmp_path / 'later.png'))[0]
+    assert not is_supported_image(str(tmp_path / 'later.txt'))[0]
+
+
+def test_format_recorded_in_header(tmp_path):
+    (tmp_path / 'photo.dng').write_bytes(b'II*\x00\x08\x00\x00\x00' + bytes(100))
+    encrypt_image(str(tmp_path / 'photo.dng'), str(tmp_path / 'photo.bin'), 'correct horse')
+    assert read_image_format(str(tmp_path / 'photo.bin')) == 'RAW'
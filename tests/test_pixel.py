@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+from tools.pixel_crypto import decrypt_pixels, encrypt_pixels
+
+PASSWORD = 'correct horse'
+
+
+def make_image(path, mode: str, size=(37, 21)):
+    rng = np.random.default_rng(0)
+    bands = len(Image.new(mode, (1, 1)).getbands())
+    pixels = rng.integers(0, 256, (size[1], size[0], bands), dtype=np.uint8)
+    Image.fromarray(pixels.squeeze(axis=2) if bands == 1 else pixels).convert(mode).save(path)
+    return np.array(Image.open(path))
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+@pytest.mark.parametrize('container', ['png', 'tiff'])
+def test_round_trip(tmp_path, mode, container):
+    original = make_image(tmp_path / 'in.png', mode)
+    encrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / f'sealed.{container}'), PASSWORD, rows_per_block=4)
+
+    with Image.open(tmp_path / f'sealed.{container}') as sealed:
+        assert sealed.size == (37, 21) and sealed.mode == mode
+        assert not np.array_equal(np.array(sealed), original)
+
+    decrypt_pixels(str(tmp_path / f'sealed.{container}'), str(tmp_path / 'out.png'), PASSWORD, rows_per_block=5)
+    assert np.array_equal(np.array(Image.open(tmp_path / 'out.png')), original)
+
+
+def test_wrong_password(tmp_path):
+    make_image(tmp_path / 'in.png', 'RGB')
+    encrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / 'sealed.png'), PASSWORD)
+    with pytest.raises(ValueError, match='Incorrect password or corrupted file'):
+        decrypt_pixels(str(tmp_path / 'sealed.png'), str(tmp_path / 'out.png'), 'wrong')
+    assert not (tmp_path / 'out.png').exists()
+
+
+def test_modified_pixels(tmp_path):
+    make_image(tmp_path / 'in.png', 'RGB')
+    encrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / 'sealed.png'), PASSWORD)
+    with Image.open(tmp_path / 'sealed.png') as sealed:
+        sealed.load()
+        info = PngImagePlugin.PngInfo()
+        info.add_text('PixelShield', sealed.info['PixelShield'])
+        sealed.putpixel((3, 3), tuple(255 - v for v in sealed.getpixel((3, 3))))
+        sealed.save(tmp_path / 'edited.png', pnginfo=info)
+    with pytest.raises(ValueError):
+        decrypt_pixels(str(tmp_path / 'edited.png'), str(tmp_path / 'out.png'), PASSWORD)
+
+
+def test_plain_image_is_rejected(tmp_path):
+    make_image(tmp_path / 'in.png', 'RGB')
+    with pytest.raises(ValueError, match='not encrypted in pixel mode'):
+        decrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / 'out.png'), PASSWORD)
+
+
+def test_output_must_be_png_or_tiff(tmp_path):
+    make_image(tmp_path / 'in.png', 'RGB')
+    with pytest.raises(ValueError, match='PNG or TIFF'):
+        encrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / 'sealed.jpg'), PASSWORD)
+
+
+def make_deep_image(path, mode: str, size=(37, 21)):
+    """A random 16-bit (`I;16`) or 32-bit (`I`) grayscale image."""
+    rng = np.random.default_rng(0)
+    dtype = np.dtype('<u2') if mode == 'I;16' else np.dtype('<i4')
+    pixels = rng.integers(0, np.iinfo(dtype).max, (size[1], size[0]), dtype=dtype)
+    Image.fromarray(pixels).save(path)
+    return np.array(Image.open(path))
+
+
+@pytest.mark.filterwarnings('error')
+@pytest.mark.parametrize('mode,container', [('I;16', 'png'), ('I;16', 'tiff'), ('I', 'tiff')])
+def test_round_trip_deep_modes(tmp_path, mode, container):
+    original = make_deep_image(tmp_path / f'in.{container}', mode)
+    encrypt_pixels(str(tmp_path / f'in.{container}'), str(tmp_path / f'sealed.{container}'), PASSWORD)
+    with Image.open(tmp_path / f'sealed.{container}') as sealed:
+        assert sealed.mode == mode
+
+    decrypt_pixels(str(tmp_path / f'sealed.{container}'), str(tmp_path / f'out.{container}'), PASSWORD)
+    assert np.array_equal(np.array(Image.open(tmp_path / f'out.{container}')), original)
+
+
+@pytest.mark.filterwarnings('error')
+def test_round_trip_la(tmp_path):
+    original = make_image(tmp_path / 'in.png', 'LA')
+    encrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / 'sealed.png'), PASSWORD)
+    decrypt_pixels(str(tmp_path / 'sealed.png'), str(tmp_path / 'out.png'), PASSWORD)
+    assert np.array_equal(np.array(Image.open(tmp_path / 'out.png')), original)
+
+
+def test_unsupported_modes_are_rejected(tmp_path):
+    make_deep_image(tmp_path / 'in.tiff', 'I')
+    with pytest.raises(ValueError, match='losslessly as TIFF'):
+        encrypt_pixels(str(tmp_path / 'in.tiff'), str(tmp_path / 'sealed.png'), PASSWORD)
+    make_image(tmp_path / 'in.png', 'P')
+    with pytest.raises(ValueError, match="does not support 'P' images"):
+        encrypt_pixels(str(tmp_path / 'in.png'), str(tmp_path / 'sealed.png'), PASSWORD)
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from tools.scheduler import CANCELLED, DONE, FAILED, JobScheduler, run_job
+
+PASSWORD = 'correct horse'
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / 'in' / f'{i}.png'
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(os.urandom(3000 + i))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_encrypt_then_decrypt(tmp_path, images, use_processes):
+    with JobScheduler(workers=2, use_processes=use_processes) as scheduler:
+        jobs = [scheduler.submit('encrypt', str(path), str(tmp_path / 'enc' / f'{path.stem}.bin'), PASSWORD,
+                                 chunk_size=1024) for path in images]
+        scheduler.wait()
+        jobs += [scheduler.submit('decrypt', str(tmp_path / 'enc' / f'{path.stem}.bin'),
+                                  str(tmp_path / 'out' / path.name), PASSWORD) for path in images]
+        scheduler.wait()
+
+    assert [job.status for job in jobs] == [DONE] * 8
+    for path in images:
+        assert (tmp_path / 'out' / path.name).read_bytes() == path.read_bytes()
+
+
+def test_failed_job_and_retry(tmp_path, images):
+    run_job('encrypt', str(images[0]), str(tmp_path / 'a.bin'), PASSWORD)
+    with JobScheduler(workers=1) as scheduler:
+        job = scheduler.submit('decrypt', str(tmp_path / 'a.bin'), str(tmp_path / 'a.png'), 'wrong')
+        scheduler.wait()
+        assert job.status == FAILED and 'Incorrect password' in job.error
+
+        scheduler.retry(job)
+        scheduler.wait()
+    assert job.status == FAILED and job.attempts == 2
+    assert not (tmp_path / 'a.png').exists()
+
+
+def test_cancel_queued_job(tmp_path, images):
+    with JobScheduler(workers=1, max_in_flight=1) as scheduler:
+        jobs = [scheduler.submit('encrypt', str(path), str(tmp_path / f'{path.stem}.bin'), PASSWORD)
+                for path in images]
+        scheduler.cancel(jobs[-1])
+        scheduler.wait()
+    assert jobs[-1].status == CANCELLED
+    assert not (tmp_path / '3.bin').exists()
+    assert [job.status for job in jobs[:-1]] == [DONE] * 3
+
+
+def test_keep_finished(tmp_path, images):
+    with JobScheduler(workers=2, keep_finished=False) as scheduler:
+        for path in images:
+            scheduler.submit('encrypt', str(path), str(tmp_path / f'{path.stem}.bin'), PASSWORD)
+        scheduler.wait()
+        assert scheduler.jobs == []
+
+
+def test_run_job_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        run_job('encrypt', str(tmp_path / 'missing.png'), str(tmp_path / 'out.bin'), PASSWORD)
+    with pytest.raises(ValueError, match='Unknown mode'):
+        run_job('shred', str(tmp_path / 'missing.png'), str(tmp_path / 'out.bin'), PASSWORD)
@@ -0,0 +1,171 @@
+import os
+
+import pytest
+
+import tools.sync
+from tools.batch import rekey_directory
+from tools.image_utils import decrypt_image, encrypt_image
+from tools.sync import MANIFEST_NAME, load_manifest, sync_directory
+
+PASSWORD = 'correct horse'
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    source, mirror = tmp_path / 'photos', tmp_path / 'mirror'
+    (source / 'trip').mkdir(parents=True)
+    (source / 'a.png').write_bytes(PNG + os.urandom(3000))
+    (source / 'trip' / 'b.png').write_bytes(PNG + os.urandom(2000))
+    (source / 'notes.txt').write_text('not an image')
+    return source, mirror
+
+
+def sync(source, mirror, password=PASSWORD, **options):
+    result = sync_directory(str(source), str(mirror), password, workers=2, **options)
+    assert result.failures == []
+    return result
+
+
+def mirrored(mirror) -> dict:
+    """Source name -> ciphertext path of every manifest entry."""
+    return {name: mirror / entry.output for name, entry in load_manifest(str(mirror), PASSWORD).items()}
+
+
+def assert_mirrors(source, mirror, tmp_path):
+    outputs = mirrored(mirror)
+    assert sorted(outputs) == sorted(str(p.relative_to(source)).replace(os.sep, '/')
+                                     for p in source.rglob('*.png'))
+    for name, output in outputs.items():
+        decrypt_image(str(output), str(tmp_path / 'out'), PASSWORD)
+        assert (tmp_path / 'out').read_bytes() == (source / name).read_bytes()
+    ciphertexts = {p for p in mirror.rglob('*') if p.is_file() and p.name != MANIFEST_NAME}
+    assert ciphertexts == set(outputs.values())
+
+
+def test_incremental_runs(dirs, tmp_path):
+    source, mirror = dirs
+    assert sync(source, mirror).encrypted == 2
+    assert_mirrors(source, mirror, tmp_path)
+
+    result = sync(source, mirror)
+    assert (result.encrypted, result.unchanged) == (0, 2)
+
+    (source / 'a.png').write_bytes(PNG + os.urandom(3001))
+    os.utime(source / 'trip' / 'b.png')  # Touched only
+    result = sync(source, mirror)
+    assert (result.encrypted, result.unchanged) == (1, 1)
+    assert_mirrors(source, mirror, tmp_path)
+
+
+def test_deleted_source(dirs, tmp_path):
+    source, mirror = dirs
+    sync(source, mirror)
+    (source / 'trip' / 'b.png').unlink()
+    result = sync(source, mirror)
+    assert (result.removed, result.unchanged) == (1, 1)
+    assert_mirrors(source, mirror, tmp_path)
+
+
+def test_duplicates_share_a_ciphertext(dirs, tmp_path):
+    source, mirror = dirs
+    (source / 'copy.png').write_bytes((source / 'a.png').read_bytes())
+    result = sync(source, mirror)
+    assert (result.encrypted, result.deduplicated) == (2, 1)
+    assert_mirrors(source, mirror, tmp_path)
+    outputs = mirrored(mirror)
+    assert outputs['copy.png'].read_bytes() == outputs['a.png'].read_bytes()
+
+
+def test_renamed_source_is_not_encrypted_again(dirs, tmp_path):
+    source, mirror = dirs
+    sync(source, mirror)
+    (source / 'a.png').rename(source / 'trip' / 'renamed.png')
+    result = sync(source, mirror)
+    assert (result.encrypted, result.deduplicated, result.removed) == (0, 1, 1)
+    assert_mirrors(source, mirror, tmp_path)
+
+
+def test_wrong_password(dirs):
+    source, mirror = dirs
+    sync(source, mirror)
+    with pytest.raises(ValueError, match='password of the earlier runs'):
+        sync_directory(str(source), str(mirror), 'wrong')
+
+
+def test_unreadable_source_keeps_its_ciphertext(dirs, tmp_path, monkeypatch):
+    source, mirror = dirs
+    sync(source, mirror)
+    before = mirrored(mirror)
+    (source / 'a.png').write_bytes(PNG + os.urandom(3001))
+    unreadable = str(source / 'a.png')
+
+    def read_format(path):
+        if path == unreadable:
+            raise PermissionError(13, 'Permission denied', path)
+        return real_read_format(path)
+
+    real_read_format = tools.sync.read_format
+    monkeypatch.setattr(tools.sync, 'read_format', read_format)
+    result = sync_directory(str(source), str(mirror), PASSWORD, workers=2)
+    assert [path for path, _ in result.failures] == [unreadable]
+    assert result.removed == 0
+    assert mirrored(mirror) == before
+    assert before['a.png'].exists()
+
+    monkeypatch.undo()
+    assert sync(source, mirror).encrypted == 1
+    assert_mirrors(source, mirror, tmp_path)
+
+
+def test_source_removed_during_the_walk(dirs, tmp_path, monkeypatch):
+    source, mirror = dirs
+    sync(source, mirror)
+    (source / 'a.png').touch()
+    vanished = str(source / 'a.png')
+    real_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        if path == vanished:
+            raise FileNotFoundError(2, 'No such file or directory', path)
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(tools.sync.os, 'stat', stat)
+    result = sync_directory(str(source), str(mirror), PASSWORD, workers=2)
+    monkeypatch.undo()
+    assert [path for path, _ in result.failures] == [vanished]
+    assert (result.unchanged, result.removed) == (1, 0)
+    assert_mirrors(source, mirror, tmp_path)
+
+
+def test_rekey_vault(dirs, tmp_path):
+    source, mirror = dirs
+    sync(source, mirror, envelope=True)
+    result = rekey_directory(str(mirror), PASSWORD, 'new password')
+    assert (result.files, result.failures) == (3, [])
+    assert sync(source, mirror, 'new password').unchanged == 2
+    with pytest.raises(ValueError):
+        load_manifest(str(mirror), PASSWORD)
+
+
+def test_rekey_vault_with_a_file_not_in_envelope_mode(dirs):
+    source, mirror = dirs
+    sync(source, mirror, envelope=True)
+    # Written without envelope mode: its password can't be changed in place
+    encrypt_image(str(source / 'a.png'), str(mirror / 'extra.bin'), PASSWORD)
+    before = {p: p.read_bytes() for p in mirror.rglob('*') if p.is_file()}
+    result = rekey_directory(str(mirror), PASSWORD, 'new password')
+    assert result.files == 0
+    assert str(mirror / 'extra.bin') in dict(result.failures)
+    assert str(mirror / MANIFEST_NAME) in dict(result.failures)
+    assert {p: p.read_bytes() for p in mirror.rglob('*') if p.is_file()} == before
+    assert sync(source, mirror).unchanged == 2
+
+
+def test_rekey_vault_keeps_the_manifest_when_a_file_fails(dirs):
+    source, mirror = dirs
+    sync(source, mirror, envelope=True)
+    encrypt_image(str(source / 'a.png'), str(mirror / 'other.bin'), 'other password', envelope=True)
+    result = rekey_directory(str(mirror), PASSWORD, 'new password')
+    assert sorted(dict(result.failures)) == [str(mirror / MANIFEST_NAME), str(mirror / 'other.bin')]
+    assert load_manifest(str(mirror), PASSWORD)
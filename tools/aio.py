@@ -0,0 +1,228 @@
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple, Union
+
+from tools.compression import AUTO
+from tools.suites import AUTO as AUTO_CIPHER
+from tools.image_utils import (
+    DEFAULT_CHUNK_SIZE, KeySession, StreamDecryptor, StreamEncryptor, atomic_output,
+    decrypt_stream, encrypt_stream, make_preview,
+)
+
+# Async entry points for event-loop based services (aiohttp, FastAPI, ...).
+#
+# Key derivation, sealing and file I/O all run on a bounded thread pool, so
+# the event loop only ever awaits. Async readers are consumed on the loop and
+# each chunk is handed to the pool on its own, so a slow upload never holds a
+# worker thread while it waits for the network.
+
+# Paths, in-memory bytes, objects with `async read(n)` or async iterables of bytes
+Source = Union[str, os.PathLike, bytes, bytearray, memoryview, Any]
+
+DEFAULT_MAX_WORKERS = min(8, (os.cpu_count() or 1) + 1)
+DEFAULT_CONCURRENCY = 8
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def default_executor() -> ThreadPoolExecutor:
+    """Return the shared pool used when no `executor` is given."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(DEFAULT_MAX_WORKERS, thread_name_prefix='pixelshield')
+    return _executor
+
+
+async def _call(executor: Executor, func, *args, cancel: Optional[threading.Event] = None):
+    """Run `func` on `executor`; if the caller is cancelled, wait for `func` before propagating.
+
+    Waiting keeps cleanup ordered (a partial output is never removed while a
+    write is still running). `cancel` is set first, so long calls stop early.
+    """
+    future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if cancel is not None:
+            cancel.set()
+        try:
+            await future
+        except Exception:
+            pass  # The cancellation is what gets reported
+        raise
+
+
+def _is_path(source: Source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+
+async def _iter_source(source: Source, chunk_size: int) -> AsyncIterator[bytes]:
+    """Yield the data of an async reader or async iterable in pieces of at most `chunk_size`."""
+    if hasattr(source, 'read'):
+        while True:
+            data = await source.read(chunk_size)
+            if not data:
+                return
+            yield data
+    elif hasattr(source, '__aiter__'):
+        async for data in source:
+            if data:
+                yield data
+    else:
+        raise TypeError(f"Unsupported source type '{type(source).__name__}'.")
+
+
+async def _pump(source: Source, transform, output_path: Optional[str], executor: Executor,
+                read_size: int) -> Optional[bytes]:
+    """Push an async source through a `StreamEncryptor`/`StreamDecryptor`, one piece at a time."""
+    if output_path is None:
+        output, dst = None, io.BytesIO()
+    else:
+        # Entered and exited on the pool: atomic_output creates, replaces and removes files
+        output = atomic_output(output_path)
+        dst = await _call(executor, output.__enter__)
+
+    try:
+        async for data in _iter_source(source, read_size):
+            sealed = await _call(executor, transform.feed, data)
+            if sealed:
+                await _call(executor, dst.write, sealed)
+        await _call(executor, dst.write, await _call(executor, transform.finish))
+    except BaseException as e:
+        if output is not None:
+            await _call(executor, output.__exit__, type(e), e, e.__traceback__)
+        raise
+
+    if output is None:
+        return dst.getvalue()
+    await _call(executor, output.__exit__, None, None, None)
+    return None
+
+
+def _encrypt_sync(source: Source, output_path: Optional[str], password: str, options: dict,
+                  cancel: threading.Event) -> Optional[bytes]:
+    preview_size = options.pop('preview_size', None)
+    if _is_path(source):
+        preview = make_preview(source, preview_size) if preview_size else None
+        src = open(source, 'rb')
+        size = os.path.getsize(source)
+    else:
+        preview = make_preview(io.BytesIO(source), preview_size) if preview_size else None
+        src = io.BytesIO(source)
+        size = len(source)
+
+    with src:
+        if output_path is None:
+            dst = io.BytesIO()
+            encrypt_stream(src, dst, password, preview=preview, cancel=cancel, size=size, **options)
+            return dst.getvalue()
+        with atomic_output(output_path) as dst:
+            encrypt_stream(src, dst, password, preview=preview, cancel=cancel, size=size, **options)
+    return None
+
+
+def _decrypt_sync(source: Source, output_path: Optional[str], password: str, options: dict,
+                  cancel: threading.Event) -> Optional[bytes]:
+    if _is_path(source):
+        src = open(source, 'rb')
+        size = os.path.getsize(source)
+    else:
+        src = io.BytesIO(source)
+        size = len(source)
+
+    with src:
+        if output_path is None:
+            dst = io.BytesIO()
+            decrypt_stream(src, dst, password, cancel=cancel, size=size, **options)
+            return dst.getvalue()
+        with atomic_output(output_path) as dst:
+            decrypt_stream(src, dst, password, cancel=cancel, size=size, **options)
+    return None
+
+
+async def _run(mode: str, source: Source, output_path: Optional[str], password: str,
+               executor: Optional[Executor], options: dict) -> Optional[bytes]:
+    executor = executor or default_executor()
+    if _is_path(source) and not os.path.exists(source):
+        raise FileNotFoundError(f"Input file '{source}' does not exist.")
+
+    if _is_path(source) or isinstance(source, (bytes, bytearray, memoryview)):
+        # The whole job fits in one executor call, which checks `cancel` between chunks
+        run = _encrypt_sync if mode == 'encrypt' else _decrypt_sync
+        cancel = threading.Event()
+        return await _call(executor, run, source, output_path, password, dict(options), cancel, cancel=cancel)
+
+    session = options.get('session')
+    if mode == 'encrypt':
+        if options.get('preview_size'):
+            raise ValueError("Previews need the whole image; pass a path or bytes to embed one.")
+        chunk_size = options.get('chunk_size', DEFAULT_CHUNK_SIZE)
+        transform = await _call(executor, StreamEncryptor, password, chunk_size, session,
+                                options.get('envelope', False), None, options.get('image_format'),
+                                options.get('compression', AUTO), options.get('kdf'),
+                                options.get('cipher', AUTO_CIPHER))
+    else:
+        chunk_size = DEFAULT_CHUNK_SIZE
+        transform = StreamDecryptor(password, session)  # Derives the key inside feed()
+    return await _pump(source, transform, output_path, executor, chunk_size)
+
+
+async def encrypt_image_async(source: Source, output_path: Optional[str], password: str, *,
+                              timeout: Optional[float] = None, executor: Optional[Executor] = None,
+                              **options) -> Optional[bytes]:
+    """Encrypt a path, bytes or async reader without blocking the event loop.
+
+    The container is written to `output_path`, or returned as bytes when it is
+    None. `options` are those of `encrypt_image` (`chunk_size`, `session`,
+    `envelope`, `preview_size`). On timeout (`asyncio.TimeoutError`) or task
+    cancellation the work stops after the current chunk and no output is left behind.
+    """
+    return await asyncio.wait_for(_run('encrypt', source, output_path, password, executor, options), timeout)
+
+
+async def decrypt_image_async(source: Source, output_path: Optional[str], password: str, *,
+                              timeout: Optional[float] = None, executor: Optional[Executor] = None,
+                              **options) -> Optional[bytes]:
+    """Decrypt a path, bytes or async reader without blocking the event loop.
+
+    The image is written to `output_path`, or returned as bytes when it is None.
+    `options` are those of `decrypt_image` (`threads`, `session`); timeouts and
+    cancellation behave as in `encrypt_image_async`.
+    """
+    return await asyncio.wait_for(_run('decrypt', source, output_path, password, executor, options), timeout)
+
+
+async def run_batch_async(mode: str, items: Iterable[Tuple[Source, Optional[str]]], password: str, *,
+                          concurrency: int = DEFAULT_CONCURRENCY, timeout: Optional[float] = None,
+                          executor: Optional[Executor] = None, **options) -> List[Any]:
+    """Encrypt or decrypt `(source, output path)` pairs, at most `concurrency` at a time.
+
+    Returns one entry per item, in order: the call's result (None or bytes) or
+    the exception it raised. `timeout` applies to each item and a shared
+    `KeySession` keeps PBKDF2 to one run for the whole batch.
+    """
+    if mode not in ('encrypt', 'decrypt'):
+        raise ValueError(f"Unknown mode '{mode}'.")
+    run = encrypt_image_async if mode == 'encrypt' else decrypt_image_async
+    limit = asyncio.Semaphore(concurrency)
+    session = options.pop('session', None)
+    own_session = session is None  # Only a session created here is cleared afterwards
+    if own_session:
+        session = KeySession(password, kdf=options.get('kdf'))
+
+    async def run_one(source: Source, output_path: Optional[str]):
+        async with limit:
+            return await run(source, output_path, password, timeout=timeout, executor=executor,
+                             session=session, **options)
+
+    try:
+        return await asyncio.gather(*(run_one(source, output_path) for source, output_path in items),
+                                    return_exceptions=True)
+    finally:
+        if own_session:
+            session.clear()
@@ -0,0 +1,247 @@
+import io
+import json
+import os
+import struct
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from tools.image_utils import (
+    DEFAULT_CHUNK_SIZE, SALT_SIZE, TAG_SIZE, atomic_output, chunk_nonce, derive_subkey, iter_chunks,
+)
+from tools.batch import iter_files
+from tools.formats import classify_many
+from tools.suites import Kdf, Pbkdf2, unpack_kdf
+
+# Archive layout (all integers big-endian):
+#
+#   ARCHIVE_MAGIC | version (u8) | KDF settings (u8 length + value) | member 0 | member 1 | ...
+#   | index | trailer
+#
+# Every member and the index are sealed as chunk streams, each under its own
+# HKDF subkey of the archive key, and the trailer at the very end points at
+# the current index. Appending writes new members, a new index and a new
+# trailer after the old ones, so existing member data is never rewritten.
+ARCHIVE_MAGIC = b'PXSA'
+ARCHIVE_VERSION = 1
+
+_TRAILER = struct.Struct(f'>QQ{SALT_SIZE}s4s')  # index offset, index length, index salt, magic
+_NONCE_PREFIX = bytes(7)  # Every stream has its own subkey, so a fixed prefix is safe
+
+
+@dataclass
+class ArchiveMember:
+    """Location of one image inside an archive."""
+    name: str
+    offset: int
+    length: int  # Stored (sealed) size
+    size: int  # Original size
+    salt: str  # Hex encoded HKDF salt of the member key
+    chunk_size: int
+
+
+def _stream_aad(name: str) -> bytes:
+    return ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]) + name.encode()
+
+
+def _seal_stream(src: BinaryIO, dst: BinaryIO, key: bytes, aad: bytes, chunk_size: int) -> Tuple[int, int]:
+    """Seal `src` into `dst` chunk by chunk, returning `(plaintext size, sealed size)`."""
+    aead = AESGCM(key)
+    size = length = 0
+    for index, (chunk, last) in enumerate(iter_chunks(src, chunk_size)):
+        sealed = aead.encrypt(chunk_nonce(_NONCE_PREFIX, index, last), chunk, aad)
+        dst.write(sealed)
+        size += len(chunk)
+        length += len(sealed)
+    return size, length
+
+
+def _open_stream(src: BinaryIO, length: int, key: bytes, aad: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Yield the plaintext of a sealed stream of `length` bytes starting at the current position."""
+    aead = AESGCM(key)
+    index = 0
+    while True:
+        sealed = src.read(min(chunk_size + TAG_SIZE, length))
+        length -= len(sealed)
+        if len(sealed) < TAG_SIZE or length < 0:
+            raise ValueError("Archive is truncated.")
+        try:
+            yield aead.decrypt(chunk_nonce(_NONCE_PREFIX, index, length == 0), sealed, aad)
+        except InvalidTag as e:
+            raise ValueError("Decryption failed. Incorrect password or corrupted archive.") from e
+        if length == 0:
+            return
+        index += 1
+
+
+class _Archive:
+    """An open archive: its key and current index."""
+
+    def __init__(self, f: BinaryIO, key: bytes, members: Dict[str, ArchiveMember]):
+        self.f = f
+        self.key = key
+        self.members = members
+
+    @classmethod
+    def create(cls, f: BinaryIO, password: str, kdf: Optional[Kdf] = None) -> '_Archive':
+        """Write a new archive header to `f`."""
+        kdf = kdf or Pbkdf2()
+        salt = os.urandom(SALT_SIZE)
+        settings = kdf.pack() + salt
+        f.write(ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION, len(settings)]) + settings)
+        return cls(f, kdf.derive(password, salt), {})
+
+    @classmethod
+    def open(cls, f: BinaryIO, password: str) -> '_Archive':
+        """Read the header of an existing archive, derive its key and load the index."""
+        header = f.read(len(ARCHIVE_MAGIC) + 2)
+        if len(header) < len(ARCHIVE_MAGIC) + 2 or header[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            raise ValueError("Not a PixelShield archive.")
+        if header[4] != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version {header[4]}.")
+        kdf, salt = unpack_kdf(f.read(header[5]))
+        if len(salt) != SALT_SIZE:
+            raise ValueError("Unsupported key derivation settings.")
+        archive = cls(f, kdf.derive(password, salt), {})
+        archive.members = archive._read_index()
+        return archive
+
+    def _read_index(self) -> Dict[str, ArchiveMember]:
+        f = self.f
+        end = f.seek(0, os.SEEK_END)
+        if end < _TRAILER.size:
+            raise ValueError("Archive is truncated.")
+        f.seek(end - _TRAILER.size)
+        offset, length, salt, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != ARCHIVE_MAGIC or offset + length > end - _TRAILER.size:
+            raise ValueError("Archive is truncated or has no index.")
+
+        f.seek(offset)
+        key = derive_subkey(self.key, salt)
+        index = b''.join(_open_stream(f, length, key, _stream_aad(''), DEFAULT_CHUNK_SIZE))
+        return {entry['name']: ArchiveMember(**entry) for entry in json.loads(index)}
+
+    def write_index(self):
+        """Seal the index at the end of the file and point a new trailer at it."""
+        f = self.f
+        offset = f.seek(0, os.SEEK_END)
+        salt = os.urandom(SALT_SIZE)
+        index = json.dumps([asdict(member) for member in self.members.values()]).encode()
+        key = derive_subkey(self.key, salt)
+        _, length = _seal_stream(io.BytesIO(index), f, key, _stream_aad(''), DEFAULT_CHUNK_SIZE)
+        f.write(_TRAILER.pack(offset, length, salt, ARCHIVE_MAGIC))
+
+    def add(self, name: str, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Seal the file at `path` at the end of the archive as member `name`."""
+        offset = self.f.seek(0, os.SEEK_END)
+        salt = os.urandom(SALT_SIZE)
+        with open(path, 'rb') as src:
+            key = derive_subkey(self.key, salt)
+            size, length = _seal_stream(src, self.f, key, _stream_aad(name), chunk_size)
+        self.members[name] = ArchiveMember(name, offset, length, size, salt.hex(), chunk_size)
+
+    def extract(self, member: ArchiveMember, dst: BinaryIO):
+        """Decrypt `member` into `dst`, reading only its own bytes."""
+        self.f.seek(member.offset)
+        key = derive_subkey(self.key, bytes.fromhex(member.salt))
+        for plaintext in _open_stream(self.f, member.length, key, _stream_aad(member.name), member.chunk_size):
+            dst.write(plaintext)
+
+
+def _member_name(name: str) -> str:
+    """Normalize a member name to a relative POSIX path."""
+    name = name.replace(os.sep, '/').lstrip('/')
+    parts = [part for part in name.split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        raise ValueError(f"Invalid archive member name '{name}'.")
+    return '/'.join(parts)
+
+
+def pack_archive(archive_path: str, files: Iterable[Tuple[str, str]], password: str,
+                 append: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, kdf: Optional[Kdf] = None) -> int:
+    """Store `(member name, file path)` pairs in an encrypted archive, returning the count added.
+
+    With `append`, members are added to an existing archive (replacing members
+    of the same name in the index) without rewriting the data already stored;
+    `kdf` only applies to new archives.
+    """
+    if append and os.path.exists(archive_path):
+        with open(archive_path, 'r+b') as f:
+            archive = _Archive.open(f, password)
+            original_size = f.seek(0, os.SEEK_END)
+            try:
+                count = _add_members(archive, files, chunk_size)
+                archive.write_index()
+            except BaseException:
+                f.truncate(original_size)  # Leave the archive exactly as it was
+                raise
+        return count
+
+    with atomic_output(archive_path) as f:
+        archive = _Archive.create(f, password, kdf)
+        count = _add_members(archive, files, chunk_size)
+        archive.write_index()
+    return count
+
+
+def _add_members(archive: _Archive, files: Iterable[Tuple[str, str]], chunk_size: int) -> int:
+    count = 0
+    for name, path in files:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Input file '{path}' does not exist.")
+        archive.add(_member_name(name), path, chunk_size)
+        count += 1
+    return count
+
+
+def collect_files(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """Expand files and directories into `(member name, path)` pairs.
+
+    Files are stored under their base name and directory contents under their
+    path relative to the directory; only supported images are picked up.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for file_path, image_format in classify_many(iter_files(path, lambda p: True)):
+                if image_format is not None:
+                    yield os.path.relpath(file_path, path), file_path
+        else:
+            yield os.path.basename(path), path
+
+
+def list_archive(archive_path: str, password: str) -> List[ArchiveMember]:
+    """Return the members of an archive (one KDF and one index decryption)."""
+    with open(archive_path, 'rb') as f:
+        return list(_Archive.open(f, password).members.values())
+
+
+def extract_member(archive_path: str, name: str, output_path: str, password: str):
+    """Decrypt a single member, seeking straight to it."""
+    with open(archive_path, 'rb') as f:
+        archive = _Archive.open(f, password)
+        member = archive.members.get(_member_name(name))
+        if member is None:
+            raise ValueError(f"Archive has no member named '{name}'.")
+        with atomic_output(output_path) as dst:
+            archive.extract(member, dst)
+
+
+def unpack_archive(archive_path: str, output_dir: str, password: str,
+                   names: Optional[Iterable[str]] = None) -> int:
+    """Extract every member (or only `names`) below `output_dir`, returning the count."""
+    with open(archive_path, 'rb') as f:
+        archive = _Archive.open(f, password)
+        members = archive.members.values()
+        if names is not None:
+            wanted = {_member_name(name) for name in names}
+            members = [member for member in members if member.name in wanted]
+        # Read members in file order so extraction is one forward pass
+        members = sorted(members, key=lambda member: member.offset)
+        for member in members:
+            output_path = os.path.join(output_dir, *member.name.split('/'))
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with atomic_output(output_path) as dst:
+                archive.extract(member, dst)
+    return len(members)
@@ -0,0 +1,259 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from tools.compression import AUTO
+from tools.formats import classify_many, with_format_extension
+from tools.image_utils import (
+    FIELD_SLOT, CorruptFileError, KeySession, TruncatedFileError, WrongPasswordError, atomic_output, decrypt_bytes,
+    encrypt_bytes, is_encrypted_container, read_header, read_image_format, rekey_image,
+)
+from tools.scheduler import CANCELLED, DONE, FAILED, Job, JobScheduler
+from tools.suites import AUTO as AUTO_CIPHER, Kdf
+
+ENCRYPTED_SUFFIX = '.bin'
+# Encrypted manifest kept by `tools.sync` in the root of its output directory
+MANIFEST_NAME = '.pixelshield-manifest'
+
+# (input path, output path) pairs handed to the worker processes
+Task = Tuple[str, str]
+
+# Outcomes reported by `verify_status`
+VERIFY_STATUSES = ('ok', 'wrong-password', 'truncated', 'corrupt', 'error')
+
+
+@dataclass
+class BatchResult:
+    """Summary of a directory encryption or decryption run."""
+    files: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+    failures: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+
+def iter_files(root: str, accept: Callable[[str], bool]) -> Iterator[str]:
+    """Walk `root` in a stable order, yielding the files accepted by `accept`."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if accept(path):
+                yield path
+
+
+def _mirror(path: str, input_dir: str, output_dir: str, name: str) -> str:
+    """Map `path` under `input_dir` to `name` in the same relative directory of `output_dir`."""
+    relative_dir = os.path.relpath(os.path.dirname(path), input_dir)
+    return os.path.normpath(os.path.join(output_dir, relative_dir, name))
+
+
+def output_name(path: str, mode: str) -> str:
+    """File name of the result of encrypting (`name.bin`) or decrypting (`name`) `path`.
+
+    Decrypted names get the extension of the format recorded in the header if
+    they do not already carry one of its extensions.
+    """
+    name = os.path.basename(path)
+    if mode == 'encrypt':
+        return name + ENCRYPTED_SUFFIX
+    if name.lower().endswith(ENCRYPTED_SUFFIX):
+        name = name[:-len(ENCRYPTED_SUFFIX)]
+    try:
+        image_format = read_image_format(path)
+    except (OSError, ValueError):
+        image_format = None  # Reported properly when the file is decrypted
+    return with_format_extension(name, image_format)
+
+
+def encryption_tasks(input_dir: str, output_dir: str) -> Iterator[Task]:
+    """Pair every supported image under `input_dir` with its `.bin` path under `output_dir`.
+
+    Images are recognized by their content, a few dozen bytes per file.
+    """
+    for path, image_format in classify_many(iter_files(input_dir, lambda p: True)):
+        if image_format is not None:
+            yield path, _mirror(path, input_dir, output_dir, output_name(path, 'encrypt'))
+
+
+def decryption_tasks(input_dir: str, output_dir: str) -> Iterator[Task]:
+    """Pair every `.bin` file under `input_dir` with its original name under `output_dir`."""
+    for path in iter_files(input_dir, lambda p: p.lower().endswith(ENCRYPTED_SUFFIX)):
+        yield path, _mirror(path, input_dir, output_dir, output_name(path, 'decrypt'))
+
+
+def run_batch(mode: str, tasks: Iterable[Task], password: str, workers: Optional[int] = None,
+              max_in_flight: Optional[int] = None,
+              on_done: Optional[Callable[[Task, Optional[BaseException]], None]] = None, **options) -> BatchResult:
+    """Run `tasks` through a process-pool `JobScheduler`, keeping at most `max_in_flight` in flight.
+
+    Each worker process keeps a `KeySession` per password, so PBKDF2 runs once
+    per process instead of once per file.
+    """
+    result = BatchResult()
+    start = time.perf_counter()
+
+    def on_update(job: Job):
+        if job.status in (DONE, FAILED, CANCELLED):
+            if job.status == DONE:
+                result.files += 1
+                result.bytes += job.size
+            else:
+                result.failures.append((job.input_path, job.error))
+            if on_done:
+                on_done((job.input_path, job.output_path), job.exception)
+
+    with JobScheduler(workers, use_processes=True, max_in_flight=max_in_flight,
+                      on_update=on_update, keep_finished=False) as scheduler:
+        backlog = scheduler.max_in_flight * 2
+        for input_path, output_path in tasks:
+            scheduler.wait(backlog)  # Walk the tree lazily instead of queueing it all
+            scheduler.submit(mode, input_path, output_path, password, **options)
+        scheduler.wait()
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def encrypt_directory(input_dir: str, output_dir: str, password: str, workers: Optional[int] = None,
+                      max_in_flight: Optional[int] = None, on_done=None, envelope: bool = False,
+                      preview_size: Optional[int] = None, compression: Optional[str] = AUTO,
+                      kdf: Optional[Kdf] = None, cipher: str = AUTO_CIPHER) -> BatchResult:
+    """Encrypt every supported image under `input_dir`, mirroring the tree into `output_dir`."""
+    if not os.path.isdir(input_dir):
+        raise FileNotFoundError(f"Input directory '{input_dir}' does not exist.")
+    tasks = encryption_tasks(input_dir, output_dir)
+    return run_batch('encrypt', tasks, password, workers, max_in_flight, on_done,
+                     envelope=envelope, preview_size=preview_size, compression=compression,
+                     kdf=kdf, cipher=cipher)
+
+
+def decrypt_directory(input_dir: str, output_dir: str, password: str, workers: Optional[int] = None,
+                      max_in_flight: Optional[int] = None, on_done=None) -> BatchResult:
+    """Decrypt every `.bin` file under `input_dir`, mirroring the tree into `output_dir`."""
+    if not os.path.isdir(input_dir):
+        raise FileNotFoundError(f"Input directory '{input_dir}' does not exist.")
+    tasks = decryption_tasks(input_dir, output_dir)
+    return run_batch('decrypt', tasks, password, workers, max_in_flight, on_done)
+
+
+def verify_status(error: Optional[BaseException]) -> str:
+    """Classify the outcome of verifying one file: ok, wrong-password, truncated, corrupt or error."""
+    if error is None:
+        return 'ok'
+    if isinstance(error, WrongPasswordError):
+        return 'wrong-password'
+    if isinstance(error, TruncatedFileError):
+        return 'truncated'
+    if isinstance(error, CorruptFileError):
+        return 'corrupt'
+    return 'error'
+
+
+def verify_directory(input_dir: str, password: str, workers: Optional[int] = None,
+                     max_in_flight: Optional[int] = None, on_done=None) -> BatchResult:
+    """Authenticate every `.bin` file under `input_dir` without writing any plaintext.
+
+    Pass `on_done` and `verify_status` to tell the kinds of failure apart.
+    """
+    if not os.path.isdir(input_dir):
+        raise FileNotFoundError(f"Input directory '{input_dir}' does not exist.")
+    tasks = ((path, '') for path in iter_files(input_dir, lambda p: p.lower().endswith(ENCRYPTED_SUFFIX)))
+    return run_batch('verify', tasks, password, workers, max_in_flight, on_done)
+
+
+def _envelope_manifest(path: str, password: str, session: KeySession):
+    """Re-encrypt a sync manifest from before manifests used envelope mode, so it can be re-keyed."""
+    with open(path, 'rb') as f:
+        if FIELD_SLOT in dict(read_header(f)):
+            return
+        f.seek(0)
+        data = decrypt_bytes(f.read(), password, session=session)
+    with atomic_output(path) as f:
+        f.write(encrypt_bytes(data, password, session=session, envelope=True, compression='zlib'))
+
+
+def _is_envelope(path: str) -> bool:
+    """Whether the file at `path` is a container with key slots, i.e. one `rekey_image` can re-key."""
+    with open(path, 'rb') as f:
+        return is_encrypted_container(f) and FIELD_SLOT in dict(read_header(f))
+
+
+def rekey_directory(input_dir: str, password: str, new_password: str, add: bool = False,
+                    on_done=None, kdf: Optional[Kdf] = None) -> BatchResult:
+    """Rewrite the key slots of every `.bin` file and sync manifest under `input_dir` in place.
+
+    Only headers are touched and both passwords go through one key session
+    each, so the run costs a few KDFs plus one small write per file. Hard
+    links (deduplicated sync output) are re-keyed once. Nothing is re-keyed
+    unless every `.bin` file is in envelope mode, and the manifest is re-keyed
+    last, only once every file has been, so a failed run never leaves the
+    manifest under another password than the images.
+    """
+    if not os.path.isdir(input_dir):
+        raise FileNotFoundError(f"Input directory '{input_dir}' does not exist.")
+
+    result = BatchResult()
+    start = time.perf_counter()
+
+    def report(path: str, error: Optional[Exception]):
+        if error is None:
+            result.files += 1
+        else:
+            result.failures.append((path, str(error)))
+        if on_done:
+            on_done((path, path), error)
+
+    paths, manifests, seen = [], [], set()
+    for path in iter_files(input_dir, lambda p: (p.lower().endswith(ENCRYPTED_SUFFIX)
+                                                 or os.path.basename(p) == MANIFEST_NAME)):
+        if os.path.basename(path) == MANIFEST_NAME:
+            manifests.append(path)
+            continue
+        st = os.stat(path)
+        if st.st_nlink > 1:
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+        paths.append(path)
+
+    # Check everything up front: a single file that can't be re-keyed would leave the vault split
+    for path in paths:
+        try:
+            if not _is_envelope(path):
+                raise ValueError("File was not encrypted in envelope mode; re-encrypt it to change the password.")
+        except (OSError, ValueError) as e:
+            report(path, e)
+    if result.failures:
+        for path in manifests:
+            report(path, ValueError("Not re-keyed: some files can't be re-keyed."))
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    with KeySession(password) as session, KeySession(new_password, kdf=kdf) as new_session:
+        for path in paths:
+            try:
+                rekey_image(path, password, new_password, add, session, new_session)
+                report(path, None)
+            except Exception as e:
+                report(path, e)
+        for path in manifests:
+            if result.failures:
+                report(path, ValueError("Not re-keyed: some files failed. Fix them and run rekey again."))
+                continue
+            try:
+                _envelope_manifest(path, password, session)
+                rekey_image(path, password, new_password, add, session, new_session)
+                report(path, None)
+            except Exception as e:
+                report(path, e)
+    result.elapsed = time.perf_counter() - start
+    return result
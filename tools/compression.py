@@ -0,0 +1,91 @@
+import lzma
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+# Optional compression of the image bytes before they are encrypted.
+#
+# Ciphertext does not compress, so this is the only place it can happen. A
+# codec is a pair of factories for streaming compressor/decompressor objects
+# with the zlib/lzma interface (`compress`/`flush` and `decompress`/`eof`);
+# its name is stored in the container header so decryption can undo it.
+# Every chunk is compressed as a stream of its own (see `compress_chunk`), so
+# encrypted files can still be decrypted one chunk at a time, at random.
+
+AUTO = 'auto'
+NONE = 'none'
+
+# Formats that usually store raw samples or text and shrink well
+UNCOMPRESSED_FORMATS = {'BMP', 'PBM', 'PGM', 'PPM', 'TIFF', 'RAW', 'SVG', 'XBM', 'XPM'}
+AUTO_CODEC = 'zlib'
+# `auto` trial-compresses this much of the image and keeps compression only
+# if it shrinks to at most AUTO_MAX_RATIO of its size
+AUTO_SAMPLE_SIZE = 256 * 1024
+AUTO_MAX_RATIO = 0.9
+
+
+@dataclass(frozen=True)
+class Codec:
+    """A streaming compression codec that can be recorded in the container header."""
+    name: str
+    compressor: Callable[[], Any]
+    decompressor: Callable[[], Any]
+
+
+_CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """Make `codec` available to encryption and decryption under `codec.name`."""
+    if codec.name in (AUTO, NONE) or not codec.name.isascii():
+        raise ValueError(f"Invalid codec name '{codec.name}'.")
+    _CODECS[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    codec = _CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unsupported compression codec '{name}'.")
+    return codec
+
+
+def available_codecs():
+    return list(_CODECS)
+
+
+# The AEAD already authenticates the data, so the xz container skips its own check
+register_codec(Codec('zlib', lambda: zlib.compressobj(6), zlib.decompressobj))
+register_codec(Codec('lzma', lambda: lzma.LZMACompressor(lzma.FORMAT_XZ, check=lzma.CHECK_NONE),
+                     lzma.LZMADecompressor))
+
+
+def choose_codec(compression: Optional[str], image_format: Optional[str]) -> Optional[str]:
+    """Resolve a `compression` setting (`auto`, `none`/None or a codec name) for one image."""
+    if compression is None or compression == NONE:
+        return None
+    if compression == AUTO:
+        return AUTO_CODEC if image_format in UNCOMPRESSED_FORMATS else None
+    return get_codec(compression).name
+
+
+def compresses_well(codec: Codec, sample: bytes) -> bool:
+    """Whether `sample` (the start of an image) shrinks enough for `auto` to keep compressing."""
+    return len(compress_chunk(codec, sample)) <= len(sample) * AUTO_MAX_RATIO
+
+
+def compress_chunk(codec: Codec, data: bytes) -> bytes:
+    """Compress `data` as a self-contained stream."""
+    compressor = codec.compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_chunk(codec: Codec, data: bytes) -> bytes:
+    """Undo `compress_chunk`, insisting on exactly one complete stream."""
+    decompressor = codec.decompressor()
+    try:
+        plaintext = decompressor.decompress(data)
+    except (zlib.error, lzma.LZMAError, EOFError) as e:
+        raise ValueError("Decryption failed. Compressed data is corrupted.") from e
+    if not decompressor.eof or decompressor.unused_data:
+        raise ValueError("Decryption failed. Compressed data is corrupted.")
+    return plaintext
@@ -0,0 +1,188 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+SUPPORTED_FORMATS = {
+    'JPEG': ['.jpg', '.jpeg', '.jpe', '.jfif'],
+    'PNG': ['.png'],
+    'BMP': ['.bmp', '.dib'],
+    'GIF': ['.gif'],
+    'TIFF': ['.tiff', '.tif'],
+    'WebP': ['.webp'],
+    'ICO': ['.ico'],
+    'HEIC': ['.heic', '.heif'],
+    'AVIF': ['.avif'],
+    'SVG': ['.svg'],
+    'RAW': ['.raw', '.cr2', '.nef', '.arw', '.dng'],
+    'PBM': ['.pbm'],
+    'PGM': ['.pgm'],
+    'PPM': ['.ppm'],
+    'XBM': ['.xbm'],
+    'XPM': ['.xpm'],
+}
+
+# Built once at import time instead of on every check
+SUPPORTED_EXTENSIONS = frozenset(ext for extensions in SUPPORTED_FORMATS.values() for ext in extensions)
+_EXTENSION_FORMATS = {ext: name for name, extensions in SUPPORTED_FORMATS.items() for ext in extensions}
+
+# Bytes read from the start of a file to identify it
+SNIFF_SIZE = 64
+
+# Formats without a reliable signature (text formats and headerless raw dumps);
+# their extension is trusted when the content matches nothing else.
+_EXTENSION_ONLY = {'SVG', 'XBM', 'XPM', 'RAW'}
+
+_PNM_WHITESPACE = (b' ', b'\t', b'\n', b'\r')
+
+# (format, ((offset, bytes), ...)): a signature matches when every part does.
+# More specific signatures come first (e.g. Canon CR2 before plain TIFF).
+_SIGNATURES: List[Tuple[str, Tuple[Tuple[int, bytes], ...]]] = [
+    ('JPEG', ((0, b'\xff\xd8\xff'),)),
+    ('PNG', ((0, b'\x89PNG\r\n\x1a\n'),)),
+    ('GIF', ((0, b'GIF87a'),)),
+    ('GIF', ((0, b'GIF89a'),)),
+    ('WebP', ((0, b'RIFF'), (8, b'WEBP'))),
+    ('RAW', ((0, b'II*\x00'), (8, b'CR\x02'))),  # Canon CR2
+    ('TIFF', ((0, b'II*\x00'),)),
+    ('TIFF', ((0, b'MM\x00*'),)),
+    ('TIFF', ((0, b'II+\x00'),)),  # BigTIFF
+    ('TIFF', ((0, b'MM\x00+'),)),
+    ('BMP', ((0, b'BM'), (6, b'\x00\x00\x00\x00'))),
+    ('ICO', ((0, b'\x00\x00\x01\x00'),)),
+    ('XPM', ((0, b'/* XPM */'),)),
+    ('XBM', ((0, b'#define '),)),
+    ('SVG', ((0, b'<svg'),)),
+] + [
+    (name, ((0, magic + space),))
+    for name, magics in (('PBM', (b'P1', b'P4')), ('PGM', (b'P2', b'P5')), ('PPM', (b'P3', b'P6')))
+    for magic in magics
+    for space in _PNM_WHITESPACE
+]
+
+# Signatures indexed by their first byte, so a lookup only tries a handful of them
+_SIGNATURE_INDEX: Dict[int, List[Tuple[str, Tuple[Tuple[int, bytes], ...]]]] = {}
+for _entry in _SIGNATURES:
+    _SIGNATURE_INDEX.setdefault(_entry[1][0][1][0], []).append(_entry)
+
+# ISO base media file brands (the 'ftyp' box of HEIF/AVIF files)
+_HEIC_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'hevm', b'hevs', b'mif1', b'msf1'}
+_AVIF_BRANDS = {b'avif', b'avis'}
+
+
+def _bmff_format(head: bytes) -> Optional[str]:
+    """Identify HEIC/AVIF from the major and compatible brands of the 'ftyp' box."""
+    if head[4:8] != b'ftyp':
+        return None
+    box_size = int.from_bytes(head[:4], 'big')
+    brands = [head[8:12]] + [head[pos:pos + 4] for pos in range(16, min(box_size, len(head)) - 3, 4)]
+    if any(brand in _AVIF_BRANDS for brand in brands):
+        return 'AVIF'
+    if any(brand in _HEIC_BRANDS for brand in brands):
+        return 'HEIC'
+    return None
+
+
+def detect_format(head: bytes, extension: str = '') -> Optional[str]:
+    """Return the `SUPPORTED_FORMATS` name matching the first bytes of a file, or None.
+
+    `extension` breaks ties the content cannot: TIFF-based raw files (DNG,
+    NEF, ARW) are reported as RAW, and signature-less formats fall back to it.
+    """
+    if head.startswith(b'\xef\xbb\xbf'):
+        head = head[3:]  # UTF-8 byte order mark of text formats
+    extension = extension.lower()
+    image_format = _bmff_format(head)
+    if image_format is None and head:
+        for name, parts in _SIGNATURE_INDEX.get(head[0], ()):
+            if all(head[offset:offset + len(magic)] == magic for offset, magic in parts):
+                image_format = name
+                break
+    if image_format is None and head.startswith(b'<?xml') and b'<svg' in head:
+        image_format = 'SVG'
+
+    hinted = _EXTENSION_FORMATS.get(extension)
+    if image_format == 'TIFF' and hinted == 'RAW':
+        return 'RAW'
+    if image_format is None and hinted in _EXTENSION_ONLY:
+        return hinted
+    return image_format
+
+
+def sniff_stream(f: BinaryIO) -> bytes:
+    """Return the first bytes of `f` without consuming them (seekable or peekable streams)."""
+    if f.seekable():
+        pos = f.tell()
+        head = f.read(SNIFF_SIZE)
+        f.seek(pos)
+        return head
+    if hasattr(f, 'peek'):
+        return f.peek(SNIFF_SIZE)[:SNIFF_SIZE]
+    return b''
+
+
+def read_format(path: str) -> Optional[str]:
+    """Like `classify`, but raises OSError when the file can't be opened or read."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        head = os.read(fd, SNIFF_SIZE)
+    finally:
+        os.close(fd)
+    return detect_format(head, os.path.splitext(path)[1])
+
+
+def classify(path: str) -> Optional[str]:
+    """Identify the image format of the file at `path`, reading only its first bytes."""
+    try:
+        return read_format(path)
+    except OSError:
+        return None
+
+
+def classify_many(paths: Iterable[str], workers: int = 8,
+                  sniff: Callable[[str], Any] = classify) -> Iterator[Tuple[str, Any]]:
+    """Yield `(path, format or None)` for every path, in order.
+
+    Files are opened and sniffed on a small thread pool, so the latency of
+    many small opens overlaps; at most `workers * 4` are in flight, which
+    keeps memory flat for arbitrarily long path lists. `sniff` replaces
+    `classify` for callers that need to tell unreadable files apart.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append((path, pool.submit(sniff, path)))
+            if len(pending) >= workers * 4:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def with_format_extension(path: str, image_format: Optional[str]) -> str:
+    """Append the usual extension of `image_format` unless `path` already has one of its extensions."""
+    if image_format not in SUPPORTED_FORMATS:
+        return path
+    extensions = SUPPORTED_FORMATS[image_format]
+    if os.path.splitext(path)[1].lower() in extensions:
+        return path
+    return path + extensions[0]
+
+
+def is_supported_image(file_path: str) -> Tuple[bool, str]:
+    """Check if the file is a supported image format.
+
+    Existing files are identified by their content, so renamed images are
+    accepted and files that only carry an image extension are not.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if os.path.isfile(file_path):
+        if classify(file_path) is None:
+            return False, f"'{os.path.basename(file_path)}' is not a supported image (unrecognized file content)."
+        return True, ""
+
+    if ext not in SUPPORTED_EXTENSIONS:
+        return False, f"Unsupported file format '{ext}'. Supported formats: {', '.join(_EXTENSION_FORMATS)}"
+
+    return True, ""
@@ -1,98 +1,1522 @@
+import io
 import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
-from typing import Tuple
-
-SUPPORTED_FORMATS = {
-    'JPEG': ['.jpg', '.jpeg', '.jpe', '.jfif'],
-    'PNG': ['.png'],
-    'BMP': ['.bmp', '.dib'],
-    'GIF': ['.gif'],
-    'TIFF': ['.tiff', '.tif'],
-    'WebP': ['.webp'],
-    'ICO': ['.ico'],
-    'HEIC': ['.heic', '.heif'],
-    'AVIF': ['.avif'],
-    'SVG': ['.svg'],
-    'RAW': ['.raw', '.cr2', '.nef', '.arw', '.dng'],
-    'PBM': ['.pbm'],
-    'PGM': ['.pgm'],
-    'PPM': ['.ppm'],
-    'XBM': ['.xbm'],
-    'XPM': ['.xpm'],
-}
-
-def derive_key(password: str, salt: bytes) -> bytes:
+from PIL import Image
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tools.compression import (
+    AUTO, AUTO_SAMPLE_SIZE, Codec, choose_codec, compress_chunk, compresses_well, decompress_chunk, get_codec,
+)
+from tools.formats import SUPPORTED_FORMATS, detect_format, is_supported_image, sniff_stream
+from tools.suites import (
+    AUTO as AUTO_CIPHER, CIPHER_AES_GCM, KEY_SIZE, PBKDF2_ITERATIONS, Aead, Kdf, Pbkdf2,
+    choose_cipher, get_cipher, unpack_kdf,
+)
+
+# Container layout (all integers big-endian):
+#
+#   MAGIC | version (u8) | header length (u32) | header fields | chunk 0 | chunk 1 | ...
+#
+# Header fields are (tag u8, length u16, value) records; a zero tag ends the
+# list and any remaining header bytes are reserved padding. Every chunk holds
+# at most `chunk size` bytes of plaintext sealed with the header's AEAD cipher
+# (AES-256-GCM when the header names none) under its own nonce (nonce prefix |
+# chunk index | final flag), so chunks can be processed one at a time and a
+# file cut short on a chunk boundary fails to decrypt. The KDF field names the
+# password KDF and its cost (see tools.suites). Without key slots, the check
+# field is the tag of an empty plaintext sealed under the payload key, so a
+# wrong password is told apart from a damaged chunk before any chunk is opened.
+#
+# With the codec field, every chunk holds exactly `chunk size` bytes of image
+# (the last one at most that) compressed on its own, and each sealed chunk is
+# preceded by its length (u32).
+#
+# In envelope mode the chunks are sealed with a random data key and the header
+# carries one or more key slots, each wrapping that data key under a password.
+# Slots are not part of the chunks' associated data, so passwords can be added
+# or changed by rewriting the header alone.
+#
+# An optional preview (a small JPEG/PNG rendition) is sealed on its own right
+# after the header, so galleries can decrypt it without touching the chunks.
+MAGIC = b'PXSH'
+FORMAT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+SALT_SIZE = 16
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+LEGACY_HEADER_SIZE = 44  # Salt (16) + IV (12) + Tag (16)
+ENVELOPE_SLOTS = 4  # Key slots reserved in the header of envelope-mode files
+DEFAULT_PREVIEW_SIZE = 256  # Longest side of embedded previews, in pixels
+
+_PREFIX = struct.Struct('>4sBI')
+_FIELD = struct.Struct('>BH')
+_LENGTH = struct.Struct('>I')  # Sealed size before each chunk of a compressed payload
+
+FIELD_END = 0
+FIELD_CHUNK_SIZE = 1
+FIELD_NONCE_PREFIX = 2
+FIELD_KDF = 3
+FIELD_SUBKEY = 4  # HKDF salt of a per-file key derived from a session master key
+FIELD_SLOT = 5  # Password-wrapped data key (envelope mode, may repeat)
+FIELD_PREVIEW = 6  # Sealed size of the preview stored before the first chunk
+FIELD_FORMAT = 7  # Detected image format (a SUPPORTED_FORMATS name), for picking output names
+FIELD_CODEC = 8  # Compression codec applied to each chunk on its own; chunks are length-prefixed
+FIELD_CHECK = 9  # Password check: empty plaintext sealed under the payload key (no key slots)
+FIELD_CIPHER = 10  # AEAD cipher id of the preview and chunks (AES-256-GCM when absent)
+
+# Fields that may change after encryption and are left out of the associated data
+_UNBOUND_FIELDS = {FIELD_SLOT}
+
+_READ_SIZE = 1024 * 1024
+_MAX_CHUNKS = 2 ** 32
+
+# progress(bytes done, bytes total), called after every chunk
+ProgressCallback = Callable[[int, int], None]
+
+
+class OperationCancelled(Exception):
+    """Raised when an operation is stopped through its `cancel` event."""
+
+
+class WrongPasswordError(ValueError):
+    """The password opens no key slot (or, without slots, not even the first chunks)."""
+
+
+class CorruptFileError(ValueError):
+    """An encrypted file is malformed or fails authentication under a password known to be right."""
+
+
+class TruncatedFileError(CorruptFileError):
+    """An encrypted file ends before its last chunk."""
+
+
+# Instrumentation.
+#
+# Metrics sinks are called as `sink(kind, stage, value)` from whichever thread
+# does the work. SECONDS and BYTES events add up per stage (threads and worker
+# processes are summed, so stage times can exceed the wall time); PEAK events
+# report the size of a buffer held at that moment, of which a sink keeps the
+# largest. With no sink registered every hook is a single truthiness check.
+SECONDS = 'seconds'
+BYTES = 'bytes'
+PEAK = 'peak'
+
+STAGE_KDF = 'kdf'  # Password key derivation (PBKDF2/scrypt), not the cheap HKDF subkeys
+STAGE_PREVIEW = 'preview'
+STAGE_TRIAL = 'trial'  # Auto compression's trial run on the first block, kept out of compress
+STAGE_READ = 'read'
+STAGE_COMPRESS = 'compress'
+STAGE_CIPHER = 'cipher'
+STAGE_DECOMPRESS = 'decompress'
+STAGE_WRITE = 'write'
+
+BUFFER_IN_FLIGHT = 'in-flight'  # Chunks read but not yet written
+BUFFER_STREAM = 'stream'  # Bytes held by StreamEncryptor/StreamDecryptor between calls
+
+# sink(kind, stage, value)
+MetricsSink = Callable[[str, str, float], None]
+
+_metrics_sinks: Tuple[MetricsSink, ...] = ()
+
+
+def add_metrics_sink(sink: MetricsSink):
+    """Send the metrics of every operation in this process to `sink` (e.g. a Prometheus exporter)."""
+    global _metrics_sinks
+    _metrics_sinks += (sink,)
+
+
+def remove_metrics_sink(sink: MetricsSink):
+    global _metrics_sinks
+    _metrics_sinks = tuple(s for s in _metrics_sinks if s is not sink)
+
+
+def clear_metrics_sinks():
+    global _metrics_sinks
+    _metrics_sinks = ()
+
+
+def metrics_enabled() -> bool:
+    return bool(_metrics_sinks)
+
+
+def emit_metric(kind: str, stage: str, value: float):
+    """Pass one measurement to every registered sink."""
+    for sink in _metrics_sinks:
+        sink(kind, stage, value)
+
+
+def _timed(stage: str, size: Optional[int], func: Callable, *args):
+    """Call `func(*args)`, reporting its time (and `size` bytes) as `stage` when metrics are enabled."""
+    if not _metrics_sinks:
+        return func(*args)
+    start = time.perf_counter()
+    result = func(*args)
+    emit_metric(SECONDS, stage, time.perf_counter() - start)
+    if size is not None:
+        emit_metric(BYTES, stage, size)
+    return result
+
+
+class StageStats:
+    """Metrics sink that totals seconds and bytes per stage and keeps the largest buffers."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.bytes: Dict[str, int] = {}
+        self.peaks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind: str, stage: str, value: float):
+        with self._lock:
+            if kind == PEAK:
+                self.peaks[stage] = max(self.peaks.get(stage, 0), value)
+            elif kind == SECONDS:
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + value
+            elif kind == BYTES:
+                self.bytes[stage] = self.bytes.get(stage, 0) + value
+
+    def events(self) -> List[Tuple[str, str, float]]:
+        """The totals as events, to replay into the sinks of another process (see `replay_metrics`)."""
+        with self._lock:
+            return ([(SECONDS, stage, value) for stage, value in self.seconds.items()]
+                    + [(BYTES, stage, value) for stage, value in self.bytes.items()]
+                    + [(PEAK, stage, value) for stage, value in self.peaks.items()])
+
+    def as_dict(self) -> dict:
+        """`{'stages': {stage: {'seconds', 'bytes'}}, 'peak_bytes': {buffer: size}}`."""
+        with self._lock:
+            stages = {stage: {'seconds': self.seconds.get(stage, 0.0), 'bytes': self.bytes.get(stage, 0)}
+                      for stage in dict.fromkeys([*self.seconds, *self.bytes])}
+            return {'stages': stages, 'peak_bytes': dict(self.peaks)}
+
+
+def replay_metrics(events: Iterable[Tuple[str, str, float]]):
+    """Pass events collected elsewhere (e.g. `StageStats.events()` of a worker) to this process's sinks."""
+    for kind, stage, value in events:
+        emit_metric(kind, stage, value)
+
+
+@contextmanager
+def collect_metrics() -> Iterator[StageStats]:
+    """Collect the metrics of the operations run inside the block into a `StageStats`."""
+    stats = StageStats()
+    add_metrics_sink(stats)
+    try:
+        yield stats
+    finally:
+        remove_metrics_sink(stats)
+
+
+class _MeteredFile:
+    """File proxy reporting the time and size of every read() or write() as `stage`."""
+
+    def __init__(self, f: BinaryIO, stage: str):
+        self._f = f
+        self._stage = stage
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        data = self._f.read(size)
+        emit_metric(SECONDS, self._stage, time.perf_counter() - start)
+        emit_metric(BYTES, self._stage, len(data))
+        return data
+
+    def write(self, data) -> int:
+        return _timed(self._stage, len(data), self._f.write, data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class _MeteredCodec:
+    """Compressor/decompressor proxy reporting every call (and its input size) as `stage`."""
+
+    def __init__(self, codec_object, stage: str):
+        self._object = codec_object
+        self._stage = stage
+
+    def compress(self, data: bytes) -> bytes:
+        return _timed(self._stage, len(data), self._object.compress, data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return _timed(self._stage, len(data), self._object.decompress, data)
+
+    def flush(self) -> bytes:
+        return _timed(self._stage, 0, self._object.flush)
+
+    def __getattr__(self, name):
+        return getattr(self._object, name)  # eof, unused_data
+
+
+def _metered_codec(codec: Optional[Codec]) -> Optional[Codec]:
+    """Wrap `codec` so its compressors and decompressors report to the sinks (only while any are registered)."""
+    if codec is None or not _metrics_sinks:
+        return codec
+    return Codec(codec.name, lambda: _MeteredCodec(codec.compressor(), STAGE_COMPRESS),
+                 lambda: _MeteredCodec(codec.decompressor(), STAGE_DECOMPRESS))
+
+
+def _metered_files(src: BinaryIO, dst: Optional[BinaryIO] = None):
+    """Wrap `src` (and `dst`) to report read (and write) metrics, if any sink is registered."""
+    if not _metrics_sinks:
+        return src, dst
+    return _MeteredFile(src, STAGE_READ), _MeteredFile(dst, STAGE_WRITE) if dst is not None else None
+
+
+def _run_kdf(kdf: Kdf, password: str, salt: bytes) -> bytes:
+    return _timed(STAGE_KDF, None, kdf.derive, password, salt)
+
+
+def derive_key(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
     """Derive a 256-bit key from the password using PBKDF2."""
-    kdf = PBKDF2HMAC(
+    return _run_kdf(Pbkdf2(iterations), password, salt)
+
+
+def derive_subkey(master_key: bytes, salt: bytes) -> bytes:
+    """Derive a 256-bit per-file key from a master key using HKDF-SHA256."""
+    hkdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,
         salt=salt,
-        iterations=100000,
+        info=b'PixelShield file key',
         backend=default_backend()
     )
-    return kdf.derive(password.encode())
+    return hkdf.derive(bytes(master_key))
+
+
+def _zeroize(buffer: bytearray):
+    """Overwrite key material held in a mutable buffer."""
+    buffer[:] = bytes(len(buffer))
 
-def encrypt_image(input_path: str, output_path: str, password: str):
-    """Encrypt an image using AES-GCM."""
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
 
-    salt = os.urandom(16)  # Generate a random salt
-    key = derive_key(password, salt)  # Derive encryption key
+class KeySession:
+    """Amortize the password KDF over many files that use the same password.
 
-    iv = os.urandom(12)  # AES-GCM standard IV size
-    cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
+    Encryption derives one master key from the password and the session salt
+    (with `kdf`, PBKDF2 by default), then a cheap HKDF subkey per file.
+    Decryption keeps the KDF results for
+    the most recently seen salts in a bounded LRU cache; evicted keys are
+    zeroized. Keys are held in bytearrays so they can be wiped, but copies made
+    by the crypto backend are outside our control.
+    """
 
-    with open(input_path, 'rb') as f:
-        plaintext = f.read()
+    def __init__(self, password: str, salt: Optional[bytes] = None,
+                 iterations: int = PBKDF2_ITERATIONS, cache_size: int = 16, kdf: Optional[Kdf] = None):
+        if cache_size <= 0:
+            raise ValueError("Cache size must be positive.")
+        self.password = password
+        self.salt = salt or os.urandom(SALT_SIZE)
+        self.kdf = kdf or Pbkdf2(iterations)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-    tag = encryptor.tag  # Authentication tag (important for GCM mode)
+    def master_key(self, salt: Optional[bytes] = None, kdf: Optional[Kdf] = None) -> bytes:
+        """Return the KDF key for `salt`, deriving it only on a cache miss.
 
-    # Store (Salt + IV + Tag + Ciphertext)
-    with open(output_path, 'wb') as f:
-        f.write(salt + iv + tag + ciphertext)
+        The result is a copy taken under the lock: another thread may evict and
+        zeroize the cached buffer at any time.
+        """
+        salt, kdf = bytes(salt or self.salt), kdf or self.kdf
+        cache_key = (salt, kdf)
+        with self._lock:
+            key = self._cache.get(cache_key)
+            if key is not None:
+                self._cache.move_to_end(cache_key)
+                return bytes(key)
+
+        derived = _run_kdf(kdf, self.password, salt)
+        with self._lock:
+            self._cache[cache_key] = bytearray(derived)
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                _, evicted = self._cache.popitem(last=False)
+                _zeroize(evicted)
+        return derived
+
+    def file_key(self, file_salt: bytes, salt: Optional[bytes] = None, kdf: Optional[Kdf] = None) -> bytes:
+        """Derive the per-file key for `file_salt` from the (cached) master key."""
+        return derive_subkey(self.master_key(salt, kdf), file_salt)
+
+    def clear(self):
+        """Zeroize and drop every cached key."""
+        with self._lock:
+            for key in self._cache.values():
+                _zeroize(key)
+            self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.clear()
+
+
+def pack_header(fields: List[Tuple[int, bytes]], reserve: int = 0) -> bytes:
+    """Serialize header fields into the container prefix and header block.
+
+    `reserve` zero bytes are appended so the header can later grow in place.
+    """
+    body = b''.join(_FIELD.pack(tag, len(value)) + value for tag, value in fields)
+    body += bytes(1 + reserve)  # FIELD_END followed by the padding
+    return _PREFIX.pack(MAGIC, FORMAT_VERSION, len(body)) + body
+
+
+def read_header(f: BinaryIO) -> List[Tuple[int, bytes]]:
+    """Read the container header from `f`, leaving it positioned at the first chunk."""
+    prefix = f.read(_PREFIX.size)
+    if len(prefix) < _PREFIX.size:
+        raise ValueError("Invalid encrypted file format.")
+    magic, version, header_len = _PREFIX.unpack(prefix)
+    if magic != MAGIC:
+        raise ValueError("Invalid encrypted file format.")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported container version {version}.")
+
+    body = f.read(header_len)
+    if len(body) < header_len:
+        raise TruncatedFileError("Encrypted file is truncated.")
+
+    fields = []
+    pos = 0
+    while pos < header_len and body[pos] != FIELD_END:
+        if pos + _FIELD.size > header_len:
+            raise ValueError("Invalid encrypted file header.")
+        tag, length = _FIELD.unpack_from(body, pos)
+        pos += _FIELD.size
+        if pos + length > header_len:
+            raise ValueError("Invalid encrypted file header.")
+        fields.append((tag, body[pos:pos + length]))
+        pos += length
+    return fields
+
+
+def get_field(fields: List[Tuple[int, bytes]], tag: int) -> bytes:
+    """Return the value of a required header field."""
+    for field_tag, value in fields:
+        if field_tag == tag:
+            return value
+    raise ValueError("Invalid encrypted file header.")
+
+
+def header_aad(fields: List[Tuple[int, bytes]]) -> bytes:
+    """Associated data binding every chunk to the header it was written with."""
+    return MAGIC + bytes([FORMAT_VERSION]) + b''.join(
+        _FIELD.pack(tag, len(value)) + value for tag, value in fields if tag not in _UNBOUND_FIELDS
+    )
+
+
+def chunk_nonce(nonce_prefix: bytes, index: int, last: bool) -> bytes:
+    """Build the 96-bit GCM nonce for chunk `index`."""
+    if index >= _MAX_CHUNKS:
+        raise ValueError("File is too large for the configured chunk size.")
+    return nonce_prefix + struct.pack('>IB', index, 1 if last else 0)
+
+
+def preview_nonce(nonce_prefix: bytes) -> bytes:
+    """Nonce of the preview section; the flag byte never occurs in chunk nonces."""
+    return nonce_prefix + struct.pack('>IB', 0, 2)
+
+
+def check_nonce(nonce_prefix: bytes) -> bytes:
+    """Nonce of the password check; its flag byte is used by no other section."""
+    return nonce_prefix + struct.pack('>IB', 0, 3)
+
+
+def is_encrypted_container(f: BinaryIO) -> bool:
+    """Check whether `f` starts with a chunked container header (position is preserved)."""
+    pos = f.tell()
+    magic = f.read(len(MAGIC))
+    f.seek(pos)
+    return magic == MAGIC
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    """Read up to `size` bytes, only returning short at end of file."""
+    data = f.read(size)
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        data = f.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def iter_chunks(f: BinaryIO, size: int) -> Iterator[Tuple[bytes, bool]]:
+    """Yield `(chunk, is_last)` pairs, reading one chunk ahead to spot the end."""
+    chunk = _read_exact(f, size)
+    while True:
+        following = _read_exact(f, size) if len(chunk) == size else b''
+        last = not following
+        yield chunk, last
+        if last:
+            return
+        chunk = following
+
+
+def _max_record_size(chunk_size: int) -> int:
+    """Largest sealed chunk of a compressed payload; codecs grow incompressible data a little."""
+    return chunk_size + chunk_size // 8 + 1024 + TAG_SIZE
+
+
+def _read_record(f: BinaryIO, max_size: int) -> Optional[bytes]:
+    """Read one length-prefixed sealed chunk, or return None at end of file."""
+    prefix = _read_exact(f, _LENGTH.size)
+    if not prefix:
+        return None
+    if len(prefix) < _LENGTH.size:
+        raise TruncatedFileError("Encrypted file is truncated.")
+    size = _LENGTH.unpack(prefix)[0]
+    if size > max_size:
+        raise CorruptFileError("Invalid encrypted chunk length.")
+    record = _read_exact(f, size)
+    if len(record) < size:
+        raise TruncatedFileError("Encrypted file is truncated.")
+    return record
+
+
+def iter_records(f: BinaryIO, max_size: int) -> Iterator[Tuple[bytes, bool]]:
+    """Yield `(sealed chunk, is_last)` pairs of a length-prefixed payload, reading one ahead."""
+    record = _read_record(f, max_size)
+    if record is None:
+        raise TruncatedFileError("Encrypted file is truncated.")
+    while True:
+        following = _read_record(f, max_size)
+        last = following is None
+        yield record, last
+        if last:
+            return
+        record = following
+
+
+def _advancing(chunks: Iterable[Tuple[bytes, bool]], advance: Callable[[int], None],
+               overhead: int = 0) -> Iterator[Tuple[bytes, bool]]:
+    """Pass `chunks` through, advancing progress by each one's size (plus `overhead`) as it is read."""
+    for chunk, last in chunks:
+        advance(len(chunk) + overhead)
+        yield chunk, last
+
+
+def progress_tracker(total: int, progress: Optional[ProgressCallback] = None,
+                     cancel: Optional[threading.Event] = None) -> Callable[[int], None]:
+    """Return an `advance(count)` function reporting progress and honouring `cancel` between chunks.
+
+    A `total` of 0 means the size is unknown (e.g. a pipe) and is reported as such.
+    """
+    done = 0
+
+    def advance(count: int):
+        nonlocal done
+        if cancel is not None and cancel.is_set():
+            raise OperationCancelled("Operation cancelled.")
+        done = min(done + count, total) if total else done + count
+        if progress is not None:
+            progress(done, total)
+
+    return advance
+
+
+def map_chunks(transform: Callable[[int, bytes, bool], bytes],
+               chunks: Iterable[Tuple[bytes, bool]], threads: int = 1) -> Iterator[bytes]:
+    """Apply `transform(index, chunk, last)` to every chunk, yielding results in order.
+
+    With `threads > 1` the chunks are sealed or opened on a thread pool (the
+    AEAD primitives release the GIL). At most two chunks per thread are in
+    flight, so memory stays bounded and the output does not depend on `threads`.
+    """
+    if threads <= 1:
+        for index, (chunk, last) in enumerate(chunks):
+            if _metrics_sinks:
+                emit_metric(PEAK, BUFFER_IN_FLIGHT, len(chunk))
+            yield transform(index, chunk, last)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        held = 0  # Plaintext or ciphertext bytes of the chunks in `pending`
+        for index, (chunk, last) in enumerate(chunks):
+            pending.append((pool.submit(transform, index, chunk, last), len(chunk)))
+            held += len(chunk)
+            if _metrics_sinks:
+                emit_metric(PEAK, BUFFER_IN_FLIGHT, held)
+            if len(pending) >= threads * 2:
+                future, size = pending.popleft()
+                held -= size
+                yield future.result()
+        while pending:
+            yield pending.popleft()[0].result()
+
+
+@contextmanager
+def atomic_output(output_path: str):
+    """Write to a temporary file next to `output_path` and move it into place on success."""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.pixelshield-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _new_key_source(password: str, session: Optional[KeySession],
+                    kdf: Optional[Kdf] = None) -> Tuple[bytes, Optional[bytes], bytes]:
+    """Pick fresh KDF settings, returning `(kdf field, subkey salt or None, key)`.
+
+    A session always uses its own KDF, so its master key is derived once.
+    """
+    if session is None:
+        kdf = kdf or Pbkdf2()
+        salt = os.urandom(SALT_SIZE)  # Generate a random salt
+        return kdf.pack() + salt, None, _run_kdf(kdf, password, salt)
+
+    file_salt = os.urandom(SALT_SIZE)
+    return session.kdf.pack() + session.salt, file_salt, session.file_key(file_salt)
+
+
+def _source_key(kdf_field: bytes, subkey_salt: Optional[bytes], password: str,
+                session: Optional[KeySession]) -> bytes:
+    """Re-derive the key described by a KDF field and optional subkey salt."""
+    kdf, salt = unpack_kdf(kdf_field)
+    if len(salt) != SALT_SIZE:
+        raise ValueError("Unsupported key derivation settings.")
+
+    if session is not None:
+        key = session.master_key(salt, kdf)
+    else:
+        key = _run_kdf(kdf, password, salt)
+    if subkey_salt is not None:
+        key = derive_subkey(key, subkey_salt)
+    return bytes(key)
+
+
+def _slot_aad(nonce_prefix: bytes) -> bytes:
+    """Associated data tying a key slot to the container it belongs to."""
+    return MAGIC + bytes([FORMAT_VERSION]) + nonce_prefix
+
+
+def _password_check(aead, nonce_prefix: bytes) -> bytes:
+    """Tag proving the payload key; it covers the nonce prefix only, so header damage still reads as corruption."""
+    return aead.encrypt(check_nonce(nonce_prefix), b'', _slot_aad(nonce_prefix))
+
+
+def _new_slot(data_key: bytes, nonce_prefix: bytes, password: str, session: Optional[KeySession],
+              kdf: Optional[Kdf] = None) -> bytes:
+    """Wrap `data_key` under `password`, returning the slot field value.
+
+    Slots are always sealed with AES-GCM; they only ever hold a 32-byte key.
+    """
+    kdf, subkey_salt, kek = _new_key_source(password, session, kdf)
+    subkey_salt = subkey_salt or b''
+    nonce = os.urandom(12)
+    wrapped = AESGCM(kek).encrypt(nonce, data_key, _slot_aad(nonce_prefix))
+    return bytes([len(kdf)]) + kdf + bytes([len(subkey_salt)]) + subkey_salt + nonce + wrapped
+
+
+def _open_slot(slot: bytes, nonce_prefix: bytes, password: str, session: Optional[KeySession]) -> Optional[bytes]:
+    """Unwrap the data key held in `slot`, or return None if `password` does not open it."""
+    try:
+        pos = slot[0] + 1
+        kdf = slot[1:pos]
+        subkey_salt = slot[pos + 1:pos + 1 + slot[pos]] or None
+        pos += 1 + slot[pos]
+        nonce, wrapped = slot[pos:pos + 12], slot[pos + 12:]
+    except IndexError as e:
+        raise ValueError("Invalid encrypted file header.") from e
+
+    kek = _source_key(kdf, subkey_salt, password, session)
+    try:
+        return AESGCM(kek).decrypt(nonce, wrapped, _slot_aad(nonce_prefix))
+    except InvalidTag:
+        return None
 
-def decrypt_image(input_path: str, output_path: str, password: str):
-    """Decrypt an image encrypted with AES-GCM."""
+
+def make_preview(input_path: str, max_size: int = DEFAULT_PREVIEW_SIZE) -> Optional[bytes]:
+    """Render a downscaled JPEG (PNG when transparent) of the image, or None if Pillow can't read it."""
+    try:
+        with Image.open(input_path) as image:
+            image.draft('RGB', (max_size, max_size))  # Let JPEG decode at reduced scale
+            image.thumbnail((max_size, max_size))
+            buffer = io.BytesIO()
+            if 'A' in image.getbands() or 'transparency' in image.info:
+                image.convert('RGBA').save(buffer, 'PNG', optimize=True)
+            else:
+                image.convert('RGB').save(buffer, 'JPEG', quality=85)
+            return buffer.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class StreamEncryptor:
+    """Push-style container encryption: `feed()` plaintext as it arrives, then `finish()`.
+
+    Each call returns the container bytes that became ready, so data can come
+    from any source (sockets, async readers) without a file object. Options
+    match `encrypt_image`; the key is derived in the constructor. `seal()`
+    seals chunk `index` on its own (compressing and length-prefixing it when
+    there is a `codec`), for callers that split the input themselves.
+    """
+
+    def __init__(self, password: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 session: Optional[KeySession] = None, envelope: bool = False,
+                 preview: Optional[bytes] = None, image_format: Optional[str] = None,
+                 compression: Optional[str] = AUTO, kdf: Optional[Kdf] = None, cipher: str = AUTO_CIPHER):
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be positive.")
+
+        self.cipher: Aead = choose_cipher(cipher)
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        fields = [
+            (FIELD_CHUNK_SIZE, struct.pack('>I', chunk_size)),
+            (FIELD_NONCE_PREFIX, nonce_prefix),
+            (FIELD_CIPHER, bytes([self.cipher.id])),
+        ]
+        reserve = 0
+        if envelope:
+            key = os.urandom(KEY_SIZE)
+            slot = _new_slot(key, nonce_prefix, password, session, kdf)
+            fields.append((FIELD_SLOT, slot))
+            reserve = (ENVELOPE_SLOTS - 1) * (_FIELD.size + len(slot))
+        else:
+            kdf_field, subkey_salt, key = _new_key_source(password, session, kdf)
+            fields.append((FIELD_KDF, kdf_field))
+            if subkey_salt is not None:
+                fields.append((FIELD_SUBKEY, subkey_salt))
+            fields.append((FIELD_CHECK, _password_check(self.cipher.factory(key), nonce_prefix)))
+        if preview is not None:
+            fields.append((FIELD_PREVIEW, struct.pack('>I', len(preview) + TAG_SIZE)))
+        if image_format is not None:
+            fields.append((FIELD_FORMAT, image_format.encode()))
+        codec_name = choose_codec(compression, image_format)
+        self.codec: Optional[Codec] = _metered_codec(get_codec(codec_name) if codec_name else None)
+        if codec_name:
+            fields.append((FIELD_CODEC, codec_name.encode()))
+
+        self.chunk_size = chunk_size
+        self._nonce_prefix = nonce_prefix
+        self._aad = header_aad(fields)
+        self._aead = self.cipher.factory(key)
+        # Header and sealed preview, written before the first chunk
+        self.header = pack_header(fields, reserve)
+        if preview is not None:
+            self.header += _timed(STAGE_CIPHER, len(preview), self._aead.encrypt,
+                                  preview_nonce(nonce_prefix), preview, self._aad)
+
+        self._pending = bytearray()
+        self._index = 0
+        self._header_sent = False
+
+    def seal(self, index: int, chunk: bytes, last: bool) -> bytes:
+        if self.codec is not None:
+            chunk = compress_chunk(self.codec, chunk)
+        sealed = _timed(STAGE_CIPHER, len(chunk), self._aead.encrypt,
+                        chunk_nonce(self._nonce_prefix, index, last), chunk, self._aad)
+        return _LENGTH.pack(len(sealed)) + sealed if self.codec is not None else sealed
+
+    def _take_header(self) -> bytes:
+        if self._header_sent:
+            return b''
+        self._header_sent = True
+        return self.header
+
+    def _seal_pending(self) -> bytes:
+        output = [self._take_header()]
+        # Hold back a full chunk: only finish() knows which chunk is the last one
+        while len(self._pending) > self.chunk_size:
+            output.append(self.seal(self._index, bytes(self._pending[:self.chunk_size]), False))
+            del self._pending[:self.chunk_size]
+            self._index += 1
+        return b''.join(output)
+
+    def feed(self, data: bytes) -> bytes:
+        self._pending += data
+        if _metrics_sinks:
+            emit_metric(PEAK, BUFFER_STREAM, len(self._pending))
+        return self._seal_pending()
+
+    def finish(self) -> bytes:
+        output = self._seal_pending() + self.seal(self._index, bytes(self._pending), True)
+        self._pending = bytearray()
+        return output
+
+
+def _auto_compression(src: BinaryIO, image_format: Optional[str]) -> Tuple[BinaryIO, Optional[str]]:
+    """Resolve `auto` compression by trial-compressing the first block of `src`.
+
+    Returns the stream to read the image from (the first block is put back in
+    front of non-seekable streams) and the codec name, or None.
+    """
+    codec_name = choose_codec(AUTO, image_format)
+    if codec_name is None:
+        return src, None
+    if src.seekable():
+        pos = src.tell()
+        sample = _read_exact(src, AUTO_SAMPLE_SIZE)
+        src.seek(pos)
+    else:
+        sample = _read_exact(src, AUTO_SAMPLE_SIZE)
+        src = io.BufferedReader(_Prepended(sample, src), _READ_SIZE)
+    if not _timed(STAGE_TRIAL, len(sample), compresses_well, get_codec(codec_name), sample):
+        return src, None
+    return src, codec_name
+
+
+def encrypt_stream(src: BinaryIO, dst: BinaryIO, password: str,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, threads: int = 1,
+                   session: Optional[KeySession] = None, envelope: bool = False,
+                   preview: Optional[bytes] = None, progress: Optional[ProgressCallback] = None,
+                   cancel: Optional[threading.Event] = None, size: int = 0,
+                   image_format: Optional[str] = None, compression: Optional[str] = AUTO,
+                   kdf: Optional[Kdf] = None, cipher: str = AUTO_CIPHER):
+    """Encrypt everything read from `src` into a container written to `dst`.
+
+    Neither stream needs to be seekable. `preview` is an already rendered
+    thumbnail (see `make_preview`) and `size`, if known, is the total passed to
+    `progress`. `image_format` is recorded in the header; when omitted it is
+    detected from the first bytes of `src`. `compression` is a codec name,
+    `none`, or `auto` (compress formats that store raw samples, unless their
+    first block barely shrinks). `kdf` (see
+    `tools.suites`, PBKDF2 by default) applies when there is no `session`;
+    `cipher` is a cipher name or `auto` for the faster one on this machine.
+    If an error is raised, `dst` may hold a partial container.
+    """
+    if image_format is None:
+        image_format = detect_format(sniff_stream(src))
+    if compression == AUTO:
+        src, compression = _auto_compression(src, image_format)
+    src, dst = _metered_files(src, dst)
+    encryptor = StreamEncryptor(password, chunk_size, session, envelope, preview, image_format, compression,
+                                kdf, cipher)
+    advance = progress_tracker(size, progress, cancel)
+    dst.write(encryptor.header)
+    if encryptor.codec is None:
+        for sealed in map_chunks(encryptor.seal, iter_chunks(src, chunk_size), threads):
+            dst.write(sealed)
+            advance(len(sealed) - TAG_SIZE)
+        return
+
+    # Compressed chunks don't tell how much input they hold, so progress follows the reads
+    for sealed in map_chunks(encryptor.seal, _advancing(iter_chunks(src, chunk_size), advance), threads):
+        dst.write(sealed)
+
+
+def _tiff_compressed(input_path: str) -> bool:
+    """Whether a TIFF already stores compressed strips, so compressing it again would not help."""
+    try:
+        with Image.open(input_path) as image:
+            return image.info.get('compression', 'raw') != 'raw'
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+
+
+def encrypt_bytes(data: bytes, password: str, **options) -> bytes:
+    """Encrypt an in-memory image; `options` are those of `encrypt_stream`."""
+    dst = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), dst, password, size=len(data), **options)
+    return dst.getvalue()
+
+
+def encrypt_image(input_path: str, output_path: str, password: str,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, threads: int = 1,
+                  session: Optional[KeySession] = None, envelope: bool = False,
+                  preview_size: Optional[int] = None, progress: Optional[ProgressCallback] = None,
+                  cancel: Optional[threading.Event] = None, compression: Optional[str] = AUTO,
+                  kdf: Optional[Kdf] = None, cipher: str = AUTO_CIPHER):
+    """Encrypt an image into a chunked AEAD container.
+
+    With a `session`, the file key is an HKDF subkey of the session master key
+    instead of a fresh `kdf` derivation from `password`. With `envelope`, a
+    random data key encrypts the image and `password` only wraps that key, so
+    the password can later be changed with `rekey_image`. With `preview_size`,
+    a thumbnail of at most that many pixels per side is stored for `decrypt_preview`.
+    `compression`, `kdf` and `cipher` are as in `encrypt_stream`; `auto`
+    compression skips TIFFs that are already compressed internally.
+
+    `progress` is called after every chunk; setting `cancel` stops the run with
+    `OperationCancelled` and leaves no output file behind.
+    """
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
 
-    with open(input_path, 'rb') as f:
-        encrypted_data = f.read()
+    preview = _timed(STAGE_PREVIEW, None, make_preview, input_path, preview_size) if preview_size else None
+    with open(input_path, 'rb') as src, atomic_output(output_path) as dst:
+        # Detect with the extension as a hint (TIFF-based raw files, text formats)
+        image_format = detect_format(sniff_stream(src), os.path.splitext(input_path)[1])
+        if compression == AUTO and image_format == 'TIFF' and _tiff_compressed(input_path):
+            compression = None
+        encrypt_stream(src, dst, password, chunk_size, threads, session, envelope, preview,
+                       progress, cancel, os.path.getsize(input_path), image_format, compression, kdf, cipher)
+
+
+def _container_key(fields: List[Tuple[int, bytes]], password: str, session: Optional[KeySession]) -> bytes:
+    """Recover the payload key from the header's key slots or KDF fields."""
+    slots = [value for tag, value in fields if tag == FIELD_SLOT]
+    nonce_prefix = get_field(fields, FIELD_NONCE_PREFIX)
+    if not slots:
+        key = _source_key(get_field(fields, FIELD_KDF), dict(fields).get(FIELD_SUBKEY), password, session)
+        try:
+            _payload_cipher(fields).factory(key).decrypt(check_nonce(nonce_prefix), get_field(fields, FIELD_CHECK),
+                                                         _slot_aad(nonce_prefix))
+        except InvalidTag as e:
+            raise WrongPasswordError("Decryption failed. Incorrect password.") from e
+        return key
+
+    for slot in slots:
+        data_key = _open_slot(slot, nonce_prefix, password, session)
+        if data_key is not None:
+            return data_key
+    raise WrongPasswordError("Decryption failed. Incorrect password or corrupted file.")
+
+
+def rekey_image(path: str, password: str, new_password: str, add: bool = False,
+                session: Optional[KeySession] = None, new_session: Optional[KeySession] = None,
+                kdf: Optional[Kdf] = None):
+    """Change (or with `add`, add) a password on an envelope-mode file.
 
-    # Ensure the file is large enough to contain Salt, IV, Tag, and Ciphertext
-    if len(encrypted_data) < 44:
+    Only the header is rewritten, in place while the reserved slot space lasts.
+    The new slot uses `kdf` (or `new_session`'s KDF), so re-keying can also
+    move a file to a stronger KDF.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Input file '{path}' does not exist.")
+
+    with open(path, 'r+b') as f:
+        if not is_encrypted_container(f):
+            raise ValueError("File was not encrypted in envelope mode; re-encrypt it to change the password.")
+        fields = read_header(f)
+        header_size = f.tell()
+        nonce_prefix = get_field(fields, FIELD_NONCE_PREFIX)
+        slots = [value for tag, value in fields if tag == FIELD_SLOT]
+        if not slots:
+            raise ValueError("File was not encrypted in envelope mode; re-encrypt it to change the password.")
+
+        for opened, slot in enumerate(slots):
+            data_key = _open_slot(slot, nonce_prefix, password, session)
+            if data_key is not None:
+                break
+        else:
+            raise WrongPasswordError("Incorrect password or corrupted file.")
+
+        new_slot = _new_slot(data_key, nonce_prefix, new_password, new_session, kdf)
+        if add:
+            slots.append(new_slot)
+        else:
+            slots[opened] = new_slot
+        fields = [(tag, value) for tag, value in fields if tag != FIELD_SLOT]
+        fields += [(FIELD_SLOT, slot) for slot in slots]
+
+        header = pack_header(fields)
+        if len(header) <= header_size:
+            f.seek(0)
+            f.write(pack_header(fields, header_size - len(header)))
+            f.flush()
+            os.fsync(f.fileno())
+            return
+
+    # The slots outgrew the reserved space: rewrite once with room for more.
+    reserve = ENVELOPE_SLOTS * (_FIELD.size + len(new_slot))
+    with open(path, 'rb') as src, atomic_output(path) as dst:
+        src.seek(header_size)
+        dst.write(pack_header(fields, reserve))
+        shutil.copyfileobj(src, dst, _READ_SIZE)
+
+
+def _payload_cipher(fields: List[Tuple[int, bytes]]) -> Aead:
+    """Return the AEAD the preview and chunks were sealed with."""
+    value = dict(fields).get(FIELD_CIPHER, bytes([CIPHER_AES_GCM]))
+    if len(value) != 1:
+        raise ValueError("Invalid encrypted file header.")
+    return get_cipher(value[0])
+
+
+def _chunk_opener(fields: List[Tuple[int, bytes]], password: str, session: Optional[KeySession],
+                  key: Optional[bytes] = None) -> Tuple[int, int, Callable[[int, bytes, bool], bytes]]:
+    """Return the chunk size, the sealed preview size and a function opening sealed chunks.
+
+    Chunks of a compressed payload (see `FIELD_CODEC`) are also decompressed.
+    `key` skips the key derivation when the caller already holds the payload key.
+    """
+    chunk_size = struct.unpack('>I', get_field(fields, FIELD_CHUNK_SIZE))[0]
+    nonce_prefix = get_field(fields, FIELD_NONCE_PREFIX)
+    if len(nonce_prefix) != NONCE_PREFIX_SIZE or chunk_size <= 0:
+        raise ValueError("Invalid encrypted file header.")
+
+    aad = header_aad(fields)
+    aead = _payload_cipher(fields).factory(key or _container_key(fields, password, session))
+
+    preview = dict(fields).get(FIELD_PREVIEW)
+    preview_size = struct.unpack('>I', preview)[0] if preview is not None else 0
+    codec = _payload_codec(fields)
+
+    def open_chunk(index: int, chunk: bytes, last: bool) -> bytes:
+        if len(chunk) < TAG_SIZE:
+            raise TruncatedFileError("Encrypted file is truncated.")
+        try:
+            plaintext = _timed(STAGE_CIPHER, len(chunk), aead.decrypt, chunk_nonce(nonce_prefix, index, last),
+                               chunk, aad)
+        except InvalidTag as e:
+            raise CorruptFileError(f"Decryption failed. Chunk {index} failed authentication.") from e
+        if codec is None:
+            return plaintext
+        plaintext = decompress_chunk(codec, plaintext)
+        # Only full chunks keep the image offsets that random access relies on
+        if len(plaintext) > chunk_size or (not last and len(plaintext) != chunk_size):
+            raise ValueError("Decryption failed. Compressed data is corrupted.")
+        return plaintext
+
+    return chunk_size, preview_size, open_chunk
+
+
+def _payload_codec(fields: List[Tuple[int, bytes]]) -> Optional[Codec]:
+    """Return the codec each chunk was compressed with, if any."""
+    name = dict(fields).get(FIELD_CODEC)
+    return _metered_codec(get_codec(name.decode('ascii', 'replace')) if name is not None else None)
+
+
+def _iter_sealed(src: BinaryIO, chunk_size: int, framed: bool) -> Iterator[Tuple[bytes, bool]]:
+    """Yield the sealed chunks of a payload: length-prefixed when `framed`, fixed-size otherwise."""
+    if framed:
+        return iter_records(src, _max_record_size(chunk_size))
+    return iter_chunks(src, chunk_size + TAG_SIZE)
+
+
+def _payload_opener(src: BinaryIO, password: str, session: Optional[KeySession]
+                    ) -> Tuple[int, Callable[[int, bytes, bool], bytes], bool]:
+    """Read the header from `src`, leaving it at the first chunk.
+
+    Returns the chunk size, a function opening sealed chunks and whether the
+    chunks are length-prefixed (compressed).
+    """
+    fields = read_header(src)
+    chunk_size, preview_size, open_chunk = _chunk_opener(fields, password, session)
+    # Skip the preview section; reading (rather than seeking) also works on pipes
+    _read_exact(src, preview_size)
+    return chunk_size, open_chunk, FIELD_CODEC in dict(fields)
+
+
+def _decrypt_container(src: BinaryIO, dst: BinaryIO, password: str, threads: int,
+                       session: Optional[KeySession], advance: Callable[[int], None]):
+    """Decrypt a chunked container chunk by chunk."""
+    chunk_size, open_chunk, framed = _payload_opener(src, password, session)
+    if src.seekable():
+        advance(src.tell())
+    if framed:
+        # Decompressed chunks don't tell how much input they took, so progress follows the reads
+        for plaintext in map_chunks(open_chunk, _advancing(_iter_sealed(src, chunk_size, framed), advance,
+                                                           _LENGTH.size), threads):
+            dst.write(plaintext)
+        return
+    for plaintext in map_chunks(open_chunk, _iter_sealed(src, chunk_size, framed), threads):
+        dst.write(plaintext)
+        advance(len(plaintext) + TAG_SIZE)
+
+
+def _legacy_decryptor(header: bytes, password: str, session: Optional[KeySession]):
+    """Set up AES-GCM decryption of a legacy file from its 44-byte header."""
+    # Ensure the file is large enough to contain Salt, IV and Tag
+    if len(header) < LEGACY_HEADER_SIZE:
         raise ValueError("Invalid encrypted file format.")
 
-    # Extract Salt, IV, Tag, and Ciphertext
-    salt = encrypted_data[:16]
-    iv = encrypted_data[16:28]
-    tag = encrypted_data[28:44]
-    ciphertext = encrypted_data[44:]
+    salt = header[:16]
+    iv = header[16:28]
+    tag = header[28:44]
 
-    key = derive_key(password, salt)  # Derive decryption key
+    # Derive decryption key
+    key = session.master_key(salt, Pbkdf2()) if session else derive_key(password, salt)
 
     cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend())
-    decryptor = cipher.decryptor()
+    return cipher.decryptor()
+
+
+def _decrypt_legacy(src: BinaryIO, dst: BinaryIO, password: str, session: Optional[KeySession],
+                    advance: Optional[Callable[[int], None]] = None):
+    """Decrypt a pre-container `salt | iv | tag | ciphertext` file."""
+    decryptor = _legacy_decryptor(src.read(LEGACY_HEADER_SIZE), password, session)
 
+    # The tag only covers the whole ciphertext, so the output is only trustworthy
+    # once finalize() succeeds; file outputs are discarded by atomic_output otherwise.
     try:
-        plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-        with open(output_path, 'wb') as f:
-            f.write(plaintext)
-    except Exception as e:
+        for block in iter(lambda: src.read(_READ_SIZE), b''):
+            dst.write(_timed(STAGE_CIPHER, len(block), decryptor.update, block))
+            if advance is not None:
+                advance(len(block))
+        dst.write(decryptor.finalize())
+    except InvalidTag as e:
         raise ValueError("Decryption failed. Incorrect password or corrupted file.") from e
 
-def is_supported_image(file_path: str) -> Tuple[bool, str]:
-    """Check if the file is a supported image format."""
-    ext = os.path.splitext(file_path)[1].lower()
-    supported_extensions = [ext for formats in SUPPORTED_FORMATS.values() for ext in formats]
-    
-    if ext not in supported_extensions:
-        return False, f"Unsupported file format '{ext}'. Supported formats: {', '.join(supported_extensions)}"
-    
-    return True, ""
\ No newline at end of file
+
+class _Prepended(io.RawIOBase):
+    """Non-seekable stream that returns `head` before the rest of `src`."""
+
+    def __init__(self, head: bytes, src: BinaryIO):
+        super().__init__()
+        self._head = head
+        self._src = src
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        if self._head:
+            count = min(len(view), len(self._head))
+            view[:count] = self._head[:count]
+            self._head = self._head[count:]
+            return count
+        data = self._src.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+class StreamDecryptor:
+    """Push-style counterpart of `StreamEncryptor` for containers and legacy files.
+
+    Plaintext is returned as soon as each chunk authenticates; the key is
+    derived once the header has arrived. Legacy files carry one tag over the
+    whole image, so their plaintext is only trustworthy once `finish()` returns.
+    """
+
+    def __init__(self, password: str, session: Optional[KeySession] = None):
+        self._password = password
+        self._session = session
+        self._buffer = bytearray()
+        self._open_chunk = None
+        self._legacy = None
+        self._sealed_size = 0
+        self._max_record = 0  # Largest length-prefixed chunk, 0 for fixed-size chunks
+        self._skip = 0  # Preview bytes still to drop
+        self._index = 0
+
+    def _start(self) -> bool:
+        """Parse the header once enough of it has arrived."""
+        buffer = self._buffer
+        if len(buffer) < len(MAGIC):
+            return False
+        if buffer[:len(MAGIC)] != MAGIC:
+            if len(buffer) < LEGACY_HEADER_SIZE:
+                return False
+            self._legacy = _legacy_decryptor(bytes(buffer[:LEGACY_HEADER_SIZE]), self._password, self._session)
+            del buffer[:LEGACY_HEADER_SIZE]
+            return True
+        if len(buffer) < _PREFIX.size or len(buffer) < _PREFIX.size + _PREFIX.unpack_from(buffer)[2]:
+            return False
+
+        header = io.BytesIO(buffer)
+        fields = read_header(header)
+        chunk_size, self._skip, self._open_chunk = _chunk_opener(fields, self._password, self._session)
+        self._sealed_size = chunk_size + TAG_SIZE
+        if FIELD_CODEC in dict(fields):
+            self._max_record = _max_record_size(chunk_size)
+        del buffer[:header.tell()]
+        return True
+
+    def _span(self) -> Optional[Tuple[int, int]]:
+        """Start and end in the buffer of the next sealed chunk, or None until its length has arrived."""
+        if not self._max_record:
+            return 0, self._sealed_size
+        if len(self._buffer) < _LENGTH.size:
+            return None
+        size = _LENGTH.unpack_from(self._buffer)[0]
+        if size > self._max_record:
+            raise CorruptFileError("Invalid encrypted chunk length.")
+        return _LENGTH.size, _LENGTH.size + size
+
+    def _drain(self) -> bytes:
+        """Decrypt everything that can be released before the end of the input."""
+        buffer = self._buffer
+        if self._legacy is not None:
+            output = _timed(STAGE_CIPHER, len(buffer), self._legacy.update, bytes(buffer))
+            buffer.clear()
+            return output
+
+        skipped = min(self._skip, len(buffer))
+        del buffer[:skipped]
+        self._skip -= skipped
+        output = []
+        # Hold back a full chunk: only finish() knows which chunk is the last one
+        while not self._skip:
+            span = self._span()
+            if span is None or len(buffer) <= span[1]:
+                break
+            output.append(self._open_chunk(self._index, bytes(buffer[span[0]:span[1]]), False))
+            del buffer[:span[1]]
+            self._index += 1
+        return b''.join(output)
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer += data
+        if _metrics_sinks:
+            emit_metric(PEAK, BUFFER_STREAM, len(self._buffer))
+        if self._open_chunk is None and self._legacy is None and not self._start():
+            return b''
+        return self._drain()
+
+    def finish(self) -> bytes:
+        if self._open_chunk is None and self._legacy is None and not self._start():
+            if self._buffer[:len(MAGIC)] == MAGIC:
+                raise TruncatedFileError("Encrypted file is truncated.")
+            raise ValueError("Invalid encrypted file format.")
+
+        output = self._drain()
+        if self._legacy is not None:
+            try:
+                return output + self._legacy.finalize()
+            except InvalidTag as e:
+                raise ValueError("Decryption failed. Incorrect password or corrupted file.") from e
+        span = self._span() if not self._skip else None
+        if span is None or (self._max_record and len(self._buffer) < span[1]):
+            raise TruncatedFileError("Encrypted file is truncated.")
+        output += self._open_chunk(self._index, bytes(self._buffer[span[0]:]), True)
+        self._buffer.clear()
+        return output
+
+
+def decrypt_stream(src: BinaryIO, dst: BinaryIO, password: str, threads: int = 1,
+                   session: Optional[KeySession] = None, progress: Optional[ProgressCallback] = None,
+                   cancel: Optional[threading.Event] = None, size: int = 0):
+    """Decrypt a container (or legacy file) read from `src` into `dst`.
+
+    `src` does not need to be seekable. If an error is raised, `dst` may hold
+    partial plaintext that must not be used.
+    """
+    advance = progress_tracker(size, progress, cancel)
+    src, dst = _metered_files(src, dst)
+    if src.seekable():
+        container = is_encrypted_container(src)
+    else:
+        head = _read_exact(src, len(MAGIC))
+        container = head == MAGIC
+        src = io.BufferedReader(_Prepended(head, src), _READ_SIZE)
+
+    if container:
+        _decrypt_container(src, dst, password, threads, session, advance)
+    else:
+        advance(LEGACY_HEADER_SIZE)
+        _decrypt_legacy(src, dst, password, session, advance)
+
+
+def decrypt_bytes(data: bytes, password: str, **options) -> bytes:
+    """Decrypt an in-memory container or legacy file; `options` are those of `decrypt_stream`."""
+    dst = io.BytesIO()
+    decrypt_stream(io.BytesIO(data), dst, password, size=len(data), **options)
+    return dst.getvalue()
+
+
+def decrypt_image(input_path: str, output_path: str, password: str, threads: int = 1,
+                  session: Optional[KeySession] = None, progress: Optional[ProgressCallback] = None,
+                  cancel: Optional[threading.Event] = None):
+    """Decrypt an image (chunked container or legacy AES-GCM layout).
+
+    A `session` caches KDF results, so files sharing a salt only pay for it
+    once. `progress` and `cancel` behave as in `encrypt_image`.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
+
+    with open(input_path, 'rb') as src, atomic_output(output_path) as dst:
+        decrypt_stream(src, dst, password, threads, session, progress, cancel, os.path.getsize(input_path))
+
+
+def _verify_container(src: BinaryIO, password: str, threads: int, session: Optional[KeySession],
+                      advance: Callable[[int], None]):
+    """Authenticate the preview and every chunk of a container, discarding the plaintext.
+
+    The key slots or password check prove the password first, so any part
+    that fails afterwards is damage.
+    """
+    try:
+        fields = read_header(src)
+        key = _container_key(fields, password, session)
+        chunk_size, preview_size, open_chunk = _chunk_opener(fields, password, session, key)
+    except (WrongPasswordError, CorruptFileError):
+        raise
+    except ValueError as e:
+        raise CorruptFileError(str(e)) from e
+
+    if preview_size:
+        sealed = _read_exact(src, preview_size)
+        if len(sealed) < preview_size:
+            raise TruncatedFileError("Encrypted file is truncated.")
+        try:
+            aead = _payload_cipher(fields).factory(key)
+            _timed(STAGE_CIPHER, len(sealed), aead.decrypt,
+                   preview_nonce(get_field(fields, FIELD_NONCE_PREFIX)), sealed, header_aad(fields))
+        except InvalidTag as e:
+            raise CorruptFileError("Embedded preview failed authentication.") from e
+        advance(src.tell() if src.seekable() else preview_size)
+
+    def check(index: int, chunk: bytes, last: bool) -> Tuple[str, int]:
+        try:
+            open_chunk(index, chunk, last)
+            return 'ok', len(chunk)
+        except TruncatedFileError:
+            return 'truncated', len(chunk)
+        except ValueError:
+            pass
+        # A final chunk sealed as a middle one means the file was cut at a chunk boundary
+        if last:
+            try:
+                open_chunk(index, chunk, False)
+                return 'truncated', len(chunk)
+            except ValueError:
+                pass
+        return 'failed', len(chunk)
+
+    framed = FIELD_CODEC in dict(fields)
+    chunks = map_chunks(check, _iter_sealed(src, chunk_size, framed), threads)
+    for index, (outcome, length) in enumerate(chunks):
+        if outcome == 'truncated':
+            raise TruncatedFileError("Encrypted file is truncated.")
+        if outcome == 'failed':
+            raise CorruptFileError(f"Chunk {index} failed authentication.")
+        advance(length + (_LENGTH.size if framed else 0))
+
+
+def _verify_legacy(src: BinaryIO, password: str, session: Optional[KeySession], advance: Callable[[int], None]):
+    """Authenticate a legacy file; its single tag can't tell a wrong password from damage."""
+    try:
+        decryptor = _legacy_decryptor(src.read(LEGACY_HEADER_SIZE), password, session)
+    except ValueError as e:
+        raise CorruptFileError(str(e)) from e
+    for block in iter(lambda: src.read(_READ_SIZE), b''):
+        _timed(STAGE_CIPHER, len(block), decryptor.update, block)
+        advance(len(block))
+    try:
+        decryptor.finalize()
+    except InvalidTag as e:
+        raise WrongPasswordError("Decryption failed. Incorrect password or corrupted file.") from e
+
+
+def verify_stream(src: BinaryIO, password: str, threads: int = 1, session: Optional[KeySession] = None,
+                  progress: Optional[ProgressCallback] = None, cancel: Optional[threading.Event] = None,
+                  size: int = 0):
+    """Check every authentication tag of a container (or legacy file) read from `src`.
+
+    Nothing is decrypted to an output, so scrubbing costs one read of the
+    file. Raises `WrongPasswordError`, `TruncatedFileError` or
+    `CorruptFileError`. Legacy files have a single tag, so a damaged legacy
+    file is reported as a wrong password.
+    """
+    advance = progress_tracker(size, progress, cancel)
+    src, _ = _metered_files(src)
+    if src.seekable():
+        container = is_encrypted_container(src)
+    else:
+        head = _read_exact(src, len(MAGIC))
+        container = head == MAGIC
+        src = io.BufferedReader(_Prepended(head, src), _READ_SIZE)
+
+    if container:
+        _verify_container(src, password, threads, session, advance)
+    else:
+        advance(LEGACY_HEADER_SIZE)
+        _verify_legacy(src, password, session, advance)
+
+
+def verify_image(input_path: str, password: str, threads: int = 1, session: Optional[KeySession] = None,
+                 progress: Optional[ProgressCallback] = None, cancel: Optional[threading.Event] = None):
+    """Authenticate an encrypted image without writing its plaintext anywhere."""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
+
+    with open(input_path, 'rb') as src:
+        verify_stream(src, password, threads, session, progress, cancel, os.path.getsize(input_path))
+
+
+def read_image_format(input_path: str) -> Optional[str]:
+    """Return the image format recorded in an encrypted file's header, if any.
+
+    No password is needed; the value is authenticated (as part of the chunks'
+    associated data) only when the file is decrypted.
+    """
+    with open(input_path, 'rb') as src:
+        if not is_encrypted_container(src):
+            return None
+        image_format = dict(read_header(src)).get(FIELD_FORMAT)
+    return image_format.decode('ascii', 'replace') if image_format is not None else None
+
+
+def read_preview(input_path: str, password: str, session: Optional[KeySession] = None) -> bytes:
+    """Decrypt only the embedded preview, whatever the size of the full image."""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
+
+    with open(input_path, 'rb') as src:
+        if not is_encrypted_container(src):
+            raise ValueError("File has no embedded preview.")
+        fields = read_header(src)
+        preview = dict(fields).get(FIELD_PREVIEW)
+        if preview is None:
+            raise ValueError("File has no embedded preview.")
+        sealed = _read_exact(src, struct.unpack('>I', preview)[0])
+
+    nonce_prefix = get_field(fields, FIELD_NONCE_PREFIX)
+    aead = _payload_cipher(fields).factory(_container_key(fields, password, session))
+    try:
+        return aead.decrypt(preview_nonce(nonce_prefix), sealed, header_aad(fields))
+    except InvalidTag as e:
+        raise CorruptFileError("Decryption failed. Embedded preview failed authentication.") from e
+
+
+def decrypt_preview(input_path: str, output_path: str, password: str, session: Optional[KeySession] = None):
+    """Write the embedded preview (JPEG, or PNG for transparent images) to `output_path`."""
+    preview = read_preview(input_path, password, session)
+    with atomic_output(output_path) as dst:
+        dst.write(preview)
+
+
+class EncryptedImageReader(io.RawIOBase):
+    """Read-only, seekable view of the plaintext of an encrypted container.
+
+    Only the chunks covering the requested byte range are read, authenticated
+    and decrypted; the most recent chunk is kept so small sequential reads
+    (as done by Pillow while parsing headers) do not decrypt it twice.
+    Compressed files are indexed on open by walking their chunk lengths, and
+    their last chunk is decrypted then to learn the image size.
+    """
+
+    def __init__(self, path: str, password: str, session: Optional[KeySession] = None):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._pos = 0
+        self._cached_index = -1
+        self._cached_chunk = b''
+        try:
+            self._chunk_size, self._open_chunk, framed = _payload_opener(self._file, password, session)
+            self._payload_start = self._file.tell()
+            payload_size = self._file.seek(0, os.SEEK_END) - self._payload_start
+            # (offset, sealed size) of every length-prefixed chunk, None for fixed-size chunks
+            self._records = self._index_records(payload_size) if framed else None
+            if framed:
+                self._chunk_count = len(self._records)
+                last = self._chunk(self._chunk_count - 1)
+                self._size = (self._chunk_count - 1) * self._chunk_size + len(last)
+            else:
+                sealed_size = self._chunk_size + TAG_SIZE
+                self._chunk_count = max(1, -(-payload_size // sealed_size))
+                self._size = payload_size - self._chunk_count * TAG_SIZE
+            if self._size < 0:
+                raise TruncatedFileError("Encrypted file is truncated.")
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _index_records(self, payload_size: int) -> List[Tuple[int, int]]:
+        """Locate the length-prefixed chunks of a compressed payload, reading only their lengths."""
+        records = []
+        max_size = _max_record_size(self._chunk_size)
+        pos = self._payload_start
+        end = self._payload_start + payload_size
+        while pos < end:
+            self._file.seek(pos)
+            prefix = self._file.read(_LENGTH.size)
+            if len(prefix) < _LENGTH.size:
+                raise TruncatedFileError("Encrypted file is truncated.")
+            size = _LENGTH.unpack(prefix)[0]
+            if size > max_size:
+                raise CorruptFileError("Invalid encrypted chunk length.")
+            records.append((pos + _LENGTH.size, size))
+            pos += _LENGTH.size + size
+        if pos > end or not records:
+            raise TruncatedFileError("Encrypted file is truncated.")
+        return records
+
+    @property
+    def size(self) -> int:
+        """Size of the decrypted image in bytes."""
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        elif whence != os.SEEK_SET:
+            raise ValueError(f"Invalid whence ({whence})")
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return offset
+
+    def _chunk(self, index: int) -> bytes:
+        """Read, authenticate and decrypt chunk `index`."""
+        if index != self._cached_index:
+            if self._records is not None:
+                offset, sealed_size = self._records[index]
+            else:
+                sealed_size = self._chunk_size + TAG_SIZE
+                offset = self._payload_start + index * sealed_size
+            self._file.seek(offset)
+            sealed = self._file.read(sealed_size)
+            self._cached_chunk = self._open_chunk(index, sealed, index == self._chunk_count - 1)
+            self._cached_index = index
+        return self._cached_chunk
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self._pos < self._size:
+            index, offset = divmod(self._pos, self._chunk_size)
+            chunk = self._chunk(index)
+            count = min(len(view) - written, len(chunk) - offset)
+            view[written:written + count] = chunk[offset:offset + count]
+            written += count
+            self._pos += count
+        return written
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._cached_chunk = b''
+        super().close()
+
+
+def open_encrypted(path: str, password: str, session: Optional[KeySession] = None) -> BinaryIO:
+    """Open an encrypted image for random-access reading, e.g. `Image.open(open_encrypted(...))`.
+
+    Legacy files carry a single tag over the whole image, so they are decrypted
+    into memory up front instead.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Input file '{path}' does not exist.")
+
+    with open(path, 'rb') as f:
+        container = is_encrypted_container(f)
+    if container:
+        return EncryptedImageReader(path, password, session)
+
+    plain = io.BytesIO()
+    with open(path, 'rb') as src:
+        _decrypt_legacy(src, plain, password, session)
+    plain.seek(0)
+    return plain
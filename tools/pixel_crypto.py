@@ -0,0 +1,215 @@
+import hmac
+import json
+import os
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from tools.image_utils import SALT_SIZE, _run_kdf
+from tools.suites import Kdf, Pbkdf2, Scrypt, unpack_kdf
+
+# Pixel-domain mode: the decoded pixel array is XORed with an AES-256-CTR
+# keystream and written back as a normal PNG or TIFF of the same size, so the
+# result stays a viewable (noise-looking) image. An HMAC-SHA256 over the
+# parameters and the encrypted pixels authenticates the result; both are
+# stored in the image metadata under METADATA_KEY. The password KDF is PBKDF2
+# (`iterations`) or scrypt (`log_n`, `r`, `p`), see tools.suites.
+# The keystream is applied a block of rows at a time, but the decoded image
+# itself is held in memory whole: Pillow decodes and writes PNG/TIFF whole.
+METADATA_KEY = 'PixelShield'
+PIXEL_FORMAT_VERSION = 1
+CONTAINER_FORMATS = {'.png': 'PNG', '.tif': 'TIFF', '.tiff': 'TIFF'}
+DEFAULT_ROWS_PER_BLOCK = 256
+
+_TIFF_IMAGE_DESCRIPTION = 270
+# Modes PNG and TIFF both store losslessly (I;16 is 16-bit grayscale)
+_NATIVE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'I;16'}
+# 32-bit integer samples: TIFF keeps them, PNG would cut them to 16 bits
+_TIFF_ONLY_MODES = {'I'}
+
+
+def _check_mode(mode: str, container: str):
+    """Reject modes whose encrypted samples the output format can't store exactly."""
+    if mode in _NATIVE_MODES or (mode in _TIFF_ONLY_MODES and container == 'TIFF'):
+        return
+    if mode in _TIFF_ONLY_MODES:
+        raise ValueError(f"Pixel mode can only store '{mode}' images losslessly as TIFF.")
+    raise ValueError(f"Pixel mode does not support '{mode}' images; supported modes are "
+                     f"{', '.join(sorted(_NATIVE_MODES | _TIFF_ONLY_MODES))}. "
+                     "Convert the image first or use the default mode.")
+
+
+def _container_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in CONTAINER_FORMATS:
+        raise ValueError(f"Pixel mode writes PNG or TIFF files, not '{ext}'.")
+    return CONTAINER_FORMATS[ext]
+
+
+def _kdf_params(kdf: Kdf) -> dict:
+    """Metadata describing `kdf`; PBKDF2 keeps the layout of older files."""
+    if isinstance(kdf, Scrypt):
+        return {'kdf': Scrypt.name, 'log_n': kdf.log_n, 'r': kdf.r, 'p': kdf.p}
+    return {'kdf': 'pbkdf2-sha256', 'iterations': kdf.iterations}
+
+
+def _params_kdf(params: dict) -> Kdf:
+    """The KDF recorded in pixel-mode metadata, checked against the same limits as container headers."""
+    try:
+        if params.get('kdf') == 'pbkdf2-sha256':
+            packed = Pbkdf2(int(params['iterations'])).pack()
+        elif params.get('kdf') == Scrypt.name:
+            packed = Scrypt(int(params['log_n']), int(params['r']), int(params['p'])).pack()
+        else:
+            raise ValueError("Unsupported pixel mode parameters.")
+        return unpack_kdf(packed + bytes(SALT_SIZE))[0]
+    except (KeyError, TypeError, ValueError, struct.error) as e:
+        raise ValueError("Unsupported pixel mode parameters.") from e
+
+
+def _pixel_keys(password: str, salt: bytes, kdf: Kdf) -> Tuple[bytes, bytes]:
+    """Derive separate AES-CTR and HMAC keys from the password."""
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=64,
+        salt=None,
+        info=b'PixelShield pixel mode',
+        backend=default_backend()
+    )
+    keys = hkdf.derive(_run_kdf(kdf, password, salt))
+    return keys[:32], keys[32:]
+
+
+def _signed_params(params: dict) -> bytes:
+    """Canonical encoding of the parameters covered by the authentication tag."""
+    return json.dumps({k: v for k, v in params.items() if k != 'tag'}, sort_keys=True).encode()
+
+
+def _pixel_rows(pixels: np.ndarray) -> np.ndarray:
+    """View the pixel array as one row of bytes per image row (no copy)."""
+    return pixels.reshape(pixels.shape[0], -1).view(np.uint8)
+
+
+def _to_image(pixels: np.ndarray, mode: str) -> Image.Image:
+    """Rebuild an image from its pixel array, which must map back to `mode`."""
+    image = Image.fromarray(pixels)
+    if image.mode != mode:
+        raise ValueError(f"Pixel mode can't rebuild a '{mode}' image from its pixels.")
+    return image
+
+
+def _mac_rows(mac: hmac.HMAC, pixels: np.ndarray, rows_per_block: int):
+    rows = _pixel_rows(pixels)
+    for start in range(0, rows.shape[0], rows_per_block):
+        mac.update(rows[start:start + rows_per_block])
+
+
+def _xor_rows(pixels: np.ndarray, key: bytes, nonce: bytes, rows_per_block: int,
+              mac: Optional[hmac.HMAC] = None):
+    """XOR `pixels` in place with the AES-CTR keystream, one block of rows at a time.
+
+    Only one block of keystream exists at a time; `mac`, if given, is fed the
+    XORed rows as they are produced.
+    """
+    keystream = Cipher(algorithms.AES(key), modes.CTR(nonce), backend=default_backend()).encryptor()
+    rows = _pixel_rows(pixels)
+    for start in range(0, rows.shape[0], rows_per_block):
+        block = rows[start:start + rows_per_block]
+        stream = np.frombuffer(keystream.update(bytes(block.nbytes)), dtype=np.uint8)
+        np.bitwise_xor(block, stream.reshape(block.shape), out=block)
+        if mac is not None:
+            mac.update(block)
+
+
+def encrypt_pixels(input_path: str, output_path: str, password: str,
+                   rows_per_block: int = DEFAULT_ROWS_PER_BLOCK, kdf: Optional[Kdf] = None):
+    """Encrypt the pixels of an image, writing a PNG/TIFF of the same dimensions.
+
+    `kdf` is the password KDF (PBKDF2 by default), recorded in the metadata.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
+    container = _container_format(output_path)
+
+    with Image.open(input_path) as image:
+        source_format = image.format
+        mode = image.mode
+        _check_mode(mode, container)
+        pixels = np.array(image)
+
+    kdf = kdf or Pbkdf2()
+    salt = os.urandom(SALT_SIZE)
+    nonce = os.urandom(16)
+    params = {
+        'version': PIXEL_FORMAT_VERSION,
+        **_kdf_params(kdf),
+        'salt': salt.hex(),
+        'nonce': nonce.hex(),
+        'mode': mode,
+        'shape': list(pixels.shape),
+        'dtype': pixels.dtype.str,
+        'source_format': source_format,
+    }
+    enc_key, mac_key = _pixel_keys(password, salt, kdf)
+    mac = hmac.new(mac_key, _signed_params(params), 'sha256')
+    _xor_rows(pixels, enc_key, nonce, rows_per_block, mac)
+    params['tag'] = mac.hexdigest()
+
+    encrypted = _to_image(pixels, mode)
+    metadata = json.dumps(params, sort_keys=True)
+    if container == 'PNG':
+        info = PngImagePlugin.PngInfo()
+        info.add_text(METADATA_KEY, metadata)
+        encrypted.save(output_path, 'PNG', pnginfo=info)
+    else:
+        encrypted.save(output_path, 'TIFF', tiffinfo={_TIFF_IMAGE_DESCRIPTION: f'{METADATA_KEY}:{metadata}'})
+
+
+def _read_params(image: Image.Image) -> dict:
+    """Extract the PixelShield parameters from PNG text or the TIFF description."""
+    metadata = image.info.get(METADATA_KEY)
+    if metadata is None and hasattr(image, 'tag_v2'):
+        description = image.tag_v2.get(_TIFF_IMAGE_DESCRIPTION, '')
+        if description.startswith(METADATA_KEY + ':'):
+            metadata = description[len(METADATA_KEY) + 1:]
+    if metadata is None:
+        raise ValueError("Image was not encrypted in pixel mode.")
+    params = json.loads(metadata)
+    if params.get('version') != PIXEL_FORMAT_VERSION:
+        raise ValueError("Unsupported pixel mode parameters.")
+    return params
+
+
+def decrypt_pixels(input_path: str, output_path: str, password: str,
+                   rows_per_block: int = DEFAULT_ROWS_PER_BLOCK):
+    """Verify and decrypt a pixel-mode image; the output format follows `output_path`."""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file '{input_path}' does not exist.")
+
+    with Image.open(input_path) as image:
+        params = _read_params(image)
+        pixels = np.array(image)
+        mode = image.mode
+
+    if mode != params['mode'] or list(pixels.shape) != params['shape'] or pixels.dtype.str != params['dtype']:
+        raise ValueError("Decryption failed. Image was modified after encryption.")
+
+    enc_key, mac_key = _pixel_keys(password, bytes.fromhex(params['salt']), _params_kdf(params))
+    mac = hmac.new(mac_key, _signed_params(params), 'sha256')
+    nonce = bytes.fromhex(params['nonce'])
+
+    # Authenticate the ciphertext before releasing any plaintext
+    _mac_rows(mac, pixels, rows_per_block)
+    if not hmac.compare_digest(mac.hexdigest(), params.get('tag', '')):
+        raise ValueError("Decryption failed. Incorrect password or corrupted file.")
+
+    if mode in _TIFF_ONLY_MODES and CONTAINER_FORMATS.get(os.path.splitext(output_path)[1].lower()) != 'TIFF':
+        raise ValueError(f"Decrypted '{mode}' images can only be written losslessly as TIFF.")
+    _xor_rows(pixels, enc_key, nonce, rows_per_block)
+    _to_image(pixels, mode).save(output_path)
@@ -0,0 +1,270 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tools.image_utils import (
+    KeySession, OperationCancelled, clear_metrics_sinks, collect_metrics, encrypt_image, decrypt_image,
+    metrics_enabled, replay_metrics, verify_image,
+)
+from tools.suites import Kdf
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+MODES = ('encrypt', 'decrypt', 'verify')
+
+
+@dataclass
+class Job:
+    """One file to encrypt, decrypt or verify, as tracked by a `JobScheduler`."""
+    id: int
+    mode: str
+    input_path: str
+    output_path: str
+    password: str = field(repr=False)
+    options: dict = field(default_factory=dict)
+    size: int = 0
+    status: str = PENDING
+    done_bytes: int = 0
+    attempts: int = 0
+    error: Optional[str] = None
+    exception: Optional[BaseException] = field(default=None, repr=False)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+
+def _run(mode: str, input_path: str, output_path: str, password: str, session: KeySession,
+         options: dict, progress=None, cancel=None):
+    """Perform one job; shared by the thread and process back ends."""
+    if mode == 'verify':  # Reads only, `output_path` is unused
+        verify_image(input_path, password, session=session, progress=progress, cancel=cancel, **options)
+        return
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    run = encrypt_image if mode == 'encrypt' else decrypt_image
+    run(input_path, output_path, password, session=session, progress=progress, cancel=cancel, **options)
+
+
+# Key sessions of a worker process, one per password and KDF, so the KDF runs once per process
+_process_sessions: Dict[Tuple[str, Optional[Kdf]], KeySession] = {}
+
+
+def _run_in_process(mode: str, input_path: str, output_path: str, password: str, options: dict,
+                    with_metrics: bool = False) -> Optional[list]:
+    """Run a job in a worker process, returning its metrics events if `with_metrics` is set."""
+    kdf = options.get('kdf')
+    session = _process_sessions.get((password, kdf))
+    if session is None:
+        session = _process_sessions[password, kdf] = KeySession(password, kdf=kdf)
+    if not with_metrics:
+        _run(mode, input_path, output_path, password, session, options)
+        return None
+    with collect_metrics() as stats:
+        _run(mode, input_path, output_path, password, session, options)
+    return stats.events()
+
+
+class JobScheduler:
+    """Execution engine shared by the CLI and the GUI.
+
+    Jobs wait in a FIFO queue and are handed to a thread pool (with per-chunk
+    progress and cancellation) or a process pool (for large batches), keeping
+    at most `max_in_flight` of them in the executor. `on_update(job)` is
+    called from worker threads whenever a job changes state or makes progress.
+    Metrics of process jobs are collected in the workers (which start without
+    the parent's sinks) and replayed into the parent's sinks as jobs finish.
+    Large batches can pass `keep_finished=False` so `jobs` only holds the
+    queued and running ones.
+    """
+
+    def __init__(self, workers: Optional[int] = None, use_processes: bool = False,
+                 max_in_flight: Optional[int] = None, on_update: Optional[Callable[[Job], None]] = None,
+                 keep_finished: bool = True):
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.on_update = on_update
+        self.keep_finished = keep_finished
+        self.jobs: List[Job] = []
+
+        if use_processes:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=clear_metrics_sinks)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._queue = deque()
+        self._running: Dict[int, Future] = {}
+        self._sessions: Dict[Tuple[str, Optional[Kdf]], KeySession] = {}
+        self._lock = threading.Condition()
+        self._started: Optional[float] = None
+        self._next_id = 0
+
+    def submit(self, mode: str, input_path: str, output_path: str, password: str, **options) -> Job:
+        """Queue a file; `options` are passed on to `encrypt_image`/`decrypt_image`/`verify_image`."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}'.")
+        size = os.path.getsize(input_path) if os.path.exists(input_path) else 0
+        with self._lock:
+            job = Job(self._next_id, mode, input_path, output_path, password, options, size)
+            self._next_id += 1
+            self.jobs.append(job)
+            self._queue.append(job)
+            self._dispatch()
+        return job
+
+    def retry(self, job: Job):
+        """Queue a failed or cancelled job again."""
+        with self._lock:
+            if job.status not in (FAILED, CANCELLED):
+                return
+            if job not in self.jobs:
+                self.jobs.append(job)
+            job.status, job.done_bytes, job.error, job.exception = PENDING, 0, None, None
+            job.cancel_event.clear()
+            self._queue.append(job)
+            self._dispatch()
+        self._notify(job)
+
+    def cancel(self, job: Job):
+        """Cancel a queued job, or ask a running one to stop after its current chunk."""
+        with self._lock:
+            if job.status == PENDING and job in self._queue:
+                self._queue.remove(job)
+                self._finish(job, CANCELLED, "Operation cancelled.")
+            elif job.status == RUNNING:
+                # Thread jobs stop at the next chunk; jobs still waiting inside the executor
+                # are cancelled outright and finished by their done callback.
+                job.cancel_event.set()
+                future = self._running.get(job.id)
+                if future is not None:
+                    future.cancel()
+
+    def cancel_all(self):
+        """Cancel every queued and running job."""
+        with self._lock:
+            for job in list(self._queue) + [job for job in self.jobs if job.status == RUNNING]:
+                self.cancel(job)
+
+    def wait(self, limit: int = 0):
+        """Block until at most `limit` jobs are queued or running."""
+        with self._lock:
+            self._lock.wait_for(lambda: len(self._queue) + len(self._running) <= limit)
+
+    def throughput(self) -> float:
+        """Bytes processed per second since the first job started."""
+        with self._lock:
+            if self._started is None:
+                return 0.0
+            elapsed = time.monotonic() - self._started
+            done = sum(job.done_bytes for job in self.jobs)
+        return done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until every queued and running job is finished."""
+        rate = self.throughput()
+        with self._lock:
+            remaining = sum(job.size - job.done_bytes for job in self.jobs if job.status in (PENDING, RUNNING))
+        if not remaining:
+            return 0.0
+        return remaining / rate if rate else None
+
+    def shutdown(self, cancel: bool = False):
+        if cancel:
+            self.cancel_all()
+        self._executor.shutdown(wait=True)
+        for session in self._sessions.values():
+            session.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.shutdown(cancel=exc_type is not None)
+
+    def _session(self, password: str, kdf: Optional[Kdf] = None) -> KeySession:
+        with self._lock:
+            session = self._sessions.get((password, kdf))
+            if session is None:
+                session = self._sessions[password, kdf] = KeySession(password, kdf=kdf)
+        return session
+
+    def _dispatch(self):
+        """Move queued jobs into the executor while there is room (lock held)."""
+        while self._queue and len(self._running) < self.max_in_flight:
+            job = self._queue.popleft()
+            job.status = RUNNING
+            job.attempts += 1
+            job.started = time.monotonic()
+            if self._started is None:
+                self._started = job.started
+
+            if self.use_processes:
+                future = self._executor.submit(_run_in_process, job.mode, job.input_path,
+                                               job.output_path, job.password, job.options, metrics_enabled())
+            else:
+                future = self._executor.submit(self._run_thread_job, job)
+            self._running[job.id] = future
+            future.add_done_callback(lambda f, job=job: self._completed(job, f))
+            self._notify(job)
+
+    def _run_thread_job(self, job: Job):
+        def progress(done: int, total: int):
+            job.done_bytes = done
+            self._notify(job)
+
+        _run(job.mode, job.input_path, job.output_path, job.password, self._session(job.password, job.options.get('kdf')),
+             job.options, progress, job.cancel_event)
+
+    def _completed(self, job: Job, future: Future):
+        if not future.cancelled() and future.exception() is None and future.result():
+            replay_metrics(future.result())  # Outside the lock: sinks may be slow
+        with self._lock:
+            self._running.pop(job.id, None)
+            if future.cancelled():
+                self._finish(job, CANCELLED, "Operation cancelled.")
+            else:
+                error = future.exception()
+                if error is None:
+                    job.done_bytes = job.size
+                    self._finish(job, DONE)
+                elif isinstance(error, OperationCancelled):
+                    self._finish(job, CANCELLED, str(error))
+                else:
+                    job.exception = error
+                    self._finish(job, FAILED, str(error))
+            self._dispatch()
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        """Record the final state of a job and wake up waiters (lock held)."""
+        job.status = status
+        job.error = error
+        job.finished = time.monotonic()
+        if not self.keep_finished:
+            self.jobs.remove(job)
+        self._lock.notify_all()
+        self._notify(job)
+
+    def _notify(self, job: Job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+
+def run_job(mode: str, input_path: str, output_path: str, password: str, **options) -> Job:
+    """Run a single job on a one-worker scheduler and re-raise its error, if any."""
+    with JobScheduler(workers=1) as scheduler:
+        job = scheduler.submit(mode, input_path, output_path, password, **options)
+        scheduler.wait()
+    if job.exception is not None:
+        raise job.exception
+    if job.status == CANCELLED:
+        raise OperationCancelled(job.error or "Operation cancelled.")
+    return job
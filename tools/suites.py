@@ -0,0 +1,204 @@
+import os
+import struct
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt as _ScryptKDF
+from cryptography.hazmat.backends import default_backend
+
+# Password KDFs and AEAD ciphers a container can be written with.
+#
+# Both are identified by a byte in the header. A KDF setting is the KDF id
+# followed by its cost parameters (and, in headers, the salt), so the cost can
+# be tuned per deployment while old files keep deriving their keys with the
+# parameters they were written with. Every cipher takes a 256-bit key, a
+# 96-bit nonce and produces a 16-byte tag, so the chunk layout does not
+# depend on the choice.
+
+KDF_PBKDF2_SHA256 = 1
+KDF_SCRYPT = 2
+
+PBKDF2_ITERATIONS = 100000
+_PBKDF2_MAX_ITERATIONS = 10000000  # Headers asking for more are rejected
+SCRYPT_LOG_N = 15
+_SCRYPT_MAX_LOG_N = 20
+_SCRYPT_MAX_MEMORY = 1024 ** 3  # Headers asking scrypt for more memory are rejected
+
+CIPHER_AES_GCM = 1
+CIPHER_CHACHA20_POLY1305 = 2
+
+AUTO = 'auto'
+
+KEY_SIZE = 32
+
+
+@dataclass(frozen=True)
+class Pbkdf2:
+    """PBKDF2-HMAC-SHA256; cost grows linearly with `iterations`."""
+    iterations: int = PBKDF2_ITERATIONS
+    name = 'pbkdf2'
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt,
+                         iterations=self.iterations, backend=default_backend())
+        return kdf.derive(password.encode())
+
+    def pack(self) -> bytes:
+        return struct.pack('>BI', KDF_PBKDF2_SHA256, self.iterations)
+
+    @property
+    def cost(self) -> int:
+        return self.iterations
+
+
+@dataclass(frozen=True)
+class Scrypt:
+    """scrypt with N = 2**log_n; memory-hard, using 128 * r * N bytes."""
+    log_n: int = SCRYPT_LOG_N
+    r: int = 8
+    p: int = 1
+    name = 'scrypt'
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        kdf = _ScryptKDF(salt=salt, length=KEY_SIZE, n=2 ** self.log_n, r=self.r, p=self.p,
+                         backend=default_backend())
+        return kdf.derive(password.encode())
+
+    def pack(self) -> bytes:
+        return struct.pack('>BBBB', KDF_SCRYPT, self.log_n, self.r, self.p)
+
+    @property
+    def cost(self) -> int:
+        return self.log_n
+
+
+Kdf = Union[Pbkdf2, Scrypt]
+
+KDF_NAMES = [Pbkdf2.name, Scrypt.name]
+
+
+def make_kdf(name: str, cost: int = 0) -> Kdf:
+    """Build a KDF from its name and cost (PBKDF2 iterations or scrypt log2 N; 0 for the default)."""
+    if name == Pbkdf2.name:
+        if not 1 <= (cost or PBKDF2_ITERATIONS) <= _PBKDF2_MAX_ITERATIONS:
+            raise ValueError(f"PBKDF2 cost must be between 1 and {_PBKDF2_MAX_ITERATIONS}.")
+        return Pbkdf2(cost or PBKDF2_ITERATIONS)
+    if name == Scrypt.name:
+        if not 1 <= (cost or SCRYPT_LOG_N) <= _SCRYPT_MAX_LOG_N:
+            raise ValueError(f"scrypt cost must be between 1 and {_SCRYPT_MAX_LOG_N}.")
+        return Scrypt(cost or SCRYPT_LOG_N)
+    raise ValueError(f"Unsupported key derivation function '{name}'.")
+
+
+def unpack_kdf(value: bytes) -> Tuple[Kdf, bytes]:
+    """Split a header KDF setting into the KDF and the salt that follows it."""
+    if value[:1] == bytes([KDF_PBKDF2_SHA256]) and len(value) > 5:
+        iterations = struct.unpack('>I', value[1:5])[0]
+        if 0 < iterations <= _PBKDF2_MAX_ITERATIONS:
+            return Pbkdf2(iterations), value[5:]
+    elif value[:1] == bytes([KDF_SCRYPT]) and len(value) > 4:
+        _, log_n, r, p = struct.unpack('>BBBB', value[:4])
+        if 1 <= log_n <= _SCRYPT_MAX_LOG_N and r and 1 <= p <= 16 and 128 * r * 2 ** log_n <= _SCRYPT_MAX_MEMORY:
+            return Scrypt(log_n, r, p), value[4:]
+    raise ValueError("Unsupported key derivation settings.")
+
+
+@dataclass(frozen=True)
+class Aead:
+    """An AEAD cipher that can be recorded in the container header."""
+    id: int
+    name: str
+    factory: Callable[[bytes], Any]
+
+
+_CIPHERS: Dict[int, Aead] = {
+    CIPHER_AES_GCM: Aead(CIPHER_AES_GCM, 'aes-256-gcm', AESGCM),
+    CIPHER_CHACHA20_POLY1305: Aead(CIPHER_CHACHA20_POLY1305, 'chacha20-poly1305', ChaCha20Poly1305),
+}
+CIPHER_NAMES = [cipher.name for cipher in _CIPHERS.values()]
+
+
+def get_cipher(cipher_id: int) -> Aead:
+    cipher = _CIPHERS.get(cipher_id)
+    if cipher is None:
+        raise ValueError(f"Unsupported cipher {cipher_id}.")
+    return cipher
+
+
+def cipher_throughput(cipher: Aead, size: int = 256 * 1024, rounds: int = 4) -> float:
+    """Measure the sealing speed of `cipher` on this machine, in MB/s (best of `rounds`)."""
+    aead = cipher.factory(os.urandom(KEY_SIZE))
+    data = bytes(size)
+    nonce = bytes(12)
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        aead.encrypt(nonce, data, b'')
+        best = min(best, time.perf_counter() - start)
+    return size / (1024 * 1024) / max(best, 1e-9)
+
+
+@lru_cache(maxsize=None)
+def preferred_cipher() -> Aead:
+    """The faster AEAD on this CPU, measured once per process.
+
+    AES-GCM stays the choice unless ChaCha20-Poly1305 is clearly faster, as
+    it is on CPUs without AES instructions.
+    """
+    aes = cipher_throughput(_CIPHERS[CIPHER_AES_GCM])
+    chacha = cipher_throughput(_CIPHERS[CIPHER_CHACHA20_POLY1305])
+    return _CIPHERS[CIPHER_CHACHA20_POLY1305 if chacha > aes * 1.25 else CIPHER_AES_GCM]
+
+
+def choose_cipher(cipher: str = AUTO) -> Aead:
+    """Resolve a cipher setting (`auto` or a cipher name)."""
+    if cipher == AUTO:
+        return preferred_cipher()
+    for candidate in _CIPHERS.values():
+        if candidate.name == cipher:
+            return candidate
+    raise ValueError(f"Unsupported cipher '{cipher}'.")
+
+
+def _time_derive(kdf: Kdf) -> float:
+    start = time.perf_counter()
+    kdf.derive('calibration', bytes(16))
+    return time.perf_counter() - start
+
+
+def calibrate_kdf(name: str, target: float) -> Tuple[Kdf, float]:
+    """Pick the cost of KDF `name` whose derivation takes about `target` seconds here.
+
+    Returns the KDF and its measured latency. The cost never drops below the
+    default, so a slow machine gets a slower KDF rather than a weaker one.
+    """
+    if name == Pbkdf2.name:
+        probe = Pbkdf2(20000)
+        iterations = int(probe.iterations * target / max(_time_derive(probe), 1e-6))
+        kdf = Pbkdf2(min(max(PBKDF2_ITERATIONS, iterations // 1000 * 1000), _PBKDF2_MAX_ITERATIONS))
+        return kdf, _time_derive(kdf)
+    if name == Scrypt.name:
+        # Doubling N doubles the time, so step up until the next step would overshoot
+        kdf, latency = Scrypt(SCRYPT_LOG_N), _time_derive(Scrypt(SCRYPT_LOG_N))
+        while kdf.log_n < _SCRYPT_MAX_LOG_N and latency * 2 <= target:
+            kdf = Scrypt(kdf.log_n + 1)
+            latency = _time_derive(kdf)
+        return kdf, latency
+    raise ValueError(f"Unsupported key derivation function '{name}'.")
+
+
+def describe_kdf(kdf: Kdf) -> str:
+    if isinstance(kdf, Scrypt):
+        return f"scrypt (N=2^{kdf.log_n}, r={kdf.r}, p={kdf.p})"
+    return f"PBKDF2-SHA256 ({kdf.iterations} iterations)"
+
+
+def cipher_report() -> List[Tuple[Aead, float]]:
+    """Throughput of every cipher on this machine, fastest first."""
+    return sorted(((cipher, cipher_throughput(cipher, rounds=8)) for cipher in _CIPHERS.values()),
+                  key=lambda item: -item[1])
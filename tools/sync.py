@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from tools.batch import MANIFEST_NAME, iter_files, output_name, run_batch
+from tools.compression import AUTO
+from tools.formats import classify_many, read_format
+from tools.image_utils import atomic_output, decrypt_bytes, encrypt_bytes
+from tools.suites import AUTO as AUTO_CIPHER, Kdf
+
+# Incremental directory sync.
+#
+# The output directory holds an encrypted manifest mapping every source (by
+# its path relative to the input directory) to its size, mtime, content hash
+# and ciphertext. A run only stats unchanged files; new or modified ones are
+# sniffed and hashed, and only content the output does not already hold is
+# encrypted. Identical images share one ciphertext through hard links. The
+# manifest is written in envelope mode, so `rekey_directory` re-keys it along
+# with the images.
+MANIFEST_VERSION = 1
+
+_HASH_READ_SIZE = 1024 * 1024
+
+
+@dataclass
+class ManifestEntry:
+    """What the manifest remembers about one source image."""
+    size: int
+    mtime_ns: int
+    sha256: str
+    output: str  # Ciphertext path relative to the output directory
+
+
+@dataclass
+class SyncResult:
+    """Summary of a sync run."""
+    encrypted: int = 0
+    deduplicated: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+    failures: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def file_hash(path: str) -> str:
+    """Hex SHA-256 of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir: str, password: str) -> Dict[str, ManifestEntry]:
+    """Decrypt the manifest of `output_dir`, or return an empty one for a first run."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        manifest = json.loads(decrypt_bytes(data, password))
+    except ValueError as e:
+        raise ValueError("Sync manifest could not be decrypted. Use the password of the earlier runs.") from e
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported sync manifest version {manifest.get('version')}.")
+    return {name: ManifestEntry(**entry) for name, entry in manifest['files'].items()}
+
+
+def save_manifest(output_dir: str, password: str, files: Dict[str, ManifestEntry], kdf: Optional[Kdf] = None):
+    """Encrypt (in envelope mode, with `kdf`) and atomically replace the manifest of `output_dir`."""
+    manifest = {'version': MANIFEST_VERSION, 'files': {name: asdict(entry) for name, entry in files.items()}}
+    data = json.dumps(manifest, sort_keys=True).encode()
+    with atomic_output(os.path.join(output_dir, MANIFEST_NAME)) as f:
+        f.write(encrypt_bytes(data, password, envelope=True, compression='zlib', kdf=kdf))
+
+
+def _link_or_copy(source: str, target: str):
+    """Make `target` a hard link to `source` (a copy where links are unsupported), replacing it atomically."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.pixelshield-', suffix='.part')
+    os.close(fd)
+    try:
+        os.remove(temp_path)
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _sniff(path: str):
+    """Format of `path` (None if it is not an image), or the OSError that kept it from being read."""
+    try:
+        return read_format(path)
+    except OSError as e:
+        return e
+
+
+def _unchanged(entry: Optional[ManifestEntry], st: os.stat_result, output_dir: str) -> bool:
+    return (entry is not None and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns
+            and os.path.exists(os.path.join(output_dir, entry.output)))
+
+
+def sync_directory(input_dir: str, output_dir: str, password: str, workers: Optional[int] = None,
+                   max_in_flight: Optional[int] = None, on_done=None, envelope: bool = False,
+                   preview_size: Optional[int] = None, compression: Optional[str] = AUTO,
+                   kdf: Optional[Kdf] = None, cipher: str = AUTO_CIPHER) -> SyncResult:
+    """Bring the encrypted mirror of `input_dir` in `output_dir` up to date.
+
+    Files whose size and mtime match the manifest are skipped without being
+    read; touched files whose hash still matches only get their stat data
+    refreshed. Ciphertexts of deleted sources are removed. Failed files,
+    including ones that can't be read, keep their previous entry and
+    ciphertext, so the next run retries them.
+    """
+    if not os.path.isdir(input_dir):
+        raise FileNotFoundError(f"Input directory '{input_dir}' does not exist.")
+
+    result = SyncResult()
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_manifest(output_dir, password)
+    files: Dict[str, ManifestEntry] = {}
+
+    # Pass 1: stat everything, keep what is unchanged
+    output_root = os.path.abspath(output_dir) + os.sep
+    changed: Dict[str, Tuple[str, os.stat_result]] = {}
+
+    def keep_previous(path: str, name: str, error: Exception):
+        result.failures.append((path, str(error)))
+        if name in previous:
+            files[name] = previous[name]
+
+    for path in iter_files(input_dir, lambda p: not os.path.abspath(p).startswith(output_root)):
+        name = os.path.relpath(path, input_dir).replace(os.sep, '/')
+        try:
+            st = os.stat(path)
+        except OSError as e:  # Removed while the tree was being walked
+            keep_previous(path, name, e)
+            continue
+        if _unchanged(previous.get(name), st, output_dir):
+            files[name] = previous[name]
+            result.unchanged += 1
+        else:
+            changed[path] = (name, st)
+
+    # Ciphertexts that stay in place (or, for deleted sources, until the end) can be reused
+    seen = set(files) | {name for name, _ in changed.values()}
+    reusable = {entry.output: entry.sha256 for name, entry in previous.items()
+                if name in files or (name not in seen and os.path.exists(os.path.join(output_dir, entry.output)))}
+    by_hash = {digest: output for output, digest in reusable.items()}
+
+    # Pass 2: sniff and hash only new or modified files
+    tasks: Dict[str, Tuple[str, ManifestEntry]] = {}
+    links: List[Tuple[str, str, ManifestEntry]] = []
+    for path, image_format in classify_many(changed, sniff=_sniff):
+        name, st = changed[path]
+        if isinstance(image_format, OSError):
+            keep_previous(path, name, image_format)
+            continue
+        if image_format is None:
+            continue
+        try:
+            digest = file_hash(path)
+        except OSError as e:
+            keep_previous(path, name, e)
+            continue
+        old = previous.get(name)
+        output = old.output if old else os.path.join(os.path.dirname(name), output_name(path, 'encrypt'))
+        entry = ManifestEntry(st.st_size, st.st_mtime_ns, digest, output.replace(os.sep, '/'))
+        if old and old.sha256 == digest and os.path.exists(os.path.join(output_dir, old.output)):
+            files[name] = entry  # Touched, not modified
+            result.unchanged += 1
+        elif digest in by_hash:
+            links.append((path, by_hash[digest], entry))
+        else:
+            by_hash[digest] = entry.output
+            tasks[path] = (name, entry)
+
+    def on_encrypted(task, error):
+        name, entry = tasks[task[0]]
+        if error is None:
+            files[name] = entry
+            result.encrypted += 1
+        elif name in previous:
+            files[name] = previous[name]
+        if on_done:
+            on_done(task, error)
+
+    if tasks:  # A run without changes never starts the worker pool
+        batch = run_batch('encrypt', [(path, os.path.join(output_dir, entry.output)) for path, (_, entry) in tasks.items()],
+                          password, workers, max_in_flight, on_encrypted,
+                          envelope=envelope, preview_size=preview_size, compression=compression,
+                          kdf=kdf, cipher=cipher)
+        result.bytes = batch.bytes
+        result.failures.extend(batch.failures)
+
+    # Duplicates point at a ciphertext of the same content instead of being encrypted again
+    reusable.update((entry.output, entry.sha256) for entry in files.values())
+    for path, source, entry in links:
+        name = changed[path][0]
+        try:
+            if reusable.get(source) != entry.sha256:
+                raise ValueError("The identical image it duplicates failed to encrypt.")
+            _link_or_copy(os.path.join(output_dir, source), os.path.join(output_dir, entry.output))
+            files[name] = entry
+            result.deduplicated += 1
+            error = None
+        except Exception as e:
+            if name in previous:
+                files[name] = previous[name]
+            result.failures.append((path, str(e)))
+            error = e
+        if on_done:
+            on_done((path, os.path.join(output_dir, entry.output)), error)
+
+    # Sources that are gone (or no longer images) lose their ciphertext
+    kept = {entry.output for entry in files.values()}
+    for name, entry in previous.items():
+        if name not in files and entry.output not in kept:
+            try:
+                os.remove(os.path.join(output_dir, entry.output))
+            except FileNotFoundError:
+                pass
+            result.removed += 1
+
+    save_manifest(output_dir, password, files, kdf)
+    result.elapsed = time.perf_counter() - start
+    return result